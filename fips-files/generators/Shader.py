@@ -2,11 +2,12 @@
 Code generator for shader libraries.
 '''
 
-Version = 49
+Version = 51
 
-import os, platform, json
+import os, sys, platform, json, subprocess
+from collections import OrderedDict
 import genutil as util
-from util import glslcompiler, shdc
+from util import glslcompiler, shdc, runner, sizereport, diagnostics, manifest, scratch, profiler
 from mod import log
 import zlib # only for crc32
 
@@ -79,6 +80,20 @@ attrOryolType = {
     'vec4':  'Oryol::VertexFormat::Float4'
 }
 
+attrCType = {
+    'float': 'float',
+    'vec2':  'glm::vec2',
+    'vec3':  'glm::vec3',
+    'vec4':  'glm::vec4'
+}
+
+attrCSize = {
+    'float': 4,
+    'vec2':  8,
+    'vec3':  12,
+    'vec4':  16
+}
+
 attrOryolName = {
     'position':  'Oryol::VertexAttr::Position',
     'normal':    'Oryol::VertexAttr::Normal',
@@ -348,12 +363,14 @@ class ShaderLibrary :
     '''
     def __init__(self, inputs) :
         self.sources = inputs
-        self.blocks = {}
+        # ordered by definition, so that the generated code is deterministic
+        self.blocks = OrderedDict()
         self.shaders = []
-        self.vertexShaders = {}
-        self.fragmentShaders = {}
-        self.programs = {}
+        self.vertexShaders = OrderedDict()
+        self.fragmentShaders = OrderedDict()
+        self.programs = OrderedDict()
         self.current = None
+        self.basePath = None    # base path of intermediate files
 
     def parseSources(self) :
         parser = Parser(self)
@@ -429,8 +446,8 @@ class ShaderLibrary :
                 # @include statement?
                 if l.include:
                     if l.include not in self.blocks:
-                        util.setErrorLocation(incl.path, incl.lineNumber)
-                        util.fmtError("included block '{}' doesn't exist".format(incl.name))
+                        util.setErrorLocation(l.path, l.lineNumber)
+                        util.fmtError("included block '{}' doesn't exist".format(l.include))
                     for lb in self.blocks[l.include].lines:
                         lines.append(lb)
                 else:
@@ -443,24 +460,80 @@ class ShaderLibrary :
             with open(refl_path, 'r') as f:
                 shd.slReflection[sl] = json.load(f)
 
-    def compileShader(self, input, shd, base_path, slangs, args):
+    def compileShader(self, input, shd, base_path, out_base_path, slangs, args, compileGLSL=True, compilePlatform=True):
+        # runs all compile steps of a shader, stops at the first failing
+        # step and returns its errors and warnings (see util/diagnostics.py)
+        # and the source lines for the error listing as (errors, warnings, lines)
+        # intermediate files go to base_path, the bytecode headers
+        # which are included by the generated source to out_base_path,
+        # with compilePlatform=False only the GLSL reference compiler and
+        # oryol-shdc run, not the Metal and HLSL compilers
         shd_type = shd.getTag()
         shd_base_path = base_path + '_' + shd.name
-        glslcompiler.compile(shd.generatedSource, shd_type, shd_base_path, slangs[0], args)
-        shdc.compile(input, shd_base_path, slangs)
-        self.loadReflection(shd, shd_base_path, slangs)
-        if 'metal' in slangs:
-            c_name = '{}_{}_metallib'.format(shd.name, shd_type)
-            metalcompiler.compile(shd.generatedSource, shd_base_path, c_name, args)
-        if 'hlsl' in slangs:
-            c_name = '{}_{}_hlsl5'.format(shd.name, shd_type)
-            hlslcompiler.compile(shd.generatedSource, shd_base_path, shd_type, c_name, args)
+        shd_out_base_path = out_base_path + '_' + shd.name
+        with profiler.scope('compile ' + shd.name, shader=shd.name):
+            if compileGLSL:
+                unit = glslcompiler.Unit(shd.generatedSource, shd_type, shd_base_path, slangs[0])
+                errors = glslcompiler.compileUnit(unit)
+                if errors:
+                    return errors, [], unit.lines
+            errors, warnings = shdc.compileErrors(input, shd_base_path, slangs)
+            if errors:
+                return errors, warnings, []
+            with profiler.scope('reflection', shader=shd.name):
+                self.loadReflection(shd, shd_base_path, slangs)
+            if compilePlatform and 'metal' in slangs:
+                c_name = '{}_{}_metallib'.format(shd.name, shd_type)
+                errors, metal_warnings = metalcompiler.compileErrors(shd.generatedSource, shd_base_path, shd_out_base_path + '.metallib.h', c_name, args)
+                warnings += metal_warnings
+                if errors:
+                    return errors, warnings, shd.generatedSource
+            if compilePlatform and 'hlsl' in slangs:
+                c_name = '{}_{}_hlsl5'.format(shd.name, shd_type)
+                errors, hlsl_warnings = hlslcompiler.compileErrors(shd.generatedSource, shd_base_path, shd_out_base_path + '.hlsl.h', shd_type, c_name, args)
+                warnings += hlsl_warnings
+                if errors:
+                    return errors, warnings, shd.generatedSource
+        return [], warnings, []
+
+    def batchUnits(self, base_path, slang):
+        # order the shaders by program, so that the vertex and fragment
+        # shader of a program end up in the same compiler invocation
+        shaders = []
+        for prog in self.programs.values():
+            for shd in [self.vertexShaders.get(prog.vs), self.fragmentShaders.get(prog.fs)]:
+                if shd is not None and shd not in shaders:
+                    shaders.append(shd)
+        for shd in self.shaders:
+            if shd not in shaders:
+                shaders.append(shd)
+        return [glslcompiler.Unit(shd.generatedSource, shd.getTag(), base_path + '_' + shd.name, slang) for shd in shaders]
 
     def compile(self, input, out_hdr, slangs, args) :
         log.info('## shader code gen: {}'.format(input)) 
-        base_path = os.path.splitext(out_hdr)[0]
-        for shd in self.shaders:
-            self.compileShader(input, shd, base_path, slangs, args)
+        self.basePath = scratch.basePath(out_hdr)
+        out_base_path = os.path.splitext(out_hdr)[0]
+        batch = os.environ.get('ORYOL_SHADER_BATCH') == '1'
+        if batch:
+            units = self.batchUnits(self.basePath, slangs[0])
+            with profiler.scope('compile batch', units=len(units)):
+                glslcompiler.compileBatch(units, os.path.dirname(self.basePath), args)
+        if os.environ.get('ORYOL_SHADER_KEEP_GOING') == '1':
+            # compile all shaders concurrently, report the errors of all
+            # failed shaders in definition order and fail once at the end
+            jobs = [runner.submitCall(self.compileShader, input, shd, self.basePath, out_base_path, slangs, args, not batch) for shd in self.shaders]
+            hasError = False
+            for job in jobs:
+                errors, warnings, lines = job.result()
+                if diagnostics.report(errors, warnings, lines, input):
+                    hasError = True
+            if hasError:
+                sys.exit(10)
+        else:
+            for shd in self.shaders:
+                errors, warnings, lines = self.compileShader(input, shd, self.basePath, out_base_path, slangs, args, not batch)
+                if diagnostics.report(errors, warnings, lines, input):
+                    sys.exit(10)
 
 #-------------------------------------------------------------------------------
 def writeHeaderTop(f, shdLib) :
@@ -469,6 +542,7 @@ def writeHeaderTop(f, shdLib) :
     f.write('/*  #version:{}#\n'.format(Version))
     f.write('    machine generated, do not edit!\n')
     f.write('*/\n')
+    f.write('#include <cstddef>\n')
     f.write('#include "Gfx/GfxTypes.h"\n')
     f.write('#include "glm/vec2.hpp"\n')
     f.write('#include "glm/vec3.hpp"\n')
@@ -494,9 +568,32 @@ def getUniformBlockTypeHash(ub_refl):
 def roundup(val, round_to):
     return (val + (round_to - 1)) & ~(round_to - 1)
 
+#-------------------------------------------------------------------------------
+def writeVertexStruct(f, vs, slang) :
+    # writes a packed C++ struct matching the vertex shader input
+    # signature, the members are in the same order and have the
+    # same formats as the VertexLayout from writeInputVertexLayout(),
+    # so that vertex data can be written directly through the struct
+    inputs = vs.slReflection[slang]['inputs']
+    if len(inputs) == 0:
+        return
+    f.write('    #pragma pack(push,1)\n')
+    f.write('    struct Vertex {\n')
+    for inp in inputs:
+        f.write('        {} {};\n'.format(attrCType[inp['type']], inp['name']))
+    f.write('    };\n')
+    f.write('    #pragma pack(pop)\n')
+    offset = 0
+    for inp in inputs:
+        f.write('    static_assert(offsetof(Vertex, {}) == {}, "{}: vertex attribute offset mismatch");\n'.format(
+            inp['name'], offset, inp['name']))
+        offset += attrCSize[inp['type']]
+    f.write('    static_assert(sizeof(Vertex) == {}, "vertex stride mismatch");\n'.format(offset))
+
 #-------------------------------------------------------------------------------
 def writeProgramHeader(f, shdLib, prog, slang) :
     f.write('namespace ' + prog.name + ' {\n')
+    writeVertexStruct(f, shdLib.vertexShaders[prog.vs], slang)
     for stage in ['VS', 'FS']:
         shd = shdLib.vertexShaders[prog.vs] if stage == 'VS' else shdLib.fragmentShaders[prog.fs]
         refl = shd.slReflection[slang]
@@ -557,7 +654,8 @@ def writeSourceBottom(f, shdLib) :
 
 #-------------------------------------------------------------------------------
 def writeShaderSource(f, absPath, shdLib, shd, slVersion) :
-    base_path = os.path.splitext(absPath)[0] + '_' + shd.name
+    base_path = shdLib.basePath + '_' + shd.name
+    out_base_path = os.path.splitext(absPath)[0] + '_' + shd.name
     if isGLSL(slVersion):
         # GLSL source code is directly inlined for runtime-compilation
         f.write('static const char* {}_{}_src = \n'.format(shd.name, slVersion))
@@ -573,27 +671,27 @@ def writeShaderSource(f, absPath, shdLib, shd, slVersion) :
         # human-readable version
         f.write('/*\n')
         hlsl_src_path = base_path + '.hlsl'
-        hlsl_bin_path = base_path + '.hlsl.h'
+        hlsl_bin_path = out_base_path + '.hlsl.h'
         with open(hlsl_src_path, 'r') as rf:
             lines = rf.read().splitlines()
             for line in lines:
                 line = line.replace('/*', '__').replace('*/', '__')
                 f.write('"{}\\n"\n'.format(line))
         f.write('*/\n')
-        f.write('#include "{}"\n'.format(hlsl_bin_path))
+        f.write('#include "{}"\n'.format(os.path.basename(hlsl_bin_path)))
     elif isMetal(slVersion):
         # for Metal, the shader has been compiled into a binary shader
         # library file, which needs to be embedded into the C header
         f.write('/*\n')
         metal_src_path = base_path + '.metal'
-        metal_bin_path = base_path + '.metallib.h'
+        metal_bin_path = out_base_path + '.metallib.h'
         with open(metal_src_path, 'r') as rf:
             lines = rf.read().splitlines()
             for line in lines:
                 line = line.replace('/*', '__').replace('*/', '__')
                 f.write('"{}\\n"\n'.format(line))
         f.write('*/\n')
-        f.write('#include "{}"\n'.format(metal_bin_path))
+        f.write('#include "{}"\n'.format(os.path.basename(metal_bin_path)))
     else :
         util.fmtError("Invalid shader language id")
 
@@ -670,13 +768,155 @@ def generateSource(absSourcePath, shdLib, slangs) :
     f.close()
 
 #-------------------------------------------------------------------------------
-def generate(input, out_src, out_hdr, args) :
-    if util.isDirty(Version, [input], [out_src, out_hdr]) :
-        slangs = slVersions[args['slang']]
-        shaderLibrary = ShaderLibrary([input])
+def writeSizeReport(out_src, out_hdr, shdLib, slangs) :
+    # writes the sizes of the embedded shader sources, bytecode and
+    # uniform block structs into a JSON file next to the generated header
+    base_path = shdLib.basePath
+    out_base_path = os.path.splitext(out_src)[0]
+    sources = {}
+    bytecode = {}
+    embedded = 0
+    for slang in slangs :
+        sources[slang] = {}
+        for shd in shdLib.shaders :
+            shd_base_path = base_path + '_' + shd.name
+            shd_out_base_path = out_base_path + '_' + shd.name
+            size = sizereport.fileSize('{}.{}'.format(shd_base_path, slang))
+            sources[slang][shd.name] = size
+            if isGLSL(slang) :
+                # GLSL sources are embedded as strings
+                embedded += size
+            else :
+                # HLSL and Metal sources are only embedded as comments
+                if isHLSL(slang) :
+                    bc_size = sizereport.hlslByteCodeSize(shd_out_base_path + '.hlsl.h')
+                else :
+                    bc_size = sizereport.fileSize(shd_base_path + '.metallib')
+                bytecode.setdefault(slang, {})[shd.name] = bc_size
+                embedded += bc_size
+    uniformBlocks = {}
+    for prog in shdLib.programs.values() :
+        for shd in [shdLib.vertexShaders[prog.vs], shdLib.fragmentShaders[prog.fs]] :
+            for ub in shd.slReflection[slangs[0]]['uniform_blocks'] :
+                ub_size = ub['size']
+                if 'glsl' in slangs[0] :
+                    ub_size = roundup(ub_size, 16)
+                uniformBlocks['{}::{}'.format(prog.name, ub['type'])] = ub_size
+    report = {
+        'embedded': embedded,
+        'sources': sources,
+        'bytecode': bytecode,
+        'uniform_blocks': uniformBlocks
+    }
+    sizereport.write(out_src, out_hdr, 'Shader', Version, report)
+
+#-------------------------------------------------------------------------------
+def generateLibrary(input, out_src, out_hdr, args) :
+    slangs = slVersions[args['slang']]
+    shaderLibrary = ShaderLibrary([input])
+    with profiler.scope('parse') :
         shaderLibrary.parseSources()
+    with profiler.scope('expand') :
         shaderLibrary.generateShaderSources()
+    with profiler.scope('compile') :
         shaderLibrary.compile(input, out_hdr, slangs, args)
+    with profiler.scope('validate') :
         shaderLibrary.validate(slangs)
+    with profiler.scope('emit') :
         generateSource(out_src, shaderLibrary, slangs)
         generateHeader(out_hdr, shaderLibrary, slangs)
+        writeSizeReport(out_src, out_hdr, shaderLibrary, slangs)
+    scratch.release(shaderLibrary.basePath)
+
+#-------------------------------------------------------------------------------
+# python script which runs generateLibrary() in a separate process
+SelfCheckScript = """
+import sys, json
+args = json.loads(sys.argv[1])
+sys.path[:0] = args['paths']
+import genutil, Shader
+genutil.Env = args['env']
+Shader.generateLibrary(args['input'], args['out_src'], args['out_hdr'], args['args'])
+"""
+
+def selfCheck(input, out_src, out_hdr, args) :
+    '''
+    Generate the shader library a second time in a separate python 
+    process with a different hash seed and check that the output
+    is byte-for-byte identical. Enabled by setting the environment
+    variable ORYOL_SHADER_SELFCHECK=1.
+    '''
+    out_paths = [out_src, out_hdr, sizereport.reportPath(out_hdr)]
+    first = []
+    for path in out_paths :
+        with open(path, 'rb') as f :
+            first.append(f.read())
+    script_args = {
+        'paths': [
+            os.path.dirname(os.path.abspath(util.__file__)),
+            os.path.dirname(os.path.abspath(__file__)),
+            os.path.dirname(os.path.dirname(os.path.abspath(log.__file__)))
+        ],
+        'env': getattr(util, 'Env', {}),
+        'input': input,
+        'out_src': out_src,
+        'out_hdr': out_hdr,
+        'args': args
+    }
+    env = dict(os.environ)
+    env['PYTHONHASHSEED'] = '2' if env.get('PYTHONHASHSEED') == '1' else '1'
+    # the second run must not overwrite the trace of this process
+    env.pop('ORYOL_GEN_PROFILE', None)
+    env.pop('ORYOL_GEN_CPROFILE', None)
+    res = subprocess.call([sys.executable, '-c', SelfCheckScript, json.dumps(script_args)], env=env)
+    util.setErrorLocation(input, 0)
+    if res != 0 :
+        util.fmtError('shader generator self-check run failed')
+    for path, content in zip(out_paths, first) :
+        with open(path, 'rb') as f :
+            if f.read() != content :
+                util.fmtError("generated file '{}' is not deterministic".format(os.path.basename(path)), False)
+                res = 10
+    if res != 0 :
+        sys.exit(res)
+
+#-------------------------------------------------------------------------------
+def generate(input, out_src, out_hdr, args) :
+    tools = [glslcompiler.getToolPath(), shdc.getToolPath()]
+    if args['slang'] == 'HLSL' :
+        tools.append(hlslcompiler.findFxc())
+    with profiler.scope('Shader.generate', 'generator', input=input) :
+        with profiler.scope('dirty check') :
+            deps = manifest.Manifest(Version, [input], [out_src, out_hdr], args, tools)
+            dirty = deps.isDirty()
+        if dirty :
+            generateLibrary(input, out_src, out_hdr, args)
+            if os.environ.get('ORYOL_SHADER_SELFCHECK') == '1' :
+                with profiler.scope('self-check') :
+                    selfCheck(input, out_src, out_hdr, args)
+            deps.write()
+
+#-------------------------------------------------------------------------------
+def check(input, args, work_dir) :
+    '''
+    Check-only version of generate() for editor integration: runs the
+    parser, block expansion, a single GLSL reference compiler pass per
+    shader and validation, and returns the errors and warnings of all
+    shaders as a list of diagnostics (see util/diagnostics.py) mapped
+    to the original source lines. Intermediate files are written to 'work_dir',
+    no output files are generated.
+    '''
+    slangs = slVersions[args['slang']][:1]
+    base_path = os.path.join(work_dir, os.path.splitext(os.path.basename(input))[0])
+    with diagnostics.Collector() as collector :
+        shaderLibrary = ShaderLibrary([input])
+        shaderLibrary.parseSources()
+        shaderLibrary.generateShaderSources()
+        hasError = False
+        for shd in shaderLibrary.shaders :
+            errors, warnings, lines = shaderLibrary.compileShader(input, shd, base_path, base_path, slangs, args, compilePlatform=False)
+            if diagnostics.report(errors, warnings, lines, input) :
+                hasError = True
+        if not hasError :
+            shaderLibrary.validate(slangs)
+    return collector.diagnostics
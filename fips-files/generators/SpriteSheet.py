@@ -2,7 +2,7 @@
 Code generator for sprite sheets.
 '''
 import genutil as util
-from util import png
+from util import png, sizereport, manifest, profiler
 import os
 
 Version = 7 
@@ -63,11 +63,10 @@ class SpriteSheet :
         sprite.char = char
         self.sprites.append(sprite)
 
-    def loadImage(self) :
-        pngReader = png.Reader(self.imagePath)
-        img = pngReader.asRGBA8()
-        self.imageWidth = img[0]
-        self.imageHeight = img[1]
+    def probeImage(self) :
+        info = png.probe(self.imagePath)
+        self.imageWidth = info['width']
+        self.imageHeight = info['height']
         if self.clampWidth > 0 and self.clampWidth < self.imageWidth :
             self.imageWidth = self.clampWidth
             print('Clamped image width to {}'.format(self.imageWidth))
@@ -75,6 +74,10 @@ class SpriteSheet :
             self.imageHeight = self.clampHeight
             print('Clamped image height to {}'.format(self.imageHeight))
 
+    def loadImage(self) :
+        self.probeImage()
+        pngReader = png.Reader(filename=self.imagePath, mmap=True)
+        img = pngReader.read_rgba8_packed(rows=(0, self.imageHeight), columns=(0, self.imageWidth))
         self.imagePixels = img[2]
         self.imageInfo = img[3]
 
@@ -161,17 +164,17 @@ class SpriteSheet :
         height = self.imageHeight
         numPixels = width * height
         f.write('const uint32_t Sheet::Pixels[' + str(numPixels) + '] = {\n')
-        for y,row in enumerate(self.imagePixels) :
-            if y < self.imageHeight :
-                f.write('    ')
-                for x in xrange(0, width) :
-                    offset = x * 4
-                    r = row[offset]
-                    g = row[offset + 1]
-                    b = row[offset + 2]
-                    a = row[offset + 3]
-                    f.write('0x{:02x}{:02x}{:02x}{:02x},'.format(a, b, g, r))
-                f.write('\n')
+        pixels = self.imagePixels
+        for y in xrange(0, height) :
+            f.write('    ')
+            for x in xrange(0, width) :
+                offset = (y * width + x) * 4
+                r = pixels[offset]
+                g = pixels[offset + 1]
+                b = pixels[offset + 2]
+                a = pixels[offset + 3]
+                f.write('0x{:02x}{:02x}{:02x}{:02x},'.format(a, b, g, r))
+            f.write('\n')
         f.write('};\n')
 
     def writeSpriteData(self, f) :
@@ -222,10 +225,27 @@ class SpriteSheet :
         self.writeSourceBottom(f)
         f.close()
 
+    def writeSizeReport(self) :
+        report = {
+            'embedded': self.imageWidth * self.imageHeight * 4,
+            'width': self.imageWidth,
+            'height': self.imageHeight,
+            'sprites': len(self.sprites)
+        }
+        sizereport.write(self.out_src, self.out_hdr, 'SpriteSheet', Version, report)
+
     #-------------------------------------------------------------------------------
     def generate(self) :
-        if util.isDirty(Version, [self.input, self.imagePath], [self.out_src, self.out_hdr]) :
-            self.loadImage()
-            self.genHeader(self.out_hdr)
-            self.genSource(self.out_src)
+        with profiler.scope('SpriteSheet.generate', 'generator', input=self.input) :
+            with profiler.scope('dirty check') :
+                deps = manifest.Manifest(Version, [self.input, self.imagePath], [self.out_src, self.out_hdr])
+                dirty = deps.isDirty()
+            if dirty :
+                with profiler.scope('load image', image=self.imagePath) :
+                    self.loadImage()
+                with profiler.scope('emit') :
+                    self.genHeader(self.out_hdr)
+                    self.genSource(self.out_src)
+                    self.writeSizeReport()
+                deps.write()
             
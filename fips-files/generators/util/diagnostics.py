@@ -0,0 +1,89 @@
+'''
+Collect code generator errors and warnings as structured diagnostics.
+
+The compiler wrappers in this directory return the errors and warnings
+of a tool run as lists of (srcPath, srcLineNr, msg) tuples mapped to 
+the original source location, report() outputs them through genutil.
+'''
+import sys
+import genutil as util
+try :
+    from StringIO import StringIO
+except ImportError :
+    from io import StringIO
+
+#-------------------------------------------------------------------------------
+def report(errors, warnings, lines, input=None) :
+    '''
+    Output errors and warnings in a format compatible with Xcode or 
+    VStudio, if there are errors, followed by the source listing of
+    the failed shader stage. Returns True if there were any errors.
+    Errors without a source location (srcPath is None, for instance
+    linker errors) are reported at the file of the stage's first
+    source line which has a file (generated lines like the '#version'
+    line have an empty path), or at the 'input' file.
+    '''
+    for srcPath, srcLineNr, msg in warnings :
+        util.setErrorLocation(srcPath, srcLineNr)
+        util.fmtWarning(msg)
+    for srcPath, srcLineNr, msg in errors :
+        if srcPath is None :
+            paths = [line.path for line in lines if line.path]
+            srcPath = paths[0] if paths else input
+            srcLineNr = 0
+        util.setErrorLocation(srcPath, srcLineNr)
+        util.fmtError(msg, False)
+    if errors :
+        for line in lines :
+            print(line.content)
+    return len(errors) > 0
+
+#-------------------------------------------------------------------------------
+class Collector :
+    '''
+    Context manager which captures the errors and warnings reported
+    through genutil as a list of diagnostics, instead of printing
+    them and terminating the process. Any other output written to
+    stdout while the collector is active is discarded.
+
+    Each diagnostic is a dictionary with the keys 'file', 'line'
+    (1-based), 'severity' ('error' or 'warning') and 'message'.
+    '''
+    def __init__(self) :
+        self.diagnostics = []
+        self.path = ''
+        self.lineNumber = 0
+        self.saved = None
+
+    def setErrorLocation(self, filePath, lineNumber) :
+        self.path = filePath
+        self.lineNumber = lineNumber
+
+    def add(self, severity, msg) :
+        self.diagnostics.append({
+            'file': self.path,
+            'line': self.lineNumber + 1,
+            'severity': severity,
+            'message': msg.strip()
+        })
+
+    def fmtError(self, msg, terminate=True) :
+        self.add('error', msg)
+        if terminate :
+            sys.exit(10)
+
+    def fmtWarning(self, msg) :
+        self.add('warning', msg)
+
+    def __enter__(self) :
+        self.saved = (util.setErrorLocation, util.fmtError, util.fmtWarning, sys.stdout)
+        util.setErrorLocation = self.setErrorLocation
+        util.fmtError = self.fmtError
+        util.fmtWarning = self.fmtWarning
+        sys.stdout = StringIO()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        util.setErrorLocation, util.fmtError, util.fmtWarning, sys.stdout = self.saved
+        # a fatal error terminates the checked operation, but not the process
+        return exc_type is SystemExit
@@ -2,8 +2,16 @@
 Simple python wrapper for the GLSL reference compiler.
 '''
 
-import subprocess, platform, os, sys
+import os, sys
 import genutil as util
+from util import runner, toolregistry, diagnostics
+
+# file extensions by shader stage, the GLSL reference compiler
+# deduces the shader stage from the file extension
+stageExt = {
+    'vs': 'vert',
+    'fs': 'frag'
+}
 
 #-------------------------------------------------------------------------------
 class Line :
@@ -14,19 +22,7 @@ class Line :
 
 #-------------------------------------------------------------------------------
 def getToolPath() :
-    path = os.path.dirname(os.path.abspath(__file__))
-    if platform.system() == 'Windows' :
-        path += '/../../../tools/win32/'
-    elif platform.system() == 'Darwin' :
-        path += '/../../../tools/osx/'
-    elif platform.system() == 'Linux' :
-        if os.uname()[1] == 'raspberrypi' :
-            path += '/../../../tools/raspi/'
-        else :
-            path +=  '/../../../tools/linux/'
-    else :
-        error("Unknown host system {}".format(platform.system()))
-    return path + 'glslangValidator'
+    return toolregistry.getPath('glslangValidator')
 
 #-------------------------------------------------------------------------------
 def writeFile(f, lines) :
@@ -35,38 +31,37 @@ def writeFile(f, lines) :
 
 #-------------------------------------------------------------------------------
 def call(cmd) :
-    child = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    out = ''
-    while True :
-        out += bytes.decode(child.stdout.read())
-        if child.poll() != None :
-            break
-    return out
+    res = runner.run(cmd)
+    runner.checkTimeout(res)
+    return res.output()
 
 #-------------------------------------------------------------------------------
-def parseOutput(output, lines) :
+def parseErrors(output, lines) :
     '''
-    Parse error output lines from the GLSL reference compiler,
-    map them to the original source code location and output
-    an error message compatible with Xcode or VStudio
+    Parse error output lines from the GLSL reference compiler and
+    map them to the original source code location. Returns a list
+    of (srcPath, srcLineNr, msg) tuples, srcPath is None if the 
+    location couldn't be extracted from the error message.
     '''
-    hasError = False
+    errors = []
     outLines = output.splitlines()
     for outLine in outLines :
         if outLine.startswith('ERROR: ') :
-            hasError = True
 
             # extract generated shader source column, line and message
             lineStartIndex = outLine.find(':', 9) + 1
             if lineStartIndex == 0:
+                errors.append((None, 0, outLine))
                 continue
             lineEndIndex = outLine.find(':', lineStartIndex)
             if lineEndIndex == -1 :
+                errors.append((None, 0, outLine))
                 continue
             msgStartIndex = lineEndIndex + 1
             try:
                 lineNr = int(outLine[lineStartIndex:lineEndIndex])
             except ValueError:
+                errors.append((None, 0, outLine))
                 continue
             msg = outLine[msgStartIndex:]
 
@@ -74,39 +69,146 @@ def parseOutput(output, lines) :
             lineIndex = lineNr - 1
             if lineIndex >= len(lines) :
                 lineIndex = len(lines) - 1
-            srcPath = lines[lineIndex].path
-            srcLineNr = lines[lineIndex].lineNumber
-            util.setErrorLocation(srcPath, srcLineNr)
-            util.fmtError(msg, False)
-            
-    if hasError :
-        for line in lines :
-            print(line.content)
+            errors.append((lines[lineIndex].path, lines[lineIndex].lineNumber, msg))
+    return errors
+
+#-------------------------------------------------------------------------------
+def reportErrors(errors, lines) :
+    '''
+    Output errors from parseErrors() in a format compatible with 
+    Xcode or VStudio, returns True if there were any errors.
+    '''
+    return diagnostics.report(errors, [], lines)
+
+#-------------------------------------------------------------------------------
+def parseOutput(output, lines) :
+    '''
+    Parse error output lines from the GLSL reference compiler,
+    map them to the original source code location and output
+    an error message compatible with Xcode or VStudio
+    '''
+    if reportErrors(parseErrors(output, lines), lines) :
         sys.exit(10) 
 
+#-------------------------------------------------------------------------------
+class Unit :
+    '''
+    A shader stage written to a GLSL source file for compilation.
+    '''
+    def __init__(self, lines, type, base_path, slang) :
+        # GLSL can have multiple versions, force to generic 'glsl'
+        if 'glsl' in slang:
+            slang = 'glsl'
+        self.type = type
+        self.src_path = '{}.{}.{}'.format(base_path, slang, stageExt[type])
+        self.dst_path = '{}.{}.spv'.format(base_path, slang)
+        self.lines = []
+        self.lines.append(Line('#version 330'))
+        self.lines.append(Line('#define ORYOL_GLSL ({})'.format('1' if slang=='glsl' else '0')))
+        self.lines.append(Line('#define ORYOL_MSL ({})'.format('1' if slang=='metal' else '0')))
+        self.lines.append(Line('#define ORYOL_HLSL ({})'.format('1' if slang=='hlsl' else '0')))
+        self.lines.extend(lines)
+
+    def write(self) :
+        with open(self.src_path, 'w') as f:
+            writeFile(f, self.lines)
+
+#-------------------------------------------------------------------------------
+def compileUnit(unit) :
+    '''
+    Compile a Unit to SPIR-V, returns the errors (see parseErrors()).
+    '''
+    unit.write()
+    res = runner.run([getToolPath(), '-G', '-o', unit.dst_path, unit.src_path])
+    if res.timedOut :
+        return [(unit.lines[-1].path, unit.lines[-1].lineNumber, runner.timeoutMessage(res))]
+    return parseErrors(res.output(), unit.lines)
+
 #-------------------------------------------------------------------------------
 def compile(lines, type, base_path, slang, args) :
     # compile GLSL source file to SPIR-V
-    ext = {
-        'vs': 'vert',
-        'fs': 'frag'
-    }
-    # GLSL can have multiple versions, force to generic 'glsl'
-    if 'glsl' in slang:
-        slang = 'glsl'
-    src_path = '{}.{}.{}'.format(base_path, slang, ext[type])
-    dst_path = '{}.{}.spv'.format(base_path, slang)
-    tgt_lines = []
-    tgt_lines.append(Line('#version 330'))
-    tgt_lines.append(Line('#define ORYOL_GLSL ({})'.format('1' if slang=='glsl' else '0')))
-    tgt_lines.append(Line('#define ORYOL_MSL ({})'.format('1' if slang=='metal' else '0')))
-    tgt_lines.append(Line('#define ORYOL_HLSL ({})'.format('1' if slang=='hlsl' else '0')))
-    tgt_lines.extend(lines)
-    with open(src_path, 'w') as f:
-        writeFile(f, tgt_lines)
-    cmd = [getToolPath(), '-G', '-o', dst_path, src_path]
-    output = call(cmd)
-    parseOutput(output, tgt_lines)
+    unit = Unit(lines, type, base_path, slang)
+    if reportErrors(compileUnit(unit), unit.lines) :
+        sys.exit(10)
+
+#-------------------------------------------------------------------------------
+def groupUnits(units) :
+    '''
+    Split units into groups with at most one unit per shader stage,
+    keeping the order of the units (so that the vertex and fragment
+    shader of a program which follow each other end up in the same group).
+    '''
+    groups = []
+    group = {}
+    for unit in units :
+        if unit.type in group :
+            groups.append(group)
+            group = {}
+        group[unit.type] = unit
+    if group :
+        groups.append(group)
+    return [[group[type] for type in ['vs', 'fs'] if type in group] for group in groups]
+
+#-------------------------------------------------------------------------------
+def compileBatch(units, work_dir, args) :
+    '''
+    Compile a batch of shader stages (which may come from several shader 
+    libraries) to SPIR-V with as few GLSL reference compiler invocations 
+    as the tool allows. With -G the tool links all input files of one
+    invocation and writes one <stage>.spv file per stage into the current
+    directory, so one invocation can compile one vertex and one
+    fragment shader. The invocations are run concurrently in separate
+    subdirectories of work_dir. Errors are demultiplexed to the stage
+    they belong to and mapped to the original source lines, all errors
+    of the batch are reported before terminating.
+    '''
+    for unit in units :
+        unit.write()
+    jobs = []
+    for index, group in enumerate(groupUnits(units)) :
+        cwd = os.path.join(work_dir, 'glslbatch{}'.format(index))
+        if not os.path.isdir(cwd) :
+            os.makedirs(cwd)
+        cmd = [getToolPath(), '-G'] + [os.path.abspath(unit.src_path) for unit in group]
+        jobs.append((group, cwd, runner.submit(cmd, cwd=cwd)))
+    hasError = False
+    for group, cwd, job in jobs :
+        res = job.result()
+        runner.checkTimeout(res)
+        # demultiplex the output lines by source path, lines without
+        # source path (e.g. linker errors) go to the first stage which 
+        # has errors, or the first stage of the group
+        outLines = {}
+        unowned = []
+        for outLine in res.output().splitlines() :
+            for unit in group :
+                if outLine.startswith('ERROR: {}:'.format(os.path.abspath(unit.src_path))) :
+                    outLines.setdefault(unit, []).append(outLine)
+                    break
+            else :
+                unowned.append(outLine)
+        owner = group[0]
+        for unit in group :
+            if unit in outLines :
+                owner = unit
+                break
+        outLines.setdefault(owner, []).extend(unowned)
+        for unit in group :
+            errors = parseErrors('\n'.join(outLines.get(unit, [])), unit.lines)
+            if reportErrors(errors, unit.lines) :
+                hasError = True
+    if hasError :
+        sys.exit(10)
+    # move the SPIR-V files to their expected location
+    for group, cwd, job in jobs :
+        for unit in group :
+            spv_path = os.path.join(cwd, stageExt[unit.type] + '.spv')
+            if not os.path.isfile(spv_path) :
+                util.setErrorLocation(unit.lines[-1].path, unit.lines[-1].lineNumber)
+                util.fmtError('GLSL reference compiler produced no SPIR-V output')
+            if os.path.isfile(unit.dst_path) :
+                os.remove(unit.dst_path)
+            os.rename(spv_path, unit.dst_path)
 
 #-------------------------------------------------------------------------------
 '''
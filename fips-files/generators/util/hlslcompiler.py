@@ -4,8 +4,9 @@ Python wrapper for HLSL compiler (fxc.exe)
 NOTE: this module contains Windows specific code and should
 only be imported when running on Windows.
 '''
-import subprocess, platform, os, sys
+import platform, os, sys
 import genutil as util
+from util import runner, diagnostics
 if sys.version_info[0] < 3:
     import _winreg as winreg
 else:
@@ -60,26 +61,20 @@ def findFxc() :
 #-------------------------------------------------------------------------------
 def callFxc(cmd) :
     ''' 
-    call the fxc compiler and return its output
+    call the fxc compiler and return the runner.Result
     '''
     print(cmd)
-    child = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-    out = ''
-    while True :
-        out += bytes.decode(child.stderr.read())
-        if child.poll() != None :
-            break
-    return out
+    return runner.run(cmd)
 
 #-------------------------------------------------------------------------------
-def parseOutput(output, lines) :
+def parseErrors(output, lines) :
     '''
-    Parse error output lines from FXC, 
-    map them to the original source code location and output
-    an error message compatible with Xcode or VStudio
+    Parse error output lines from FXC and map them to the original
+    source code location. Returns the errors and warnings as two lists
+    of (srcPath, srcLineNr, msg) tuples.
     '''
-    hasError = False
-    hasWarning = False
+    errors = []
+    warnings = []
     outLines = output.splitlines()
 
     for outLine in outLines :
@@ -113,22 +108,30 @@ def parseOutput(output, lines) :
         srcPath = lines[lineIndex].path
         srcLineNr = lines[lineIndex].lineNumber
         
-        # and output...
-        util.setErrorLocation(srcPath, srcLineNr)
         if 'error' in outLine :
-            hasError = True
-            util.fmtError(msg, False)
+            errors.append((srcPath, srcLineNr, msg))
         elif 'warning' in outLine :
-            hasWarning = True
-            util.fmtWarning(msg)
+            warnings.append((srcPath, srcLineNr, msg))
 
-    if hasError :
-        for line in lines :
-            print(line.content)
+    return errors, warnings
+
+#-------------------------------------------------------------------------------
+def parseOutput(output, lines) :
+    '''
+    Parse error output lines from FXC, 
+    map them to the original source code location and output
+    an error message compatible with Xcode or VStudio
+    '''
+    errors, warnings = parseErrors(output, lines)
+    if diagnostics.report(errors, warnings, lines) :
         sys.exit(10) 
 
 #-------------------------------------------------------------------------------
-def compile(lines, base_path, type, c_name, args) :
+def compileErrors(lines, base_path, out_path, type, c_name, args) :
+    '''
+    Compile a HLSL shader stage to a C header with the byte code,
+    returns the errors and warnings (see parseErrors()).
+    '''
     fxcPath = findFxc()
     if not fxcPath :
         util.fmtError("fxc.exe not found!\n")
@@ -142,7 +145,6 @@ def compile(lines, base_path, type, c_name, args) :
         'fs': 'ps_5_0'
     }
     hlsl_src_path = base_path + '.hlsl'
-    out_path = base_path + '.hlsl.h'
 
     # /Gec is backward compatibility mode
     cmd = [fxcPath, '/T', profile[type], '/Fh', out_path, '/Vn', c_name, '/Gec']
@@ -152,5 +154,13 @@ def compile(lines, base_path, type, c_name, args) :
         cmd.append('/O3')
     cmd.append(hlsl_src_path)
     
-    output = callFxc(cmd)
-    parseOutput(output, lines)
+    res = callFxc(cmd)
+    if res.timedOut :
+        return [(lines[-1].path, lines[-1].lineNumber, runner.timeoutMessage(res))], []
+    return parseErrors(res.stderr, lines)
+
+#-------------------------------------------------------------------------------
+def compile(lines, base_path, out_path, type, c_name, args) :
+    errors, warnings = compileErrors(lines, base_path, out_path, type, c_name, args)
+    if diagnostics.report(errors, warnings, lines) :
+        sys.exit(10)
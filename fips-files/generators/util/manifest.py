@@ -0,0 +1,87 @@
+'''
+Content-hash based dirty check for code generators.
+
+Instead of comparing file modification times, a hash over the
+content of all input files, the generator version, the generator
+arguments and the tool binary fingerprints (see toolregistry.py) is
+written into a sidecar manifest file next to the generated files.
+The outputs only need to be regenerated if this hash changes, or if
+an output file has been modified or deleted. This means that a git
+checkout, a restored CI cache or a 'touch' doesn't trigger a
+regeneration, but a tool upgrade does.
+'''
+import os, json, hashlib
+from util import toolregistry
+
+#-------------------------------------------------------------------------------
+def hashFile(path) :
+    '''
+    Return the SHA1 hex digest of a file's content, or None if the
+    file doesn't exist.
+    '''
+    if not path or not os.path.isfile(path) :
+        return None
+    h = hashlib.sha1()
+    with open(path, 'rb') as f :
+        while True :
+            chunk = f.read(1<<16)
+            if not chunk :
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+#-------------------------------------------------------------------------------
+class Manifest :
+    '''
+    The dirty-check state of a set of generated output files.
+    '''
+    def __init__(self, version, inputs, outputs, args=None, tools=None) :
+        self.outputs = outputs
+        self.tools = dict((os.path.basename(tool), toolregistry.fingerprintFile(tool)) for tool in (tools or []))
+        self.path = os.path.splitext(outputs[-1])[0] + '.manifest.json'
+        h = hashlib.sha1()
+        h.update(str(version).encode('utf-8'))
+        h.update(json.dumps(args, sort_keys=True).encode('utf-8'))
+        for input in inputs :
+            h.update(os.path.basename(input).encode('utf-8'))
+            h.update(str(hashFile(input)).encode('utf-8'))
+        for tool in (tools or []) :
+            h.update(str(toolregistry.fingerprintFile(tool)).encode('utf-8'))
+        self.hash = h.hexdigest()
+
+    def load(self) :
+        if os.path.isfile(self.path) :
+            try :
+                with open(self.path, 'r') as f :
+                    return json.load(f)
+            except ValueError :
+                pass
+        return None
+
+    def isDirty(self) :
+        '''
+        Return True if the outputs must be regenerated.
+        '''
+        manifest = self.load()
+        if manifest is None or manifest.get('hash') != self.hash :
+            return True
+        outputs = manifest.get('outputs', {})
+        for path in self.outputs :
+            name = os.path.basename(path)
+            if name not in outputs or hashFile(path) != outputs[name] :
+                return True
+        return False
+
+    def write(self) :
+        '''
+        Write the manifest file, call this after the outputs have been
+        generated successfully.
+        '''
+        manifest = {
+            'hash': self.hash,
+            'tools': self.tools,
+            'outputs': dict((os.path.basename(path), hashFile(path)) for path in self.outputs)
+        }
+        with open(self.path, 'w') as f :
+            json.dump(manifest, f, indent=2, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
@@ -1,8 +1,9 @@
 '''
 Python wrapper for metal shader compiler.
 '''
-import subprocess, os, sys, binascii
+import os, sys, binascii
 import genutil as util
+from util import runner, diagnostics
 
 #-------------------------------------------------------------------------------
 def writeFile(f, lines) :
@@ -21,13 +22,9 @@ def run(platform, run_cmd) :
         sdk = 'macosx'
     cmd = ['xcrun', '--sdk', sdk, '--run']
     cmd.extend(run_cmd)
-    child = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-    out = ''
-    while True :
-        out += bytes.decode(child.stderr.read())
-        if child.poll() != None :
-            break
-    return out
+    res = runner.run(cmd)
+    runner.checkTimeout(res)
+    return res.stderr
 
 #-------------------------------------------------------------------------------
 def cc(platform, in_src, out_dia, out_air) :
@@ -58,9 +55,14 @@ def link(platform, in_lib, out_bin) :
     return run(platform, cmd)
 
 #-------------------------------------------------------------------------------
-def parseOutput(output, lines) :
-    hasError = False
-    hasWarnings = False
+def parseErrors(output, lines) :
+    '''
+    Parse the output of the metal compiler and map it to the original
+    source code location. Returns the errors and warnings (including
+    notes) as two lists of (srcPath, srcLineNr, msg) tuples.
+    '''
+    errors = []
+    warnings = []
     outLines = output.splitlines()
 
     for outLine in outLines :
@@ -72,11 +74,6 @@ def parseOutput(output, lines) :
             msgType = tokens[3]
             msg = tokens[4]
 
-            if msgType == ' error':
-                hasError = True
-            if msgType == ' warning':
-                hasWarning = True
-
             # map to original location
             lineIndex = lineNr - 1
             if lineIndex >= len(lines) :
@@ -84,16 +81,12 @@ def parseOutput(output, lines) :
             srcPath = lines[lineIndex].path
             srcLineNr = lines[lineIndex].lineNumber
 
-            # and output...
-            util.setErrorLocation(srcPath, srcLineNr)
-            util.fmtError(msg, False)
+            if msgType == ' error':
+                errors.append((srcPath, srcLineNr, msg))
+            else:
+                warnings.append((srcPath, srcLineNr, msg))
 
-    if hasError :
-        for outLine in outLines :
-            print(outLine)
-        for line in lines :
-            print(line.content)
-        sys.exit(10) 
+    return errors, warnings
 
 #-------------------------------------------------------------------------------
 def writeBinHeader(in_bin, out_hdr, c_name) :
@@ -113,11 +106,14 @@ def writeBinHeader(in_bin, out_hdr, c_name) :
         out_file.write('\n};\n')
 
 #-------------------------------------------------------------------------------
-def compile(lines, base_path, c_name, args) :
-   
+def compileErrors(lines, base_path, out_path, c_name, args) :
+    '''
+    Compile a metal shader stage into a C header with the metallib 
+    binary data, returns the errors and warnings (see parseErrors()).
+    '''
     platform = util.getEnv('target_platform')
     if platform != 'ios' and platform != 'osx' :
-        return
+        return [], []
 
     # filenames
     metal_src_path = base_path + '.metal'
@@ -125,12 +121,20 @@ def compile(lines, base_path, c_name, args) :
     metal_air_path = base_path + '.air'
     metal_lib_path = base_path + '.metal-ar'
     metal_bin_path = base_path + '.metallib'
-    c_header_path  = base_path + '.metallib.h'
+    c_header_path  = out_path
 
     # compile .metal source file
     output = cc(platform, metal_src_path, metal_dia_path, metal_air_path)
-    parseOutput(output, lines)
+    errors, warnings = parseErrors(output, lines)
+    if errors :
+        return errors, warnings
     output += ar(platform, metal_air_path, metal_lib_path)
     output += link(platform, metal_lib_path, metal_bin_path)
     writeBinHeader(metal_bin_path, c_header_path, c_name)
+    return [], warnings
 
+#-------------------------------------------------------------------------------
+def compile(lines, base_path, out_path, c_name, args) :
+    errors, warnings = compileErrors(lines, base_path, out_path, c_name, args)
+    if diagnostics.report(errors, warnings, lines) :
+        sys.exit(10)
@@ -181,9 +181,20 @@ import sys
 import zlib
 # http://www.python.org/doc/2.4.4/lib/module-warnings.html
 import warnings
+import binascii
+import mmap
+
+# NumPy is optional.  When it is available it is used to speed up the
+# per-scanline work, otherwise there are (slower) fallbacks using
+# only the standard library.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array']
+__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array',
+           'probe', 'decode_many']
 
 
 # The PNG signature.
@@ -216,9 +227,13 @@ def isarray(x):
 try:  # see :pyver:old
     array.tostring
 except:
-    def tostring(row):
-        l = len(row)
-        return struct.pack('%dB' % l, *row)
+    if hasattr(array, 'tobytes'):
+        def tostring(row):
+            return row.tobytes()
+    else:
+        def tostring(row):
+            l = len(row)
+            return struct.pack('%dB' % l, *row)
 else:
     def tostring(row):
         """Convert row of bytes to string.  Expects `row` to be an
@@ -235,6 +250,239 @@ except:
     strtobytes = str
     bytestostr = str
 
+# Conversion between strings of bytes and (big-endian) integers, used
+# to operate on a whole scanline at once when numpy is not available.
+try:
+    int.from_bytes
+    def _bytestoint(x): return int.from_bytes(x, 'big')
+    def _inttobytes(v, n): return v.to_bytes(n, 'big')
+except AttributeError:
+    def _bytestoint(x): return int(binascii.hexlify(x), 16)
+    def _inttobytes(v, n): return binascii.unhexlify('%0*x' % (2*n, v))
+
+# Zero-copy views of a part of a buffer (a string, array or mmap), and
+# conversion of a view (or a string) to a string.
+try:
+    buffer
+    def _view(buf, offset, n): return buffer(buf, offset, n)
+    def _viewtobytes(v): return str(v)
+except NameError:
+    def _view(buf, offset, n): return memoryview(buf)[offset:offset+n]
+    def _viewtobytes(v):
+        if isinstance(v, memoryview):
+            return v.tobytes()
+        return v
+
+def _rowwriter(buffer):
+    """Return a function ``write(offset, data)`` which stores a string
+    of bytes at a (byte) offset in a writable buffer: a ``bytearray``,
+    ``mmap``, ``array('B')``, numpy array, ``memoryview`` (for example
+    of shared memory) or any other object supporting the buffer
+    protocol.  Returns the function and the size of the buffer in bytes.
+    """
+
+    if numpy is not None and isinstance(buffer, numpy.ndarray):
+        if not buffer.flags.c_contiguous or not buffer.flags.writeable:
+            raise ValueError("numpy array must be contiguous and writeable")
+        flat = buffer.reshape(-1).view(numpy.uint8)
+        def write(offset, data):
+            flat[offset:offset+len(data)] = numpy.frombuffer(data, numpy.uint8)
+        return write, flat.size
+    try:
+        view = memoryview(buffer)
+    except TypeError:
+        # mmap objects and arrays on Python 2 don't support memoryview,
+        # but they do support slice assignment.
+        if isarray(buffer):
+            if buffer.typecode != 'B':
+                raise TypeError("array must have typecode 'B'")
+            def write(offset, data):
+                buffer[offset:offset+len(data)] = array('B', bytes(data))
+        else:
+            def write(offset, data):
+                buffer[offset:offset+len(data)] = bytes(data)
+        return write, len(buffer)
+    if view.readonly:
+        raise TypeError("buffer is read-only")
+    if view.ndim != 1 or view.format != 'B':
+        view = view.cast('B')
+    def write(offset, data):
+        view[offset:offset+len(data)] = data
+    return write, len(view)
+
+# Masks for the byte-wise operations below, by length in bytes.
+_bytemasks = {}
+
+def _masks(n):
+    """Return the masks of the high bits and of the low 7 bits of
+    each byte, for `n` byte long integers.
+    """
+
+    if n not in _bytemasks:
+        high = _bytestoint(strtobytes('\x80' * n))
+        _bytemasks[n] = (high, high - (high >> 7))
+    return _bytemasks[n]
+
+def _addbytes(x, y, n):
+    """Add the bytes of two `n` byte long integers (as produced by
+    :func:`_bytestoint`) modulo 256 each, without carries from one byte
+    to the next.
+    """
+
+    high, low = _masks(n)
+    return ((x & low) + (y & low)) ^ ((x ^ y) & high)
+
+def _subbytes(x, y, n):
+    """Like :func:`_addbytes`, but subtract the bytes of `y` from
+    the bytes of `x`.
+    """
+
+    high, low = _masks(n)
+    return ((x | high) - (y & low)) ^ ((x ^ y ^ high) & high)
+
+def _avgbytes(x, y, n):
+    """Like :func:`_addbytes`, but compute the average (rounded down)
+    of each pair of bytes.
+    """
+
+    high, low = _masks(n)
+    return (x & y) + (((x ^ y) >> 1) & low)
+
+# Translation tables for unpacking and packing samples of less than 8
+# bits, by bit depth.
+_sampletables = {}
+
+def _sampletable(bitdepth):
+    """Return two lists of ``8//bitdepth`` translation tables (for
+    ``str.translate``) for samples of `bitdepth` bits: the first maps
+    each byte to its *k*-th sample (from the most significant bits), the
+    second maps each sample value to a byte with the value in the
+    position of the *k*-th sample.
+    """
+
+    if bitdepth not in _sampletables:
+        spb = 8 // bitdepth
+        mask = 2**bitdepth - 1
+        shifts = [bitdepth * (spb - 1 - k) for k in range(spb)]
+        _sampletables[bitdepth] = (
+          [tostring(array('B', [(b >> shift) & mask for b in range(256)]))
+           for shift in shifts],
+          [tostring(array('B', [((b & mask) << shift) & 0xff
+                                for b in range(256)]))
+           for shift in shifts])
+    return _sampletables[bitdepth]
+
+def _unpacksamples(data, bitdepth, width=None):
+    """Unpack the samples of `bitdepth` (1, 2 or 4) bits in `data` (a
+    string or array of bytes) into an array with one sample per byte.
+    If `width` is given, the data is a sequence of rows of `width`
+    samples each (padded to a whole byte), and the padding is dropped.
+    """
+
+    if isarray(data):
+        data = tostring(data)
+    spb = 8 // bitdepth
+    # The k-th sample of every byte in one go, using the 256-entry
+    # table for that sample, instead of shifting each byte.
+    out = bytearray(len(data) * spb)
+    for k, table in enumerate(_sampletable(bitdepth)[0]):
+        out[k::spb] = data.translate(table)
+    out = array('B', bytes(out))
+    if width is None:
+        return out
+    row = -(-width // spb) * spb
+    if row == width:
+        return out
+    rows = array('B')
+    for i in range(0, len(out), row):
+        rows.extend(out[i:i+width])
+    return rows
+
+def _packsamples(values, bitdepth):
+    """Pack the sample `values` (a sequence of integers of `bitdepth`
+    (1, 2 or 4) bits) into a string of bytes, padded with zero bits to a
+    whole byte.  The inverse of :func:`_unpacksamples`.
+    """
+
+    spb = 8 // bitdepth
+    values = array('B', values)
+    values.extend([0] * (-len(values) % spb))
+    values = tostring(values)
+    n = len(values) // spb
+    # The samples are in different bits of the packed bytes, so they
+    # can be combined by adding the bytes as one big integer.
+    packed = 0
+    for k, table in enumerate(_sampletable(bitdepth)[1]):
+        packed += _bytestoint(values[k::spb].translate(table) or
+                              strtobytes('\0'))
+    return _inttobytes(packed, n)
+
+def _unpack16(data):
+    """Unpack the big-endian 16-bit samples in `data` (a string or
+    array of bytes) into an ``array('H')``.
+    """
+
+    if isarray(data):
+        data = tostring(data)
+    out = array('H', data)
+    if sys.byteorder == 'little':
+        out.byteswap()
+    return out
+
+def _pack16(values):
+    """Pack the 16-bit sample `values` into a string of big-endian
+    bytes.  The inverse of :func:`_unpack16`.
+    """
+
+    values = array('H', values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return tostring(values)
+
+def _bytetable(values):
+    """Return a string of the byte `values`, for example a translation
+    table for ``str.translate``.
+    """
+
+    return tostring(array('B', values))
+
+def _transparentmasks(transparent, typecode):
+    """Return the translation tables for :func:`_opaquebytes` which
+    find the pixels with the `transparent` colour (a tuple with a
+    value for each channel) in an array with `typecode`: one for each
+    byte of a pixel, which maps the byte of the transparent colour to
+    0xff and all other bytes to 0.
+    """
+
+    lanes = len(transparent) * array(typecode).itemsize
+    try:
+        expected = bytearray(tostring(array(typecode, transparent)))
+    except OverflowError:
+        # No pixel can have this colour.
+        return [_bytetable([0] * 256)] * lanes
+    return [_bytetable([(0, 0xff)[v == e] for v in range(256)])
+            for e in expected]
+
+def _opaquebytes(row, masks):
+    """Return a string with a byte for each pixel of `row` (an array in
+    flat pixel format, or its bytes): 0 for the pixels with the
+    transparent colour of the `masks` (from :func:`_transparentmasks`),
+    and 0xff for all others.
+    """
+
+    if isarray(row):
+        row = tostring(row)
+    lanes = len(masks)
+    width = len(row) // lanes
+    # Compare all pixels at once, byte by byte: the bytes which match
+    # are translated to 0xff, and a pixel matches if all of its bytes
+    # match (ANDed as one big integer).
+    full = (1 << (8 * width)) - 1
+    same = full
+    for lane, mask in enumerate(masks):
+        same &= _bytestoint(row[lane::lanes].translate(mask))
+    return _inttobytes(same ^ full, width)
+
 def interleave_planes(ipixels, apixels, ipsize, apsize):
     """
     Interleave (colour) planes, e.g. RGB + A = RGBA.
@@ -328,7 +576,12 @@ class Writer:
                  planes=None,
                  colormap=None,
                  maxval=None,
-                 chunk_limit=2**20):
+                 chunk_limit=2**20,
+                 filter_type=None,
+                 compression_workers=None,
+                 compression_block_size=2**18,
+                 compression_strategy=None,
+                 optimize=False):
         """
         Create a PNG encoder object.
 
@@ -358,6 +611,17 @@ class Writer:
           Create an interlaced image.
         chunk_limit
           Write multiple ``IDAT`` chunks to save memory.
+        filter_type
+          Scanline filter type (0 to 4), or ``'adaptive'``.
+        compression_workers
+          Number of threads compressing the image data in parallel.
+        compression_block_size
+          Size of the blocks of image data compressed in parallel.
+        compression_strategy
+          zlib compression strategy (such as ``zlib.Z_FILTERED``).
+        optimize
+          Write the smallest PNG file found by trying lossless
+          reductions and compression settings.
 
         The image size (in pixels) can be specified either by using the
         `width` and `height` arguments, or with the single `size`
@@ -444,6 +708,40 @@ class Writer:
         `chunk_limit` is used to limit the amount of memory used whilst
         compressing the image.  In order to avoid using large amounts of
         memory, multiple ``IDAT`` chunks may be created.
+
+        `filter_type` selects the filter which is applied to each
+        scanline before compression: 0 to 4 for the PNG filter types
+        (none, sub, up, average, paeth), or ``'adaptive'`` to choose
+        the filter separately for each scanline, the one which produces
+        the smallest sum of absolute (signed) byte values (which is the
+        heuristic recommended by the PNG specification).  The default,
+        ``None``, is adaptive filtering for images with a bit depth of
+        8 or 16 which are not colour mapped, and no filtering otherwise
+        (filters rarely help for those).
+
+        If `compression_workers` is more than 1, the image data is split
+        into blocks of `compression_block_size` bytes which are
+        compressed in parallel by that many threads (zlib releases the
+        GIL while it compresses), and joined into a single zlib stream.
+        This is faster for large images, at the cost of a slightly
+        larger file (more so on Python 2, where a block can't use the
+        end of the preceding block as dictionary).
+
+        `compression_strategy` is passed to ``zlib.compressobj``;
+        ``None`` means ``zlib.Z_DEFAULT_STRATEGY``.
+
+        If `optimize` is true, the image is written (by :meth:`write`,
+        :meth:`write_array` and the convert methods) as the smallest of
+        a number of trial encodings, which are compressed in parallel
+        by `compression_workers` threads (default: the number of CPUs).
+        The trials use the lossless reductions found by
+        :meth:`reductions` (dropping an opaque alpha channel, colour to
+        greyscale, 16 to 8 bits, greyscale to fewer bits, up to 256
+        colours to a palette with a ``tRNS`` chunk), each with filter
+        types 0 and ``'adaptive'`` and the zlib settings in
+        :data:`_optimize_compression`.  The `compression` and
+        `filter_type` arguments are ignored.  This needs the entire
+        image in working memory, and is slow.
         """
 
         # At the moment the `planes` argument is ignored;
@@ -569,6 +867,14 @@ class Writer:
         if bitdepth > 8 and palette:
             raise ValueError(
                 "bit depth must be 8 or less for images with palette")
+        if filter_type is None:
+            if bitdepth < 8 or palette:
+                filter_type = 0
+            else:
+                filter_type = 'adaptive'
+        if filter_type not in (0,1,2,3,4,'adaptive'):
+            raise ValueError(
+                "filter_type must be 0, 1, 2, 3, 4 or 'adaptive'")
 
         transparent = check_color(transparent, 'transparent')
         background = check_color(background, 'background')
@@ -588,6 +894,11 @@ class Writer:
         self.compression = compression
         self.chunk_limit = chunk_limit
         self.interlace = bool(interlace)
+        self.filter_type = filter_type
+        self.compression_workers = compression_workers
+        self.compression_block_size = compression_block_size
+        self.compression_strategy = compression_strategy
+        self.optimize = bool(optimize)
         self.palette = check_palette(palette)
 
         self.color_type = 4*self.alpha + 2*(not greyscale) + 1*self.colormap
@@ -624,23 +935,22 @@ class Writer:
         should be ``self.height`` rows of ``self.width * self.planes`` values.
         If `interlace` is specified (when creating the instance), then
         an interlaced PNG file will be written.  Supply the rows in the
-        normal image order; the interlacing is carried out internally.
-        
-        .. note ::
-
-          Interlacing will require the entire image to be in working memory.
+        normal image order; the interlacing is carried out internally
+        (see :meth:`write_interlaced`).
         """
 
-        if self.interlace:
+        if self.optimize:
             fmt = 'BH'[self.bitdepth > 8]
             a = array(fmt, itertools.chain(*rows))
             return self.write_array(outfile, a)
+        if self.interlace:
+            nrows = self.write_interlaced(outfile, rows)
         else:
             nrows = self.write_passes(outfile, rows)
-            if nrows != self.height:
-                raise ValueError(
-                  "rows supplied (%d) does not match height (%d)" %
-                  (nrows, self.height))
+        if nrows != self.height:
+            raise ValueError(
+              "rows supplied (%d) does not match height (%d)" %
+              (nrows, self.height))
 
     def write_passes(self, outfile, rows, packed=False):
         """
@@ -662,6 +972,196 @@ class Writer:
 
         """
 
+        self.write_preamble(outfile)
+
+        # http://www.w3.org/TR/PNG/#11IDAT
+        level = self.compression
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        strategy = self.compression_strategy
+        if strategy is None:
+            strategy = zlib.Z_DEFAULT_STRATEGY
+        if self.compression_workers and self.compression_workers > 1:
+            compressor = _ParallelCompressor(level,
+                                             self.compression_workers,
+                                             self.compression_block_size,
+                                             strategy)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                          zlib.MAX_WBITS,
+                                          zlib.DEF_MEM_LEVEL, strategy)
+
+        # The worker threads of a parallel compressor must be stopped
+        # also if writing fails.
+        try:
+            data = array('B')
+            line = array('B')
+            extend = self.make_extend(line, packed)
+
+            # Build the first row, testing mostly to see if we need to
+            # changed the extend function to cope with NumPy integer types
+            # (they cause our ordinary definition of extend to fail, so we
+            # wrap it).  See
+            # http://code.google.com/p/pypng/issues/detail?id=44
+            enumrows = enumerate(rows)
+            del rows
+
+            # The filter offset: the size of a pixel in bytes, but at
+            # least 1.
+            fo = max(1, (self.bitdepth * self.planes) // 8)
+            # The rows which start a (reduced) pass image: these must be
+            # filtered without a previous line.
+            firstrows = self.pass_first_rows()
+
+            # :todo: Certain exceptions in the call to ``.next()`` or the
+            # following try would indicate no row data supplied.
+            # Should catch.
+            i,row = enumrows.next()
+            try:
+                # If this fails...
+                extend(row)
+            except:
+                # ... try a version that converts the values to int first.
+                # Not only does this work for the (slightly broken) NumPy
+                # types, there are probably lots of other, unknown, "nearly"
+                # int types it works for.
+                def wrapmapint(f):
+                    return lambda sl: f(map(int, sl))
+                extend = wrapmapint(extend)
+                del wrapmapint
+                extend(row)
+
+            # The previous (unfiltered) scanline, as a string.
+            prev = None
+            while True:
+                scanline = tostring(line)
+                del line[:]
+                if i in firstrows:
+                    prev = None
+                filter_type, filtered = self.filter_row(scanline, prev, fo)
+                prev = scanline
+                data.append(filter_type)
+                data.extend(array('B', filtered))
+                if len(data) > self.chunk_limit:
+                    compressed = compressor.compress(tostring(data))
+                    if len(compressed):
+                        # print >> sys.stderr, len(data), len(compressed)
+                        write_chunk(outfile, 'IDAT', compressed)
+                    del data[:]
+                try:
+                    i,row = enumrows.next()
+                except StopIteration:
+                    break
+                # Because of our very witty definition of ``extend``,
+                # above, we must re-use the same ``line`` object.  Hence
+                # we use ``del`` to empty it, rather than create a fresh
+                # one (which would be my natural FP instinct).
+                extend(row)
+            if len(data):
+                compressed = compressor.compress(tostring(data))
+            else:
+                compressed = ''
+            flushed = compressor.flush()
+            if len(compressed) or len(flushed):
+                # print >> sys.stderr, len(data), len(compressed), len(flushed)
+                write_chunk(outfile, 'IDAT', compressed + flushed)
+        finally:
+            if isinstance(compressor, _ParallelCompressor):
+                compressor.close()
+        # http://www.w3.org/TR/PNG/#11IEND
+        write_chunk(outfile, 'IEND')
+        return i+1
+
+    def write_interlaced(self, outfile, rows):
+        """
+        Write an interlaced PNG image to the output file.  `rows`
+        should be an iterable that yields each row in boxed row flat
+        pixel format, in the normal image order (like for
+        :meth:`write`).  Returns the number of rows.
+
+        The image is not kept in memory: each row is split into the
+        rows of the reduced images (the *Adam7* passes) it belongs to,
+        which are filtered and compressed right away, each pass
+        as a separate deflate stream.  Only the compressed data is kept
+        until the last row, when the passes are joined into a single
+        zlib stream.  `compression_workers` is not used.
+        """
+
+        self.write_preamble(outfile)
+
+        level = self.compression
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        strategy = self.compression_strategy
+        if strategy is None:
+            strategy = zlib.Z_DEFAULT_STRATEGY
+        fmt = 'BH'[self.bitdepth > 8]
+        fo = max(1, (self.bitdepth * self.planes) // 8)
+        line = array('B')
+        extend = self.make_extend(line)
+
+        # The passes which are not empty, and for each of them the
+        # compressor, the previous (unfiltered) scanline, the Adler-32
+        # checksum and length of the (filtered) data and the
+        # compressed data.
+        passes = [p for p in _adam7
+                  if p[0] < self.width and p[1] < self.height]
+        compressors = [zlib.compressobj(level, zlib.DEFLATED, -15,
+                                        zlib.DEF_MEM_LEVEL, strategy)
+                       for p in passes]
+        prevs = [None] * len(passes)
+        adlers = [zlib.adler32(strtobytes(''))] * len(passes)
+        lengths = [0] * len(passes)
+        outs = [[] for p in passes]
+
+        nrows = 0
+        for y, row in enumerate(rows):
+            # Converting to an array copes with NumPy integer types
+            # (see :meth:`write_passes`).
+            row = array(fmt, row)
+            for k, (xstart, ystart, xstep, ystep) in enumerate(passes):
+                if y < ystart or (y - ystart) % ystep:
+                    continue
+                extend(_adam7row(row, self.planes, xstart, xstep))
+                scanline = tostring(line)
+                del line[:]
+                filter_type, filtered = self.filter_row(scanline,
+                                                        prevs[k], fo)
+                prevs[k] = scanline
+                data = array('B', [filter_type])
+                data.extend(array('B', filtered))
+                data = tostring(data)
+                adlers[k] = zlib.adler32(data, adlers[k])
+                lengths[k] += len(data)
+                outs[k].append(compressors[k].compress(data))
+            nrows = y + 1
+        if nrows != self.height:
+            raise ValueError(
+              "rows supplied (%d) does not match height (%d)" %
+              (nrows, self.height))
+
+        # http://tools.ietf.org/html/rfc1950
+        idat = [_zlibheader(level)]
+        adler = zlib.adler32(strtobytes(''))
+        for k in range(len(passes)):
+            idat.extend(outs[k])
+            idat.append(compressors[k].flush(
+              (zlib.Z_SYNC_FLUSH, zlib.Z_FINISH)[k == len(passes) - 1]))
+            adler = _adler32combine(adler, adlers[k], lengths[k])
+        idat.append(struct.pack('!I', adler))
+        idat = strtobytes('').join(idat)
+        for i in range(0, len(idat), self.chunk_limit):
+            write_chunk(outfile, 'IDAT', idat[i:i+self.chunk_limit])
+        # http://www.w3.org/TR/PNG/#11IEND
+        write_chunk(outfile, 'IEND')
+        return nrows
+
+    def write_preamble(self, outfile):
+        """
+        Write the PNG signature and the chunks which precede the image
+        data to the output file.
+        """
+
         # http://www.w3.org/TR/PNG/#5PNG-file-signature
         outfile.write(_signature)
 
@@ -714,104 +1214,78 @@ class Writer:
                 write_chunk(outfile, 'bKGD',
                             struct.pack("!3H", *self.background))
 
-        # http://www.w3.org/TR/PNG/#11IDAT
-        if self.compression is not None:
-            compressor = zlib.compressobj(self.compression)
-        else:
-            compressor = zlib.compressobj()
+    def make_extend(self, line, packed=False):
+        """
+        Return a function which packs a row (in boxed row flat pixel
+        format, or packed when `packed` is true) into bytes, and
+        appends them to the array `line`.
+        """
 
         # Choose an extend function based on the bitdepth.  The extend
         # function packs/decomposes the pixel values into bytes and
-        # stuffs them onto the data array.
-        data = array('B')
+        # stuffs them onto the line array, which is then filtered and
+        # added to the data array.
         if self.bitdepth == 8 or packed:
-            extend = data.extend
+            extend = line.extend
         elif self.bitdepth == 16:
             # Decompose into bytes
             def extend(sl):
-                fmt = '!%dH' % len(sl)
-                data.extend(array('B', struct.pack(fmt, *sl)))
+                line.extend(array('B', _pack16(sl)))
         else:
             # Pack into bytes
             assert self.bitdepth < 8
-            # samples per byte
-            spb = int(8/self.bitdepth)
             def extend(sl):
-                a = array('B', sl)
-                # Adding padding bytes so we can group into a whole
-                # number of spb-tuples.
-                l = float(len(a))
-                extra = math.ceil(l / float(spb))*spb - l
-                a.extend([0]*int(extra))
-                # Pack into bytes
-                l = group(a, spb)
-                l = map(lambda e: reduce(lambda x,y:
-                                           (x << self.bitdepth) + y, e), l)
-                data.extend(l)
+                line.extend(array('B', _packsamples(sl, self.bitdepth)))
         if self.rescale:
             oldextend = extend
             factor = \
               float(2**self.rescale[1]-1) / float(2**self.rescale[0]-1)
             def extend(sl):
                 oldextend(map(lambda x: int(round(factor*x)), sl))
+        return extend
 
-        # Build the first row, testing mostly to see if we need to
-        # changed the extend function to cope with NumPy integer types
-        # (they cause our ordinary definition of extend to fail, so we
-        # wrap it).  See
-        # http://code.google.com/p/pypng/issues/detail?id=44
-        enumrows = enumerate(rows)
-        del rows
-
-        # First row's filter type.
-        data.append(0)
-        # :todo: Certain exceptions in the call to ``.next()`` or the
-        # following try would indicate no row data supplied.
-        # Should catch.
-        i,row = enumrows.next()
-        try:
-            # If this fails...
-            extend(row)
-        except:
-            # ... try a version that converts the values to int first.
-            # Not only does this work for the (slightly broken) NumPy
-            # types, there are probably lots of other, unknown, "nearly"
-            # int types it works for.
-            def wrapmapint(f):
-                return lambda sl: f(map(int, sl))
-            extend = wrapmapint(extend)
-            del wrapmapint
-            extend(row)
+    def pass_first_rows(self):
+        """Return the set of the indexes of the scanlines (in the order
+        they are written to the file) which are the first scanline of a
+        pass.  That is only the first row for a straightlaced image, and
+        the first row of each reduced image for an interlaced image.
+        """
 
-        for i,row in enumrows:
-            # Add "None" filter type.  Currently, it's essential that
-            # this filter type be used for every scanline as we do not
-            # mark the first row of a reduced pass image; that means we
-            # could accidentally compute the wrong filtered scanline if
-            # we used "up", "average", or "paeth" on such a line.
-            data.append(0)
-            extend(row)
-            if len(data) > self.chunk_limit:
-                compressed = compressor.compress(tostring(data))
-                if len(compressed):
-                    # print >> sys.stderr, len(data), len(compressed)
-                    write_chunk(outfile, 'IDAT', compressed)
-                # Because of our very witty definition of ``extend``,
-                # above, we must re-use the same ``data`` object.  Hence
-                # we use ``del`` to empty this one, rather than create a
-                # fresh one (which would be my natural FP instinct).
-                del data[:]
-        if len(data):
-            compressed = compressor.compress(tostring(data))
+        if not self.interlace:
+            return set([0])
+        first = set()
+        i = 0
+        for xstart, ystart, xstep, ystep in _adam7:
+            if xstart >= self.width:
+                continue
+            first.add(i)
+            i += len(range(ystart, self.height, ystep))
+        return first
+
+    def filter_row(self, scanline, prev, fo):
+        """Filter a scanline (a string of bytes) with the filter
+        configured by the `filter_type` argument.  `prev` is the
+        previous (unfiltered) scanline, or ``None`` for the first
+        scanline of a pass.  Returns the used filter type and the
+        filtered scanline.
+        """
+
+        if self.filter_type != 'adaptive':
+            return (self.filter_type,
+                    _filterbytes(self.filter_type, scanline, prev, fo))
+        # Without a previous scanline "up" is the same as "none", and
+        # "paeth" is the same as "sub".
+        if prev is None:
+            types = (0, 1, 3)
         else:
-            compressed = ''
-        flushed = compressor.flush()
-        if len(compressed) or len(flushed):
-            # print >> sys.stderr, len(data), len(compressed), len(flushed)
-            write_chunk(outfile, 'IDAT', compressed + flushed)
-        # http://www.w3.org/TR/PNG/#11IEND
-        write_chunk(outfile, 'IEND')
-        return i+1
+            types = (0, 1, 2, 3, 4)
+        best = None
+        for type in types:
+            filtered = _filterbytes(type, scanline, prev, fo)
+            cost = _filtercost(filtered)
+            if best is None or cost < best[0]:
+                best = (cost, type, filtered)
+        return best[1], best[2]
 
     def write_array(self, outfile, pixels):
         """
@@ -819,11 +1293,185 @@ class Writer:
         the output file.  See also :meth:`write` method.
         """
 
-        if self.interlace:
-            self.write_passes(outfile, self.array_scanlines_interlace(pixels))
+        if self.optimize:
+            self.write_optimized(outfile, pixels)
+        elif self.interlace:
+            self.write_interlaced(outfile, self.array_scanlines(pixels))
         else:
             self.write_passes(outfile, self.array_scanlines(pixels))
 
+    def write_optimized(self, outfile, pixels):
+        """
+        Write an array in flat row flat pixel format as the smallest
+        PNG file found by the trials described for the `optimize`
+        argument.  Returns the size of the written file in bytes.
+
+        The image data of each reduction is filtered (which is done in
+        Python, holding the GIL) once per filter type, and the
+        filtered data is then compressed with each of the zlib
+        settings on the thread pool, while the next reduction is
+        filtered.
+        """
+
+        from multiprocessing.pool import ThreadPool
+        try:
+            from io import BytesIO
+        except ImportError:
+            from StringIO import StringIO as BytesIO
+
+        fmt = 'BH'[self.bitdepth > 8]
+        if not (isinstance(pixels, array) and pixels.typecode == fmt):
+            pixels = array(fmt, pixels)
+        if len(pixels) != self.width * self.height * self.planes:
+            raise ValueError(
+              "pixels supplied (%d values) does not match image size" %
+              len(pixels))
+        info = dict(width=self.width, height=self.height,
+                    greyscale=self.greyscale, alpha=self.alpha,
+                    bitdepth=(self.rescale or [self.bitdepth])[0],
+                    palette=self.palette, transparent=self.transparent,
+                    background=self.background, gamma=self.gamma,
+                    interlace=self.interlace, chunk_limit=self.chunk_limit)
+        candidates = [({}, pixels)] + self.reductions(pixels)
+        filter_types = (0, 'adaptive')
+        ntrials = len(candidates) * len(filter_types) * \
+          len(_optimize_compression)
+        workers = self.compression_workers
+        if not workers:
+            try:
+                import multiprocessing
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        pool = ThreadPool(min(workers, ntrials))
+        # (*preamble*, *result*) for each trial, where *preamble* is
+        # the PNG file up to the image data, and *result* the
+        # AsyncResult of the compression of its image data.
+        trials = []
+        try:
+            for reduction, reduced in candidates:
+                for filter_type in filter_types:
+                    kw = dict(info, filter_type=filter_type)
+                    kw.update(reduction)
+                    writer = Writer(**kw)
+                    preamble = BytesIO()
+                    writer.write_preamble(preamble)
+                    preamble = preamble.getvalue()
+                    data = writer.filter_array(reduced)
+                    for level, strategy in _optimize_compression:
+                        trials.append((preamble, pool.apply_async(
+                          _compresstrial, ((data, level, strategy),))))
+                    del data
+            # The first of the smallest, so that the result doesn't
+            # depend on the order in which the trials finish.
+            best = None
+            for preamble, result in trials:
+                out = BytesIO()
+                out.write(preamble)
+                idat = result.get()
+                for i in range(0, len(idat), self.chunk_limit):
+                    write_chunk(out, 'IDAT', idat[i:i+self.chunk_limit])
+                # http://www.w3.org/TR/PNG/#11IEND
+                write_chunk(out, 'IEND')
+                out = out.getvalue()
+                if best is None or len(out) < len(best):
+                    best = out
+        finally:
+            pool.close()
+            pool.join()
+        outfile.write(best)
+        return len(best)
+
+    def reductions(self, pixels):
+        """
+        Return the lossless reductions of the image `pixels` (an array
+        in flat row flat pixel format), as a list of (*info*, *pixels*)
+        pairs, where *info* is a dictionary of the :class:`Writer`
+        arguments (`greyscale`, `alpha`, `bitdepth` and `palette`) for
+        the reduced *pixels*.  The list is empty if no reduction is
+        possible.  Images with a palette, a `transparent` or
+        `background` colour, or a bit depth which is rescaled, are not
+        reduced.
+        """
+
+        if (self.colormap or self.rescale or
+            self.transparent is not None or self.background is not None):
+            return []
+        greyscale = self.greyscale
+        alpha = self.alpha
+        bitdepth = self.bitdepth
+        planes = self.planes
+        npixels = self.width * self.height
+        changed = False
+        # 16-bit values with equal high and low bytes are 8-bit values
+        # times 257 (whatever the byte order).
+        if bitdepth == 16:
+            s = tostring(array('H', pixels))
+            if s[0::2] == s[1::2]:
+                pixels = array('B', s[0::2])
+                bitdepth = 8
+                changed = True
+        # An alpha channel which is opaque everywhere.
+        if alpha and (pixels[planes-1::planes].count(2**bitdepth-1) ==
+                      npixels):
+            pixels = _selectplanes(pixels, planes, range(planes-1))
+            alpha = False
+            planes -= 1
+            changed = True
+        # Colour which is grey everywhere.
+        if (not greyscale and
+            pixels[0::planes] == pixels[1::planes] == pixels[2::planes]):
+            pixels = _selectplanes(pixels, planes, [0] + [3]*alpha)
+            greyscale = True
+            planes = 1 + alpha
+            changed = True
+        result = []
+        if changed:
+            result.append((dict(greyscale=greyscale, alpha=alpha,
+                                bitdepth=bitdepth, palette=None), pixels))
+        if bitdepth != 8:
+            return result
+        s = tostring(pixels)
+        # Greyscale values which are all multiples of 255/(2**n-1) are
+        # n-bit values.
+        if greyscale and not alpha:
+            for depth in (1, 2, 4):
+                factor = 255 // (2**depth-1)
+                multiples = tostring(array('B', range(0, 256, factor)))
+                if s.translate(None, multiples):
+                    continue
+                divide = tostring(array('B',
+                                        [v // factor for v in range(256)]))
+                result.append((dict(greyscale=True, alpha=False,
+                                    bitdepth=depth, palette=None),
+                               array('B', s.translate(divide))))
+                break
+        # Up to 256 colours can be written with a palette (greyscale
+        # only if that reduces the bit depth).
+        keys = [s[i:i+planes] for i in range(0, len(s), planes)]
+        colours = set(keys)
+        if len(colours) > 256 or (greyscale and not alpha and
+                                  len(colours) > 16):
+            return result
+        def entry(key):
+            v = tuple(bytearray(key))
+            if greyscale:
+                v = v[:1]*3 + v[1:]
+            if len(v) == 4 and v[3] == 255:
+                v = v[:3]
+            return v
+        # The entries with alpha (4-tuples) must come first.
+        entries = sorted((len(entry(key)) == 3, entry(key), key)
+                         for key in colours)
+        index = dict((key, i) for i, (_, _, key) in enumerate(entries))
+        for depth in (1, 2, 4, 8):
+            if len(entries) <= 2**depth:
+                break
+        result.append((dict(greyscale=False, alpha=False, bitdepth=depth,
+                            palette=[e for _, e, _ in entries]),
+                       array('B', [index[key] for key in keys])))
+        return result
+
     def write_packed(self, outfile, rows):
         """
         Write PNG file to `outfile`.  The pixel data comes from `rows`
@@ -842,6 +1490,8 @@ class Writer:
         if self.rescale:
             raise Error("write_packed method not suitable for bit depth %d" %
               self.rescale[0])
+        if self.optimize:
+            raise Error("write_packed method not suitable for optimize")
         return self.write_passes(outfile, rows, packed=True)
 
     def convert_pnm(self, infile, outfile):
@@ -851,12 +1501,10 @@ class Writer:
         (binary) PGM, PPM, and PAM formats.
         """
 
-        if self.interlace:
-            pixels = array('B')
-            pixels.fromfile(infile,
-                            (self.bitdepth/8) * self.color_planes *
-                            self.width * self.height)
-            self.write_passes(outfile, self.array_scanlines_interlace(pixels))
+        if self.optimize:
+            self.write(outfile, self.file_scanlines(infile))
+        elif self.interlace:
+            self.write_interlaced(outfile, self.file_scanlines(infile))
         else:
             self.write_passes(outfile, self.file_scanlines(infile))
 
@@ -876,10 +1524,7 @@ class Writer:
         pixels = interleave_planes(pixels, apixels,
                                    (self.bitdepth/8) * self.color_planes,
                                    (self.bitdepth/8))
-        if self.interlace:
-            self.write_passes(outfile, self.array_scanlines_interlace(pixels))
-        else:
-            self.write_passes(outfile, self.array_scanlines(pixels))
+        self.write_array(outfile, pixels)
 
     def file_scanlines(self, infile):
         """
@@ -897,9 +1542,8 @@ class Writer:
         if self.bitdepth > 8:
             assert self.bitdepth == 16
             row_bytes *= 2
-            fmt = '>%dH' % vpr
             def line():
-                return array('H', struct.unpack(fmt, infile.read(row_bytes)))
+                return _unpack16(infile.read(row_bytes))
         else:
             def line():
                 scanline = array('B', infile.read(row_bytes))
@@ -907,6 +1551,36 @@ class Writer:
         for y in range(self.height):
             yield line()
 
+    def filter_array(self, pixels):
+        """
+        Return the image data of an array in flat row flat pixel
+        format as it is compressed into the ``IDAT`` chunks: each
+        scanline (of each pass, for an interlaced image) filtered with
+        :meth:`filter_row` and preceded by its filter type.
+        """
+
+        if self.interlace:
+            rows = self.array_scanlines_interlace(pixels)
+        else:
+            rows = self.array_scanlines(pixels)
+        fo = max(1, (self.bitdepth * self.planes) // 8)
+        firstrows = self.pass_first_rows()
+        data = array('B')
+        line = array('B')
+        extend = self.make_extend(line)
+        prev = None
+        for i, row in enumerate(rows):
+            extend(row)
+            scanline = tostring(line)
+            del line[:]
+            if i in firstrows:
+                prev = None
+            filter_type, filtered = self.filter_row(scanline, prev, fo)
+            prev = scanline
+            data.append(filter_type)
+            data.extend(array('B', filtered))
+        return tostring(data)
+
     def array_scanlines(self, pixels):
         """
         Generates boxed rows (flat pixels) from flat rows (flat pixels)
@@ -957,6 +1631,185 @@ class Writer:
                             pixels[offset+i:end_offset:skip]
                     yield row
 
+def _adam7row(row, planes, xstart, xstep):
+    """Return the pixels of the flat pixel `row` which belong to the
+    reduced image of an *Adam7* pass: every `xstep` pixel, from pixel
+    `xstart`.
+    """
+
+    if xstep == 1:
+        return row
+    if planes == 1:
+        return row[xstart::xstep]
+    ppr = (len(row) // planes - xstart + xstep - 1) // xstep
+    out = row[:ppr*planes]
+    for i in range(planes):
+        out[i::planes] = row[xstart*planes+i::xstep*planes]
+    return out
+
+def _zlibheader(level):
+    """Return the zlib header for a deflate stream compressed at
+    `level`, which has the compression level in FLEVEL.
+    """
+
+    # http://tools.ietf.org/html/rfc1950
+    if level == zlib.Z_DEFAULT_COMPRESSION:
+        flevel = 2
+    else:
+        flevel = (level >= 2) + (level >= 6) + (level >= 7)
+    cmf = 0x78
+    flg = flevel << 6
+    flg += 31 - (cmf * 256 + flg) % 31
+    return struct.pack('BB', cmf, flg)
+
+def _adler32combine(adler1, adler2, length2):
+    """Return the Adler-32 checksum of two joined sequences, from their
+    checksums `adler1` and `adler2`, and the length `length2` of the
+    second sequence (like ``adler32_combine`` in zlib).
+    """
+
+    base = 65521
+    adler1 &= 0xffffffff
+    adler2 &= 0xffffffff
+    low = ((adler1 & 0xffff) + (adler2 & 0xffff) - 1) % base
+    high = ((adler1 >> 16) + (adler2 >> 16) +
+            length2 * ((adler1 & 0xffff) - 1)) % base
+    return (high << 16) | low
+
+# Whether zlib.compressobj supports a preset dictionary (Python 3.3
+# and later).
+try:
+    zlib.compressobj(6, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY,
+                     strtobytes('\0'))
+    _zdict = True
+except TypeError:
+    _zdict = False
+
+def _deflateblock(block, level, strategy, dictionary, last):
+    """Compress a block of data for :class:`_ParallelCompressor`, as
+    raw deflate data.  Unless it is the `last` block, the data is
+    ended with a sync flush, so that it ends at a byte boundary and
+    the next block can be appended.
+    """
+
+    if dictionary and _zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8,
+                                      strategy, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8,
+                                      strategy)
+    compressed = compressor.compress(block)
+    return compressed + compressor.flush((zlib.Z_SYNC_FLUSH,
+                                          zlib.Z_FINISH)[last])
+
+class _ParallelCompressor:
+    """
+    Compressor with the interface of ``zlib.compressobj`` which
+    compresses blocks of the data on a thread pool (like pigz does).
+    The result is a single zlib stream: a zlib header, the raw deflate
+    data of each block (each primed with the last 32 KBytes of the
+    preceding block as dictionary, if supported), and the Adler-32
+    checksum of all data.
+
+    Priming with a dictionary needs ``zlib.compressobj`` of Python 3.3
+    or later (see :data:`_zdict`).  png.py does not run on Python 3
+    yet, so that branch is untested, and on Python 2 each block is
+    compressed without a dictionary (which costs a little ratio at the
+    block boundaries).
+    """
+
+    def __init__(self, level, workers, blocksize,
+                 strategy=zlib.Z_DEFAULT_STRATEGY):
+        from multiprocessing.pool import ThreadPool
+
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        self.level = level
+        self.strategy = strategy
+        self.blocksize = blocksize
+        self.pool = ThreadPool(workers)
+        # At most this many blocks are compressed (or waiting to be
+        # written) at a time, to limit the memory use.
+        self.maxpending = 2 * workers
+        self.pending = []
+        self.buffer = bytearray()
+        self.dictionary = None
+        self.adler = zlib.adler32(strtobytes(''))
+        self.header = _zlibheader(level)
+
+    def submit(self, block, last=False):
+        self.adler = zlib.adler32(block, self.adler)
+        self.pending.append(self.pool.apply_async(_deflateblock,
+            (block, self.level, self.strategy, self.dictionary, last)))
+        self.dictionary = block[-32768:]
+
+    def collect(self, wait):
+        """Return the compressed data of the finished blocks, in order.
+        If `wait` is true, wait for all blocks.
+        """
+
+        out = [self.header]
+        self.header = strtobytes('')
+        while self.pending and (wait or self.pending[0].ready() or
+                                len(self.pending) > self.maxpending):
+            out.append(self.pending.pop(0).get())
+        return strtobytes('').join(out)
+
+    def compress(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.blocksize:
+            self.submit(bytes(self.buffer[:self.blocksize]))
+            del self.buffer[:self.blocksize]
+        return self.collect(False)
+
+    def flush(self):
+        self.submit(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        out = self.collect(True)
+        self.pool.close()
+        self.pool.join()
+        return out + struct.pack('!I', self.adler & 0xffffffff)
+
+    def close(self):
+        """Stop the worker threads, also if the data was not flushed
+        (because writing the image failed).
+        """
+
+        self.pool.terminate()
+        self.pool.join()
+
+# The (level, strategy) pairs with which the trials of an optimizing
+# :class:`Writer` are compressed.  Z_RLE is missing from the zlib module
+# of older Pythons, but zlib itself has it since version 1.2.0.1.
+_optimize_compression = [
+    (9, zlib.Z_DEFAULT_STRATEGY),
+    (9, zlib.Z_FILTERED),
+    (9, getattr(zlib, 'Z_RLE', 3)),
+    (6, zlib.Z_DEFAULT_STRATEGY),
+]
+
+def _compresstrial(args):
+    """Compress the filtered image data of a trial encoding for
+    :meth:`Writer.write_optimized`.  `args` is a tuple (*data*,
+    *level*, *strategy*).  Returns the zlib stream.
+    """
+
+    data, level, strategy = args
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS,
+                                  zlib.DEF_MEM_LEVEL, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+def _selectplanes(pixels, planes, keep):
+    """Return the channels `keep` (a list of plane indexes) of the
+    flat pixel array `pixels` which has `planes` channels.
+    """
+
+    keep = list(keep)
+    out = pixels[:len(pixels) // planes * len(keep)]
+    for i, plane in enumerate(keep):
+        out[i::len(keep)] = pixels[plane::planes]
+    return out
+
 def write_chunk(outfile, tag, data=strtobytes('')):
     """
     Write a PNG chunk to the output file, including length and
@@ -988,80 +1841,119 @@ def filter_scanline(type, line, fo, prev=None):
     filter offset; normally this is size of a pixel in bytes (the number
     of bytes per sample times the number of channels), but when this is
     < 1 (for bit depths < 8) then the filter offset is 1.
+
+    Returns an array of bytes, the filter type followed by the
+    filtered scanline.
     """
 
     assert 0 <= type < 5
 
-    # The output array.  Which, pathetically, we extend one-byte at a
-    # time (fortunately this is linear).
+    def asstring(seq):
+        if not isarray(seq):
+            seq = array('B', seq)
+        return tostring(seq)
+
+    if prev:
+        prev = asstring(prev)
     out = array('B', [type])
+    out.extend(array('B', _filterbytes(type, asstring(line), prev, fo)))
+    return out
 
-    def sub():
-        ai = -fo
-        for x in line:
-            if ai >= 0:
-                x = (x - line[ai]) & 0xff
-            out.append(x)
-            ai += 1
-    def up():
-        for i,x in enumerate(line):
-            x = (x - prev[i]) & 0xff
-            out.append(x)
-    def average():
-        ai = -fo
-        for i,x in enumerate(line):
-            if ai >= 0:
-                x = (x - ((line[ai] + prev[i]) >> 1)) & 0xff
-            else:
-                x = (x - (prev[i] >> 1)) & 0xff
-            out.append(x)
-            ai += 1
-    def paeth():
-        # http://www.w3.org/TR/PNG/#9Filter-type-4-Paeth
-        ai = -fo # also used for ci
-        for i,x in enumerate(line):
-            a = 0
-            b = prev[i]
-            c = 0
-
-            if ai >= 0:
-                a = line[ai]
-                c = prev[ai]
-            p = a + b - c
-            pa = abs(p - a)
-            pb = abs(p - b)
-            pc = abs(p - c)
-            if pa <= pb and pa <= pc: Pr = a
-            elif pb <= pc: Pr = b
-            else: Pr = c
-
-            x = (x - Pr) & 0xff
-            out.append(x)
-            ai += 1
+def _filterbytes(type, line, prev, fo):
+    """Implementation of :func:`filter_scanline`, with the scanlines
+    `line` and `prev` as strings (`prev` is ``None`` for the first
+    line); returns the filtered scanline as a string.
+
+    The filters are computed for the whole scanline at once (with
+    numpy if available), except for paeth without numpy.
+    """
 
+    n = len(line)
+    if type == 0:
+        return line
     if not prev:
-        # We're on the first line.  Some of the filters can be reduced
-        # to simpler cases which makes handling the line "off the top"
-        # of the image simpler.  "up" becomes "none"; "paeth" becomes
-        # "left" (non-trivial, but true). "average" needs to be handled
-        # specially.
-        if type == 2: # "up"
-            return line # type = 0
-        elif type == 3:
-            prev = [0]*len(line)
-        elif type == 4: # "paeth"
+        # On the first line the previous line is all zeroes; "up"
+        # becomes "none", "paeth" becomes "sub".
+        if type == 2:
+            return line
+        if type == 4:
             type = 1
-    if type == 0:
-        out.extend(line)
-    elif type == 1:
-        sub()
+        prev = strtobytes('\0' * n)
+    if numpy is not None:
+        x = numpy.frombuffer(line, numpy.uint8)
+        b = numpy.frombuffer(prev, numpy.uint8)
+        # The bytes to the left, a in the line and c in the previous
+        # line, zero before the start of the line.
+        a = numpy.zeros(n, numpy.uint8)
+        if fo < n:
+            a[fo:] = x[:n-fo]
+        if type == 1:
+            out = x - a
+        elif type == 2:
+            out = x - b
+        elif type == 3:
+            out = x - ((a.astype(numpy.uint16) + b) >> 1).astype(numpy.uint8)
+        else:
+            c = numpy.zeros(n, numpy.uint8)
+            if fo < n:
+                c[fo:] = b[:n-fo]
+            a = a.astype(numpy.int16)
+            b = b.astype(numpy.int16)
+            c = c.astype(numpy.int16)
+            pa = numpy.abs(b - c)
+            pb = numpy.abs(a - c)
+            pc = numpy.abs(a + b - c - c)
+            pr = numpy.where((pa <= pb) & (pa <= pc), a,
+                             numpy.where(pb <= pc, b, c))
+            out = x - pr.astype(numpy.uint8)
+        return out.tobytes()
+    if type == 4:
+        x = bytearray(line)
+        b = bytearray(prev)
+        zero = bytearray(fo)
+        a = zero + x[:n-fo]
+        c = zero + b[:n-fo]
+        out = bytearray(n)
+        for i in range(n):
+            ai = a[i]
+            bi = b[i]
+            ci = c[i]
+            pa = abs(bi - ci)
+            pb = abs(ai - ci)
+            pc = abs(ai + bi - ci - ci)
+            if pa <= pb and pa <= pc:
+                pr = ai
+            elif pb <= pc:
+                pr = bi
+            else:
+                pr = ci
+            out[i] = (x[i] - pr) & 0xff
+        return bytes(out)
+    x = _bytestoint(line)
+    # The bytes to the left.
+    a = x >> (8*fo)
+    if type == 1:
+        x = _subbytes(x, a, n)
     elif type == 2:
-        up()
-    elif type == 3:
-        average()
-    else: # type == 4
-        paeth()
-    return out
+        x = _subbytes(x, _bytestoint(prev), n)
+    else:
+        x = _subbytes(x, _avgbytes(a, _bytestoint(prev), n), n)
+    return _inttobytes(x, n)
+
+# For each byte value, its absolute value when interpreted as signed
+# byte, the cost used by adaptive filtering.
+_filtercosts = [min(v, 256-v) for v in range(256)]
+_filtercosttable = strtobytes(''.join(map(chr, _filtercosts)))
+
+def _filtercost(filtered):
+    """The sum of the absolute values of the bytes of a filtered
+    scanline (a string), each interpreted as a signed byte.
+    """
+
+    if numpy is not None:
+        costs = numpy.frombuffer(filtered, numpy.int8).astype(numpy.int32)
+        return int(numpy.abs(costs).sum())
+    return sum(bytearray(filtered.translate(_filtercosttable)))
 
 
 def from_array(a, mode=None, info={}):
@@ -1300,23 +2192,6 @@ class Image:
         finally:
             close()
 
-class _readable:
-    """
-    A simple file-like interface for strings and arrays.
-    """
-
-    def __init__(self, buf):
-        self.buf = buf
-        self.offset = 0
-
-    def read(self, n):
-        r = self.buf[self.offset:self.offset+n]
-        if isarray(r):
-            r = r.tostring()
-        self.offset += n
-        return r
-
-
 class Reader:
     """
     PNG decoder in pure Python.
@@ -1337,7 +2212,12 @@ class Reader:
         bytes
           ``array`` or ``string`` with PNG data.
 
+        Additionally, when a `filename` is given, ``mmap=True`` memory
+        maps the file instead of reading it.  With `bytes` or a memory
+        mapped file, the chunks are walked as slices of the data (and
+        ``IDAT`` chunks are decompressed) without copying them.
         """
+        usemmap = kw.pop("mmap", False)
         if ((_guess is not None and len(kw) != 0) or
             (_guess is None and len(kw) != 1)):
             raise TypeError("Reader() takes exactly 1 argument")
@@ -1350,6 +2230,10 @@ class Reader:
         # past the 4 bytes that specify the chunk type).  See preamble
         # method for how this is used.
         self.atchunk = None
+        # The PNG data if it is in memory (or memory mapped), and the
+        # current offset in it; otherwise None and it is read from file.
+        self.buffer = None
+        self.offset = 0
 
         if _guess is not None:
             if isarray(_guess):
@@ -1361,13 +2245,54 @@ class Reader:
 
         if "filename" in kw:
             self.file = open(kw["filename"], "rb")
+            if usemmap:
+                self.mapfile()
         elif "file" in kw:
             self.file = kw["file"]
         elif "bytes" in kw:
-            self.file = _readable(kw["bytes"])
+            self.file = None
+            self.buffer = kw["bytes"]
         else:
             raise TypeError("expecting filename, file or bytes array")
 
+    def mapfile(self):
+        """Memory map the input file (read-only), and read from the
+        mapping instead of the file.  If the file can't be mapped (for
+        example because it is empty), it is read normally.
+        """
+
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return
+        # The mapping stays valid after the file is closed.
+        self.file.close()
+        self.file = None
+
+    def readbytes(self, n):
+        """Read up to `n` bytes from the input, as a string."""
+
+        if self.buffer is None:
+            return self.file.read(n)
+        r = self.buffer[self.offset:self.offset+n]
+        self.offset += len(r)
+        if isarray(r):
+            r = tostring(r)
+        return r
+
+    def readview(self, n):
+        """Like :meth:`readbytes`, but for input in memory return a
+        view of the bytes instead of a copy.
+        """
+
+        if self.buffer is None:
+            return self.file.read(n)
+        n = max(0, min(n, len(self.buffer) - self.offset))
+        r = _view(self.buffer, self.offset, n)
+        self.offset += n
+        return r
+
     def chunk(self, seek=None):
         """
         Read the next PNG chunk from the input file; returns a
@@ -1382,6 +2307,15 @@ class Reader:
         using `seek` can cause you to miss chunks.
         """
 
+        type, data = self.chunkview(seek)
+        return type, _viewtobytes(data)
+
+    def chunkview(self, seek=None):
+        """Like :meth:`chunk`, but when the input is in memory (or
+        memory mapped) *data* is a view of the chunk's data (a
+        ``buffer`` or ``memoryview``) instead of a copy.
+        """
+
         self.validate_signature()
 
         while True:
@@ -1390,13 +2324,13 @@ class Reader:
                 self.atchunk = self.chunklentype()
             length,type = self.atchunk
             self.atchunk = None
-            data = self.file.read(length)
+            data = self.readview(length)
             if len(data) != length:
                 raise ChunkError('Chunk %s too short for required %i octets.'
                   % (type, length))
-            checksum = self.file.read(4)
+            checksum = self.readbytes(4)
             if len(checksum) != 4:
-                raise ValueError('Chunk %s too short for checksum.', tag)
+                raise ValueError('Chunk %s too short for checksum.' % type)
             if seek and type != seek:
                 continue
             verify = zlib.crc32(strtobytes(type))
@@ -1467,78 +2401,94 @@ class Reader:
         # byte is used instead.
         fu = max(1, self.psize)
 
-        # For the first line of a pass, synthesize a dummy previous
-        # line.  An alternative approach would be to observe that on the
-        # first line 'up' is the same as 'null', 'paeth' is the same
-        # as 'sub', with only 'average' requiring any special case.
+        # For the first line of a pass there is no previous line.  On
+        # the first line 'up' is the same as 'null', 'paeth' is the
+        # same as 'sub', with only 'average' requiring a dummy
+        # previous line.
         if not previous:
-            previous = array('B', [0]*len(scanline))
+            if filter_type == 2:
+                return result
+            if filter_type == 4:
+                filter_type = 1
+            previous = array('B', [0]) * len(scanline)
+
+        # Sub and up are done for the whole scanline at once, with
+        # numpy if available, otherwise by operating on the scanline as
+        # one big integer (adding bytes without carries).  Average and
+        # paeth depend on the reconstructed byte to the left, so they
+        # can only be done one pixel after the other; each channel lane
+        # (every fu-th byte) is processed in a loop without any index
+        # arithmetic.
 
         def sub():
             """Undo sub filter."""
 
-            ai = 0
-            # Loops starts at index fu.  Observe that the initial part
-            # of the result is already filled in correctly with
-            # scanline.
-            for i in range(fu, len(result)):
-                x = scanline[i]
-                a = result[ai]
-                result[i] = (x + a) & 0xff
-                ai += 1
+            n = len(result)
+            if numpy is not None and n % fu == 0:
+                x = numpy.frombuffer(tostring(scanline), numpy.uint8)
+                x = numpy.cumsum(x.reshape(-1, fu), axis=0, dtype=numpy.uint8)
+                return array('B', x.tobytes())
+            # Prefix sum in log2(n/fu) steps: after the step with
+            # distance d each byte is the sum of the 2*d bytes (in
+            # steps of fu) ending with it.
+            x = _bytestoint(tostring(scanline))
+            d = fu
+            while d < n:
+                x = _addbytes(x, x >> (8*d), n)
+                d *= 2
+            return array('B', _inttobytes(x, n))
 
         def up():
             """Undo up filter."""
 
-            for i in range(len(result)):
-                x = scanline[i]
-                b = previous[i]
-                result[i] = (x + b) & 0xff
+            if numpy is not None:
+                x = numpy.frombuffer(tostring(scanline), numpy.uint8)
+                b = numpy.frombuffer(tostring(previous), numpy.uint8)
+                return array('B', (x + b).tobytes())
+            n = len(result)
+            x = _addbytes(_bytestoint(tostring(scanline)),
+                          _bytestoint(tostring(previous)), n)
+            return array('B', _inttobytes(x, n))
 
         def average():
             """Undo average filter."""
 
-            ai = -fu
-            for i in range(len(result)):
-                x = scanline[i]
-                if ai < 0:
-                    a = 0
-                else:
-                    a = result[ai]
-                b = previous[i]
-                result[i] = (x + ((a + b) >> 1)) & 0xff
-                ai += 1
+            for i in range(fu):
+                a = 0
+                lane = []
+                for x, b in zip(scanline[i::fu], previous[i::fu]):
+                    a = (x + ((a + b) >> 1)) & 0xff
+                    lane.append(a)
+                result[i::fu] = array('B', lane)
+            return result
 
         def paeth():
             """Undo Paeth filter."""
 
-            # Also used for ci.
-            ai = -fu
-            for i in range(len(result)):
-                x = scanline[i]
-                if ai < 0:
-                    a = c = 0
-                else:
-                    a = result[ai]
-                    c = previous[ai]
-                b = previous[i]
-                p = a + b - c
-                pa = abs(p - a)
-                pb = abs(p - b)
-                pc = abs(p - c)
-                if pa <= pb and pa <= pc:
-                    pr = a
-                elif pb <= pc:
-                    pr = b
-                else:
-                    pr = c
-                result[i] = (x + pr) & 0xff
-                ai += 1
+            for i in range(fu):
+                a = c = 0
+                lane = []
+                for x, b in zip(scanline[i::fu], previous[i::fu]):
+                    # With p = a + b - c, the distances of p to a, b
+                    # and c are:
+                    pa = abs(b - c)
+                    pb = abs(a - c)
+                    pc = abs(a + b - c - c)
+                    if pa <= pb and pa <= pc:
+                        pr = a
+                    elif pb <= pc:
+                        pr = b
+                    else:
+                        pr = c
+                    a = (x + pr) & 0xff
+                    c = b
+                    lane.append(a)
+                result[i::fu] = array('B', lane)
+            return result
 
         # Call appropriate filter algorithm.  Note that 0 has already
         # been dealt with.
-        (None, sub, up, average, paeth)[filter_type]()
-        return result
+        return (None, sub, up, average, paeth)[filter_type]()
 
     def deinterlace(self, raw):
         """
@@ -1546,21 +2496,23 @@ class Reader:
         Return in flat row flat pixel format.
         """
 
-        # print >> sys.stderr, ("Reading interlaced, w=%s, r=%s, planes=%s," +
-        #     " bpp=%s") % (self.width, self.height, self.planes, self.bps)
-        # Values per row (of the target image)
-        vpr = self.width * self.planes
-
-        # Make a result array, and make it big enough.  Interleaving
-        # writes to the output array randomly (well, not quite), so the
-        # entire output array must be in memory.
         fmt = 'BH'[self.bitdepth > 8]
-        a = array(fmt, [0]*vpr*self.height)
-        source_offset = 0
-
-        for xstart, ystart, xstep, ystep in _adam7:
-            # print >> sys.stderr, "Adam7: start=%s,%s step=%s,%s" % (
-            #     xstart, ystart, xstep, ystep)
+        return array(fmt, itertools.chain(*self.iterinterlaced([raw])))
+
+    def iterpasses(self, raw):
+        """Iterator that undoes the effect of filtering, for an
+        interlaced image, and yields (*pass*, *y*, *row*) for each
+        scanline of the reduced images in turn: *pass* is the
+        (*xstart*, *ystart*, *xstep*, *ystep*) of the *Adam7* pass, *y*
+        the row of the full image and *row* the scanline in flat pixel
+        format.  `raw` should be an iterable that yields the raw bytes
+        in chunks of arbitrary size."""
+
+        raw = iter(raw)
+        a = array('B')
+        offset = 0
+        for adam7pass in _adam7:
+            xstart, ystart, xstep, ystep = adam7pass
             if xstart >= self.width:
                 continue
             # The previous (reconstructed) scanline.  None at the
@@ -1572,51 +2524,120 @@ class Reader:
             # Row size in bytes for this pass.
             row_size = int(math.ceil(self.psize * ppr))
             for y in range(ystart, self.height, ystep):
-                filter_type = raw[source_offset]
-                source_offset += 1
-                scanline = raw[source_offset:source_offset+row_size]
-                source_offset += row_size
+                while len(a) - offset < row_size + 1:
+                    # Remove the rows already used only when more
+                    # data is needed (like :meth:`iterstraight`).
+                    del a[:offset]
+                    offset = 0
+                    try:
+                        a.extend(next(raw))
+                    except StopIteration:
+                        raise FormatError(
+                          'Wrong size for decompressed IDAT chunk.')
+                filter_type = a[offset]
+                scanline = a[offset+1:offset+row_size+1]
+                offset += row_size + 1
                 recon = self.undo_filter(filter_type, scanline, recon)
                 # Convert so that there is one element per pixel value
-                flat = self.serialtoflat(recon, ppr)
-                if xstep == 1:
-                    assert xstart == 0
-                    offset = y * vpr
-                    a[offset:offset+vpr] = flat
-                else:
-                    offset = y * vpr + xstart * self.planes
-                    end_offset = (y+1) * vpr
-                    skip = self.planes * xstep
-                    for i in range(self.planes):
-                        a[offset+i:end_offset:skip] = \
-                            flat[i::self.planes]
-        return a
+                yield adam7pass, y, self.serialtoflat(recon, ppr)
+
+    def iterinterlaced(self, raw, rows=None, columns=None):
+        """Iterator that undoes the effect of filtering and interlacing,
+        and yields each row in boxed row flat pixel format.  `raw`
+        should be an iterable that yields the raw bytes in chunks of
+        arbitrary size.  If `rows` or `columns` is given, it should be
+        a (*start*, *stop*) pair, then only the rows and columns of
+        this window are yielded.
+
+        The passes 1 to 6 only cover the even rows of the image, and
+        pass 7 (the last one) exactly the odd rows.  So only the even
+        rows (of the window) are assembled in memory, and yielded in
+        turn with the odd rows as these are decoded from pass 7.
+        Decoding stops after the last row of the window.
+        """
 
-    def iterboxed(self, rows):
+        y0, y1 = rows or (0, self.height)
+        x0, x1 = columns or (0, self.width)
+        planes = self.planes
+        # Values per row
+        vpr = self.width * planes
+        first = x0 * planes
+        last = x1 * planes
+        # The even rows of the window, from row e0.
+        e0 = y0 + (y0 & 1)
+        fmt = 'BH'[self.bitdepth > 8]
+        even = array(fmt, [0]) * (vpr * len(range(e0, y1, 2)))
+
+        # The next even row to be yielded.
+        y = e0
+        for (xstart, ystart, xstep, ystep), py, flat in \
+          self.iterpasses(raw):
+            if ystart == 1:
+                # Pass 7: all of each odd row.
+                if py >= y1:
+                    break
+                if py < y0:
+                    continue
+                while y < py:
+                    offset = (y - e0) // 2 * vpr
+                    yield even[offset+first:offset+last]
+                    y += 2
+                yield flat[first:last]
+                continue
+            if py < e0 or py >= y1:
+                continue
+            # Scatter the pixels of the reduced row into the even row,
+            # with a slice assignment for each channel.
+            offset = (py - e0) // 2 * vpr
+            if xstep == 1:
+                even[offset:offset+vpr] = flat
+            else:
+                end = offset + vpr
+                offset += xstart * planes
+                skip = xstep * planes
+                for i in range(planes):
+                    even[offset+i:end:skip] = flat[i::planes]
+        while y < y1:
+            offset = (y - e0) // 2 * vpr
+            yield even[offset+first:offset+last]
+            y += 2
+
+    def iterboxed(self, rows, columns=None):
         """Iterator that yields each scanline in boxed row flat pixel
         format.  `rows` should be an iterator that yields the bytes of
-        each row in turn.
+        each row in turn.  If `columns` is given, it should be a
+        (*start*, *stop*) pair of pixel columns; then only these
+        columns are converted and yielded.
         """
 
+        start, stop = columns or (0, self.width)
+        width = stop - start
+        if self.bitdepth >= 8:
+            # Bytes per pixel.
+            bpp = self.planes * self.bitdepth // 8
+            first = start * bpp
+            last = stop * bpp
+            skip = 0
+        else:
+            # Samples per byte (and there is only one sample per pixel)
+            spb = 8//self.bitdepth
+            first = start // spb
+            last = (stop + spb - 1) // spb
+            skip = start - first * spb
+        window = columns is not None
+
         def asvalues(raw):
             """Convert a row of raw bytes into a flat row.  Result may
             or may not share with argument"""
 
+            if window:
+                raw = raw[first:last]
             if self.bitdepth == 8:
                 return raw
             if self.bitdepth == 16:
-                raw = tostring(raw)
-                return array('H', struct.unpack('!%dH' % (len(raw)//2), raw))
+                return _unpack16(raw)
             assert self.bitdepth < 8
-            width = self.width
-            # Samples per byte
-            spb = 8//self.bitdepth
-            out = array('B')
-            mask = 2**self.bitdepth - 1
-            shifts = map(self.bitdepth.__mul__, reversed(range(spb)))
-            for o in raw:
-                out.extend(map(lambda i: mask&(o>>i), shifts))
-            return out[:width]
+            return _unpacksamples(raw, self.bitdepth)[skip:skip+width]
 
         return itertools.imap(asvalues, rows)
 
@@ -1628,24 +2649,11 @@ class Reader:
         if self.bitdepth == 8:
             return bytes
         if self.bitdepth == 16:
-            bytes = tostring(bytes)
-            return array('H',
-              struct.unpack('!%dH' % (len(bytes)//2), bytes))
+            return _unpack16(bytes)
         assert self.bitdepth < 8
         if width is None:
             width = self.width
-        # Samples per byte
-        spb = 8//self.bitdepth
-        out = array('B')
-        mask = 2**self.bitdepth - 1
-        shifts = map(self.bitdepth.__mul__, reversed(range(spb)))
-        l = width
-        for o in bytes:
-            out.extend([(mask&(o>>s)) for s in shifts][:l])
-            l -= spb
-            if l <= 0:
-                l = width
-        return out
+        return _unpacksamples(bytes, self.bitdepth, width)
 
     def iterstraight(self, raw):
         """Iterator that undoes the effect of filtering, and yields each
@@ -1661,12 +2669,17 @@ class Reader:
         recon = None
         for some in raw:
             a.extend(some)
-            while len(a) >= rb + 1:
-                filter_type = a[0]
-                scanline = a[1:rb+1]
-                del a[:rb+1]
+            # Walk the complete rows in the buffer, and only then
+            # remove them all at once (instead of shifting the
+            # remaining bytes down for every row).
+            offset = 0
+            while len(a) - offset >= rb + 1:
+                filter_type = a[offset]
+                scanline = a[offset+1:offset+rb+1]
+                offset += rb + 1
                 recon = self.undo_filter(filter_type, scanline, recon)
                 yield recon
+            del a[:offset]
         if len(a) != 0:
             # :file:format We get here with a file format error: when the
             # available bytes (after decompressing) do not pack into exact
@@ -1682,7 +2695,7 @@ class Reader:
 
         if self.signature:
             return
-        self.signature = self.file.read(8)
+        self.signature = self.readbytes(8)
         if self.signature != _signature:
             raise FormatError("PNG file has invalid signature.")
 
@@ -1713,7 +2726,7 @@ class Reader:
         is returned.
         """
 
-        x = self.file.read(8)
+        x = self.readbytes(8)
         if not x:
             return None
         if len(x) != 8:
@@ -1846,7 +2859,31 @@ class Reader:
                 not self.colormap and len(data) != self.planes):
                 raise FormatError("sBIT chunk has incorrect length.")
 
-    def read(self):
+    def window(self, rows=None, columns=None):
+        """Check a window of the image, given as `rows` and `columns`
+        arguments to the :meth:`read` method (and friends), and return
+        it as (*x0*, *x1*, *y0*, *y1*), the start and stop column and
+        row.  The image header must have been read already.
+        """
+
+        def check(range, size, what):
+            if range is None:
+                return 0, size
+            start, stop = range
+            start = max(0, start)
+            if stop is None:
+                stop = size
+            stop = min(stop, size)
+            if start >= stop:
+                raise ValueError("%s window %r is empty for image %s %d" %
+                  (what, range, ('height', 'width')[what == 'column'], size))
+            return start, stop
+
+        y0, y1 = check(rows, self.height, 'row')
+        x0, x1 = check(columns, self.width, 'column')
+        return x0, x1, y0, y1
+
+    def read(self, rows=None, columns=None):
         """
         Read the PNG file and decode it.  Returns (`width`, `height`,
         `pixels`, `metadata`).
@@ -1854,13 +2891,23 @@ class Reader:
         May use excessive memory.
 
         `pixels` are returned in boxed row flat pixel format.
+
+        `rows` and `columns` select a window of the image, each is a
+        (*start*, *stop*) pair like the arguments of a slice (*stop*
+        can be ``None`` for the end of the image, and the window is
+        clipped to the image).  Then `width`, `height` and the ``size``
+        in the metadata are those of the window.  Decompression stops
+        after the last row of the window (for interlaced images, in the
+        last pass), and for straightlaced images only the columns of
+        the window are unpacked.
         """
 
         def iteridat():
-            """Iterator that yields all the ``IDAT`` chunks as strings."""
+            """Iterator that yields all the ``IDAT`` chunks as strings
+            (or views, for input in memory)."""
             while True:
                 try:
-                    type, data = self.chunk()
+                    type, data = self.chunkview()
                 except ValueError as e:
                     raise ChunkError(e.args[0])
                 if type == 'IEND':
@@ -1879,42 +2926,44 @@ class Reader:
             be an iterator that yields the ``IDAT`` chunk data.
             """
 
-            # Currently, with no max_length paramter to decompress, this
-            # routine will do one yield per IDAT chunk.  So not very
-            # incremental.
             d = zlib.decompressobj()
-            # Each IDAT chunk is passed to the decompressor, then any
-            # remaining state is decompressed out.
+            # Each IDAT chunk is passed to the decompressor (in steps
+            # which produce at most `limit` bytes, so that the caller
+            # can stop early), then any remaining state is decompressed
+            # out.
+            limit = max(2**18, self.row_bytes + 1)
             for data in idat:
-                # :todo: add a max_length argument here to limit output
-                # size.
-                yield array('B', d.decompress(data))
+                while len(data):
+                    yield array('B', d.decompress(data, limit))
+                    data = d.unconsumed_tail
             yield array('B', d.flush())
 
         self.preamble()
+        x0, x1, y0, y1 = self.window(rows, columns)
         raw = iterdecomp(iteridat())
 
         if self.interlace:
-            raw = array('B', itertools.chain(*raw))
-            arraycode = 'BH'[self.bitdepth>8]
-            # Like :meth:`group` but producing an array.array object for
-            # each row.
-            pixels = itertools.imap(lambda *row: array(arraycode, row),
-                       *[iter(self.deinterlace(raw))]*self.width*self.planes)
+            pixels = self.iterinterlaced(raw, (y0, y1), (x0, x1))
         else:
-            pixels = self.iterboxed(self.iterstraight(raw))
+            rows = self.iterstraight(raw)
+            if y0 > 0 or y1 < self.height:
+                rows = itertools.islice(rows, y0, y1)
+            if x0 > 0 or x1 < self.width:
+                pixels = self.iterboxed(rows, (x0, x1))
+            else:
+                pixels = self.iterboxed(rows)
         meta = dict()
         for attr in 'greyscale alpha planes bitdepth interlace'.split():
             meta[attr] = getattr(self, attr)
-        meta['size'] = (self.width, self.height)
+        meta['size'] = (x1 - x0, y1 - y0)
         for attr in 'gamma transparent background'.split():
             a = getattr(self, attr, None)
             if a is not None:
                 meta[attr] = a
-        return self.width, self.height, pixels, meta
+        return x1 - x0, y1 - y0, pixels, meta
 
 
-    def read_flat(self):
+    def read_flat(self, rows=None, columns=None):
         """
         Read a PNG file and decode it into flat row flat pixel format.
         Returns (*width*, *height*, *pixels*, *metadata*).
@@ -1927,7 +2976,7 @@ class Reader:
         more stream-friendly boxed row flat pixel format.
         """
 
-        x, y, pixel, meta = self.read()
+        x, y, pixel, meta = self.read(rows, columns)
         arraycode = 'BH'[meta['bitdepth']>8]
         pixel = array(arraycode, itertools.chain(*pixel))
         return x, y, pixel, meta
@@ -1955,7 +3004,7 @@ class Reader:
             plte = map(operator.add, plte, group(trns, 1))
         return plte
 
-    def asDirect(self):
+    def asDirect(self, rows=None, columns=None):
         """Returns the image data as a direct representation of an
         ``x * y * planes`` array.  This method is intended to remove the
         need for callers to deal with palettes and transparency
@@ -1991,65 +3040,72 @@ class Reader:
         like the :meth:`read` method).
 
         All the other aspects of the image data are not changed.
+
+        The `rows` and `columns` arguments select a window of the image,
+        as for the :meth:`read` method; this applies to all the
+        methods below as well.
         """
 
         self.preamble()
 
         # Simple case, no conversion necessary.
         if not self.colormap and not self.trns and not self.sbit:
-            return self.read()
+            return self.read(rows, columns)
 
-        x,y,pixels,meta = self.read()
+        x,y,pixels,meta = self.read(rows, columns)
 
         if self.colormap:
             meta['colormap'] = False
             meta['alpha'] = bool(self.trns)
             meta['bitdepth'] = 8
             meta['planes'] = 3 + bool(self.trns)
-            plte = self.palette()
+            plte = list(self.palette())
+            planes = meta['planes']
+            # Palette indexes which are in range (they are deleted from
+            # the row to check for invalid ones), and for each channel
+            # a table which maps the indexes to the channel values.
+            valid = _bytetable(range(len(plte)))
+            plte += [(0,) * planes] * (256 - len(plte))
+            tables = [_bytetable([entry[i] for entry in plte])
+                      for i in range(planes)]
             def iterpal(pixels):
                 for row in pixels:
-                    row = map(plte.__getitem__, row)
-                    yield array('B', itertools.chain(*row))
+                    row = tostring(row)
+                    if row.translate(None, valid):
+                        raise FormatError("Palette index out of range.")
+                    out = bytearray(len(row) * planes)
+                    for i in range(planes):
+                        out[i::planes] = row.translate(tables[i])
+                    yield array('B', bytes(out))
             pixels = iterpal(pixels)
         elif self.trns:
-            # It would be nice if there was some reasonable way of doing
-            # this without generating a whole load of intermediate tuples.
-            # But tuples does seem like the easiest way, with no other way
-            # clearly much simpler or much faster.  (Actually, the L to LA
-            # conversion could perhaps go faster (all those 1-tuples!), but
-            # I still wonder whether the code proliferation is worth it)
-            it = self.transparent
             maxval = 2**meta['bitdepth']-1
             planes = meta['planes']
             meta['alpha'] = True
             meta['planes'] += 1
             typecode = 'BH'[meta['bitdepth']>8]
+            masks = _transparentmasks(self.transparent, typecode)
+            # Maps the opaque bytes (0xff) to maxval (or to both bytes
+            # of it, for 16 bits).
+            alphatable = _bytetable([0] * 255 + [maxval & 0xff])
             def itertrns(pixels):
                 for row in pixels:
-                    # For each row we group it into pixels, then form a
-                    # characterisation vector that says whether each pixel
-                    # is opaque or not.  Then we convert True/False to
-                    # 0/maxval (by multiplication), and add it as the extra
-                    # channel.
-                    row = group(row, planes)
-                    opa = map(it.__ne__, row)
-                    opa = map(maxval.__mul__, opa)
-                    opa = zip(opa) # convert to 1-tuples
-                    yield array(typecode,
-                      itertools.chain(*map(operator.add, row, opa)))
+                    alpha = _opaquebytes(row, masks).translate(alphatable)
+                    width = len(alpha)
+                    if typecode == 'H':
+                        double = bytearray(2 * width)
+                        double[0::2] = alpha
+                        double[1::2] = alpha
+                        alpha = bytes(double)
+                    # Interleave the channels and the alpha channel, with
+                    # a slice assignment for each.
+                    out = array(typecode, [0]) * (width * (planes + 1))
+                    for i in range(planes):
+                        out[i::planes+1] = row[i::planes]
+                    out[planes::planes+1] = array(typecode, alpha)
+                    yield out
             pixels = itertrns(pixels)
-        targetbitdepth = None
-        if self.sbit:
-            sbit = struct.unpack('%dB' % len(self.sbit), self.sbit)
-            targetbitdepth = max(sbit)
-            if targetbitdepth > meta['bitdepth']:
-                raise Error('sBIT chunk %r exceeds bitdepth %d' %
-                    (sbit,self.bitdepth))
-            if min(sbit) <= 0:
-                raise Error('sBIT chunk %r has a 0-entry' % sbit)
-            if targetbitdepth == meta['bitdepth']:
-                targetbitdepth = None
+        targetbitdepth = self._sbit_depth(meta['bitdepth'])
         if targetbitdepth:
             shift = meta['bitdepth'] - targetbitdepth
             meta['bitdepth'] = targetbitdepth
@@ -2059,13 +3115,32 @@ class Reader:
             pixels = itershift(pixels)
         return x,y,pixels,meta
 
-    def asFloat(self, maxval=1.0):
+    def _sbit_depth(self, bitdepth):
+        """Return the bit depth that the pixel values (with `bitdepth`
+        bits) should be reduced to according to the ``sBIT`` chunk, or
+        ``None`` if they should not be reduced.
+        """
+
+        if not self.sbit:
+            return None
+        sbit = struct.unpack('%dB' % len(self.sbit), self.sbit)
+        targetbitdepth = max(sbit)
+        if targetbitdepth > bitdepth:
+            raise Error('sBIT chunk %r exceeds bitdepth %d' %
+                (sbit,self.bitdepth))
+        if min(sbit) <= 0:
+            raise Error('sBIT chunk %r has a 0-entry' % sbit)
+        if targetbitdepth == bitdepth:
+            return None
+        return targetbitdepth
+
+    def asFloat(self, maxval=1.0, rows=None, columns=None):
         """Return image pixels as per :meth:`asDirect` method, but scale
         all pixel values to be floating point values between 0.0 and
         *maxval*.
         """
 
-        x,y,pixels,info = self.asDirect()
+        x,y,pixels,info = self.asDirect(rows, columns)
         sourcemaxval = 2**info['bitdepth']-1
         del info['bitdepth']
         info['maxval'] = float(maxval)
@@ -2075,10 +3150,10 @@ class Reader:
                 yield map(factor.__mul__, row)
         return x,y,iterfloat(),info
 
-    def _as_rescale(self, get, targetbitdepth):
+    def _as_rescale(self, get, targetbitdepth, rows=None, columns=None):
         """Helper used by :meth:`asRGB8` and :meth:`asRGBA8`."""
 
-        width,height,pixels,meta = get()
+        width,height,pixels,meta = get(rows, columns)
         maxval = 2**meta['bitdepth'] - 1
         targetmaxval = 2**targetbitdepth - 1
         factor = float(targetmaxval) / float(maxval)
@@ -2088,7 +3163,7 @@ class Reader:
                 yield map(lambda x: int(round(x*factor)), row)
         return width, height, iterscale(), meta
 
-    def asRGB8(self):
+    def asRGB8(self, rows=None, columns=None):
         """Return the image data as an RGB pixels with 8-bits per
         sample.  This is like the :meth:`asRGB` method except that
         this method additionally rescales the values so that they
@@ -2106,9 +3181,9 @@ class Reader:
         *pixels* is the pixel data in boxed row flat pixel format.
         """
 
-        return self._as_rescale(self.asRGB, 8)
+        return self._as_rescale(self.asRGB, 8, rows, columns)
 
-    def asRGBA8(self):
+    def asRGBA8(self, rows=None, columns=None):
         """Return the image data as RGBA pixels with 8-bits per
         sample.  This method is similar to :meth:`asRGB8` and
         :meth:`asRGBA`:  The result pixels have an alpha channel, *and*
@@ -2116,9 +3191,185 @@ class Reader:
         synthesized if necessary (with a small speed penalty).
         """
 
-        return self._as_rescale(self.asRGBA, 8)
+        return self._as_rescale(self.asRGBA, 8, rows, columns)
+
+    def read_rgba8_packed(self, rows=None, columns=None):
+        """Return the image data as RGBA pixels with 8-bits per sample,
+        exactly like the :meth:`asRGBA8` method, but with all the pixels
+        in a single ``bytearray`` of *width* * *height* * 4 bytes, one
+        row after the other.
+
+        This function returns a 4-tuple:
+        (*width*, *height*, *pixels*, *metadata*).
+
+        For images with a bit depth of 8 or less the rows are converted
+        with translation tables (palette lookup, alpha synthesis and
+        rescaling happen in the table), 16 bit images use numpy if
+        available.  No Python object is created per sample (except
+        for 16 bit images without numpy).
+        """
+
+        self.preamble()
+        x0, x1, y0, y1 = self.window(rows, columns)
+        out = bytearray((x1 - x0) * (y1 - y0) * 4)
+        width,height,meta = self.readinto(out, rows=rows, columns=columns)
+        return width,height,out,meta
+
+    def readinto(self, buffer, stride=None, offset=0,
+                 rows=None, columns=None):
+        """Decode the image as RGBA pixels with 8-bits per sample (like
+        :meth:`read_rgba8_packed`) directly into `buffer`, which can be
+        any writable object supporting the buffer protocol, for
+        example a ``bytearray``, ``mmap``, numpy array (which must be
+        contiguous) or shared memory.  Each row is written as soon as
+        it is decoded, no other copy of the image is held in memory.
+
+        The first row is written at byte `offset` in the buffer, and
+        the following rows `stride` bytes after each other (the default
+        is the size of a row, ``width * 4``), so an image can be decoded
+        into a part of a larger image, for example a texture atlas.
+
+        Returns (*width*, *height*, *metadata*).
+        """
+
+        self.preamble()
+        if self.bitdepth > 8 and numpy is None:
+            width,height,pixels,meta = self.asRGBA8(rows, columns)
+            rgba = itertools.imap(lambda row: tostring(array('B', row)),
+                                  pixels)
+        else:
+            width,height,pixels,meta = self.read(rows, columns)
+            rgba = self._iterrgba8(pixels, width)
+        meta['greyscale'] = False
+        meta['alpha'] = True
+        meta['planes'] = 4
+        meta['bitdepth'] = 8
+
+        write, size = _rowwriter(buffer)
+        rowbytes = width * 4
+        if stride is None:
+            stride = rowbytes
+        if stride < rowbytes:
+            raise ValueError("stride %d is less than the row size %d" %
+              (stride, rowbytes))
+        if offset < 0 or offset + (height - 1) * stride + rowbytes > size:
+            raise ValueError("buffer of %d bytes too small for %dx%d pixels"
+              " (stride %d, offset %d)" % (size, width, height, stride, offset))
+        for row in rgba:
+            write(offset, row)
+            offset += stride
+        return width,height,meta
+
+    def _iterrgba8(self, pixels, width):
+        """Convert rows returned by :meth:`read` to RGBA8, returns an
+        iterator which yields each row as a string (or ``bytearray``).
+        16 bit images require numpy.
+        """
+
+        if self.bitdepth > 8:
+            return self._iterrgba8_numpy(pixels, width)
+
+        # Rescaling of the samples to 8 bits, taking the sBIT chunk
+        # into account.  Palette entries are always 8 bits.
+        bitdepth = (self.bitdepth, 8)[self.colormap]
+        targetbitdepth = self._sbit_depth(bitdepth) or bitdepth
+        shift = bitdepth - targetbitdepth
+        factor = 255.0 / float(2**targetbitdepth - 1)
+        scale = [int(round((v >> shift) * factor))
+                 for v in range(2**bitdepth)]
+        scale += [0] * (256 - len(scale))
+        table = _bytetable
+        identity = scale == list(range(256))
+        scaletable = table(scale)
+
+        opaque = strtobytes('\xff') * width
+        if self.colormap:
+            plte = list(self.palette(alpha='force'))
+            # Palette indexes which are in range (they are deleted from
+            # the row to check for invalid ones).
+            valid = table(range(len(plte)))
+            plte = plte + [(0,0,0,0)] * (256 - len(plte))
+            tables = [table([scale[p[i]] for p in plte]) for i in range(4)]
+        elif self.transparent is not None:
+            transparent = self.transparent
+            if self.greyscale:
+                alphatable = table([(0xff, 0)[v == transparent[0]]
+                                    for v in range(256)])
+            else:
+                masks = _transparentmasks(transparent, 'B')
+
+        def convert(row):
+            row = tostring(row)
+            out = bytearray(width * 4)
+            if self.colormap:
+                if row.translate(None, valid):
+                    raise FormatError("Palette index out of range.")
+                for i in range(4):
+                    out[i::4] = row.translate(tables[i])
+                return out
+            if self.alpha and not self.greyscale:
+                # RGBA, nothing to convert
+                if identity:
+                    return row
+                return row.translate(scaletable)
+            if self.greyscale:
+                if self.alpha:
+                    grey = row[0::2]
+                    alpha = row[1::2].translate(scaletable)
+                else:
+                    grey = row
+                    if self.transparent is not None:
+                        alpha = row.translate(alphatable)
+                    else:
+                        alpha = opaque
+                grey = grey.translate(scaletable)
+                out[0::4] = grey
+                out[1::4] = grey
+                out[2::4] = grey
+                out[3::4] = alpha
+                return out
+            # RGB
+            channels = [row[i::3] for i in range(3)]
+            if self.transparent is not None:
+                alpha = _opaquebytes(row, masks)
+            else:
+                alpha = opaque
+            for i in range(3):
+                out[i::4] = channels[i].translate(scaletable)
+            out[3::4] = alpha
+            return out
+
+        return itertools.imap(convert, pixels)
+
+    def _iterrgba8_numpy(self, pixels, width):
+        """Like :meth:`_iterrgba8` for 16 bit images, with numpy."""
+
+        targetbitdepth = self._sbit_depth(16) or 16
+        shift = 16 - targetbitdepth
+        maxval = 2**targetbitdepth - 1
+        planes = self.planes
+        transparent = self.transparent
+        if transparent is not None:
+            transparent = numpy.array(transparent, numpy.uint16)
+        def convert(row):
+            v = numpy.frombuffer(tostring(row), numpy.uint16)
+            v = v.reshape(width, planes)
+            out = numpy.empty((width, 4), numpy.uint8)
+            scaled = ((v >> shift).astype(numpy.uint32) * 255 + maxval // 2) // maxval
+            if self.greyscale:
+                out[:,0:3] = scaled[:,0:1]
+            else:
+                out[:,0:3] = scaled[:,0:3]
+            if self.alpha:
+                out[:,3] = scaled[:,-1]
+            elif transparent is not None:
+                out[:,3] = (v != transparent).any(axis=1) * 255
+            else:
+                out[:,3] = 255
+            return out.tobytes()
+        return itertools.imap(convert, pixels)
 
-    def asRGB(self):
+    def asRGB(self, rows=None, columns=None):
         """Return image as RGB pixels.  RGB colour images are passed
         through unchanged; greyscales are expanded into RGB
         triplets (there is a small speed overhead for doing this).
@@ -2132,7 +3383,7 @@ class Reader:
         ``metadata['greyscale']`` will be ``False``.
         """
 
-        width,height,pixels,meta = self.asDirect()
+        width,height,pixels,meta = self.asDirect(rows, columns)
         if meta['alpha']:
             raise Error("will not convert image with alpha channel to RGB")
         if not meta['greyscale']:
@@ -2147,7 +3398,7 @@ class Reader:
                 yield a
         return width,height,iterrgb(),meta
 
-    def asRGBA(self):
+    def asRGBA(self, rows=None, columns=None):
         """Return image as RGBA pixels.  Greyscales are expanded into
         RGB triplets; an alpha channel is synthesized if necessary.
         The return values are as for the :meth:`read` method
@@ -2157,7 +3408,7 @@ class Reader:
         ``metadata['alpha']`` will be ``True``.
         """
 
-        width,height,pixels,meta = self.asDirect()
+        width,height,pixels,meta = self.asDirect(rows, columns)
         if meta['alpha'] and not meta['greyscale']:
             return width,height,pixels,meta
         typecode = 'BH'[meta['bitdepth'] > 8]
@@ -2199,6 +3450,279 @@ class Reader:
         meta['greyscale'] = False
         return width,height,convert(),meta
 
+def probe(filename):
+    """Read the header of a PNG file, without decoding the image.  Only
+    the signature and the chunks before the first ``IDAT`` chunk are
+    read (the file is memory mapped, so the rest of the file is never
+    touched).
+
+    Returns a dictionary with the keys ``width``, ``height``, ``size``,
+    ``bitdepth``, ``color_type``, ``greyscale``, ``alpha``,
+    ``colormap``, ``planes``, ``interlace``, ``gamma`` (``None`` if
+    there is no ``gAMA`` chunk), ``transparent`` (the transparent
+    colour from a ``tRNS`` chunk of a greyscale or RGB image, or
+    ``None``), and ``transparency``, which is ``True`` if the image
+    has an alpha channel or a ``tRNS`` chunk.
+    """
+
+    r = Reader(filename=filename, mmap=True)
+    try:
+        r.preamble()
+    finally:
+        if r.buffer is not None:
+            r.buffer.close()
+        else:
+            r.file.close()
+    return dict(width=r.width, height=r.height,
+                size=(r.width, r.height),
+                bitdepth=r.bitdepth,
+                color_type=r.color_type,
+                greyscale=r.greyscale,
+                alpha=r.alpha,
+                colormap=r.colormap,
+                planes=r.planes,
+                interlace=r.interlace,
+                gamma=getattr(r, 'gamma', None),
+                transparent=r.transparent,
+                transparency=bool(r.alpha or r.trns))
+
+def decode_many(paths, mode='rgba8', workers=None):
+    """Decode the PNG files `paths` in parallel, in a pool of `workers`
+    processes (default: the number of CPUs).  Returns an iterator which
+    yields (*path*, *width*, *height*, *pixels*, *metadata*) for each
+    file as soon as it is decoded, so in the order of completion, not
+    in the order of `paths`.
+
+    The only `mode` is ``'rgba8'``: *pixels* is a ``bytearray`` of
+    RGBA pixels with 8 bits per sample, as returned by
+    :meth:`Reader.read_rgba8_packed` (and so is *metadata*).
+
+    The size of each image is read (see :func:`probe`) before it is
+    handed to a worker, which decodes it (with :meth:`Reader.readinto`)
+    into a block of shared memory (``multiprocessing.shared_memory``,
+    or on older Pythons a memory mapped temporary file, in /dev/shm if
+    available), so the pixels are not pickled.  At most twice as many
+    images as workers are decoded (or waiting to be collected) at a
+    time, to limit the memory use.
+
+    An error reading or decoding a file is raised when its result
+    would be yielded; an error reading the header of a file (with
+    :func:`probe`) only once the files before it in `paths` have been
+    yielded.  A worker process that dies or a result that cannot be
+    sent back also raise an exception, instead of waiting forever
+    (without ``concurrent.futures``, a dead worker raises
+    :class:`Error`).  Like all uses of
+    ``multiprocessing``, the calling module must be importable without
+    side effects (guarded by ``if __name__ == '__main__'``) where
+    processes are spawned.
+    """
+
+    import multiprocessing
+    try:
+        import concurrent.futures as futures
+    except ImportError:
+        futures = None
+
+    if mode != 'rgba8':
+        raise ValueError("mode must be 'rgba8'")
+    paths = list(paths)
+    if not paths:
+        return
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    try:
+        # Start the resource tracker before the workers, so that they
+        # share it and the shared memory they attach to is seen as
+        # released when this process unlinks it.
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+    except ImportError:
+        pass
+    if futures is not None:
+        # A dead worker breaks the pool, which fails its futures.
+        pool = futures.ProcessPoolExecutor(min(workers, len(paths)))
+        submit = pool.submit
+    else:
+        pool = multiprocessing.Pool(min(workers, len(paths)))
+        def submit(function, arg):
+            return pool.apply_async(function, (arg,))
+        # The pool replaces a worker that dies, but the result of the
+        # file it was decoding never arrives; the workers are watched
+        # instead.
+        processes = list(pool._pool)
+    # Maps the index in `paths` to (*path*, *shared*, *result*), where
+    # *result* is the future (or AsyncResult) of the worker, or the
+    # exception raised when reading the header.
+    pending = {}
+    maxpending = 2 * workers
+    submitted = 0
+    try:
+        while submitted < len(paths) or pending:
+            while submitted < len(paths) and len(pending) < maxpending:
+                path = paths[submitted]
+                try:
+                    info = probe(path)
+                except Exception:
+                    pending[submitted] = (path, None, sys.exc_info()[1])
+                else:
+                    shared = _SharedBuffer(info['width'] * info['height'] * 4)
+                    try:
+                        result = submit(_decodeinto, (path, shared.name))
+                    except:
+                        shared.release()
+                        raise
+                    pending[submitted] = (path, shared, result)
+                submitted += 1
+            if futures is not None:
+                index = _firstdone(pending, futures)
+            else:
+                index = _firstdone(pending, futures, processes)
+            path, shared, result = pending.pop(index)
+            if shared is None:
+                raise result
+            try:
+                if futures is not None:
+                    width, height, meta = result.result()
+                else:
+                    width, height, meta = result.get()
+                pixels = shared.read()
+            finally:
+                shared.release()
+            yield path, width, height, pixels, meta
+    finally:
+        # All the work is done, unless an error occurred or the
+        # iterator was not exhausted.
+        if futures is not None:
+            for path, shared, result in pending.values():
+                if shared is not None:
+                    result.cancel()
+            pool.shutdown(wait=True)
+        else:
+            pool.terminate()
+            pool.join()
+        for path, shared, result in pending.values():
+            if shared is not None:
+                shared.release()
+
+def _firstdone(pending, futures, processes=()):
+    """Wait for one of the `pending` results of :func:`decode_many` and
+    return its index.  A file whose header could not be read is only
+    done when it is the first of the pending files, so that the files
+    before it are yielded before its error is raised.  Without
+    `futures`, :class:`Error` is raised if one of the worker
+    `processes` of the ``multiprocessing.Pool`` has died.
+    """
+
+    first = min(pending)
+    if pending[first][1] is None:
+        return first
+    running = dict((result, index)
+                   for index, (path, shared, result) in pending.items()
+                   if shared is not None)
+    if futures is not None:
+        done, _ = futures.wait(list(running),
+                               return_when=futures.FIRST_COMPLETED)
+        return min(running[result] for result in done)
+    while True:
+        for result, index in sorted(running.items(), key=lambda x: x[1]):
+            if result.ready():
+                return index
+        for process in processes:
+            if process.exitcode is not None:
+                raise Error("decode_many worker process died (exit code %d)"
+                            % process.exitcode)
+        pending[first][2].wait(0.05)
+
+class _SharedBuffer:
+    """
+    Memory shared with the worker processes of :func:`decode_many`: a
+    ``multiprocessing.shared_memory`` block if available, otherwise a
+    temporary file (in /dev/shm, which is in memory, if available)
+    which the workers map into memory.  `name` identifies the memory
+    for :func:`_decodeinto`.
+    """
+
+    def __init__(self, size):
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            shared_memory = None
+
+        self.size = size
+        if shared_memory is not None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.name = ('shm', self.shm.name, size)
+        else:
+            import os
+            import tempfile
+
+            self.shm = None
+            directory = None
+            if os.path.isdir('/dev/shm'):
+                directory = '/dev/shm'
+            fd, path = tempfile.mkstemp(prefix='png', dir=directory)
+            try:
+                os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+            self.name = ('file', path, size)
+
+    def read(self):
+        """Return a copy of the shared memory, as a ``bytearray``."""
+
+        if self.shm is not None:
+            return bytearray(self.shm.buf[:self.size])
+        f = open(self.name[1], 'rb')
+        try:
+            return bytearray(f.read())
+        finally:
+            f.close()
+
+    def release(self):
+        """Free the shared memory."""
+
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+        else:
+            import os
+            os.remove(self.name[1])
+
+def _decodeinto(args):
+    """Decode a PNG file into the shared memory of a
+    :class:`_SharedBuffer`, in a worker process of :func:`decode_many`.
+    `args` is a tuple (*path*, *name*).  Returns (*width*, *height*,
+    *metadata*); an error decoding the file is raised (and so raised
+    again by :func:`decode_many`).
+    """
+
+    path, (kind, key, size) = args
+    if kind == 'shm':
+        from multiprocessing import shared_memory
+        shared = shared_memory.SharedMemory(name=key)
+        buffer = shared.buf[:size]
+    else:
+        shared = open(key, 'r+b')
+        buffer = mmap.mmap(shared.fileno(), size)
+    try:
+        r = Reader(filename=path, mmap=True)
+        try:
+            return r.readinto(buffer)
+        finally:
+            if r.buffer is not None:
+                r.buffer.close()
+            else:
+                r.file.close()
+    finally:
+        if kind == 'shm':
+            buffer.release()
+        else:
+            buffer.close()
+        shared.close()
+
 
 # === Legacy Version Support ===
 
@@ -2694,6 +4218,433 @@ class Test(unittest.TestCase):
             data = zlib.compress(data)
             return (chunk[0], data)
         self.assertRaises(FormatError, self.helperFormat, eachchunk)
+    def testUndoFilter(self):
+        """Undo each filter type, with and without numpy."""
+        import random
+        global numpy
+
+        rnd = random.Random(38)
+        r = Reader(bytes=strtobytes(''))
+        saved = numpy
+        try:
+            for use_numpy in (True, False):
+                if not use_numpy:
+                    numpy = None
+                for psize in (1, 2, 3, 4, 6, 8):
+                    r.psize = psize
+                    n = psize * 37
+                    line = array('B', [rnd.randrange(256) for i in range(n)])
+                    prev = array('B', [rnd.randrange(256) for i in range(n)])
+                    for type in range(5):
+                        filtered = filter_scanline(type, line, psize, prev)
+                        got = r.undo_filter(type, filtered[1:], prev)
+                        self.assertEqual(list(got), list(line))
+                    for type in (0, 1, 3):
+                        filtered = filter_scanline(type, line, psize)
+                        got = r.undo_filter(type, filtered[1:], None)
+                        self.assertEqual(list(got), list(line))
+        finally:
+            numpy = saved
+    def testFilterType(self):
+        """Write with each filter type, with and without numpy."""
+        global numpy
+
+        saved = numpy
+        try:
+            for use_numpy in (True, False):
+                if not use_numpy:
+                    numpy = None
+                for kw in (dict(), dict(alpha=True), dict(bitdepth=16),
+                           dict(greyscale=True, bitdepth=4)):
+                    for interlace in (False, True):
+                        for filter_type in (0, 1, 2, 3, 4, 'adaptive'):
+                            w = Writer(13, 11, interlace=interlace,
+                                       filter_type=filter_type, **kw)
+                            maxval = 2**w.bitdepth - 1
+                            rows = [[(x*x + 3*y*x + y) % (maxval + 1)
+                                     for x in range(13*w.planes)]
+                                    for y in range(11)]
+                            o = BytesIO()
+                            w.write(o, rows)
+                            r = Reader(bytes=o.getvalue())
+                            x,y,pixels,meta = r.read()
+                            self.assertEqual(map(list, pixels), rows)
+        finally:
+            numpy = saved
+    def testAdaptiveFilter(self):
+        """Adaptive filtering chooses a good filter for a gradient."""
+        rows = [[(x + y) & 0xff for x in range(64)] for y in range(64)]
+        sizes = []
+        for filter_type in (0, 'adaptive'):
+            o = BytesIO()
+            Writer(64, 64, greyscale=True,
+                   filter_type=filter_type).write(o, rows)
+            sizes.append(len(o.getvalue()))
+        self.assertTrue(sizes[1] < sizes[0])
+    def testMmap(self):
+        """Read a memory mapped file."""
+        import os
+
+        data = _pngsuite['basi2c16']
+        f = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+        try:
+            f.write(data)
+            f.close()
+            r = Reader(filename=f.name, mmap=True)
+            self.assertTrue(r.file is None)
+            x,y,pixels,meta = r.read()
+            expected = Reader(bytes=data).read()[2]
+            self.assertEqual(map(list, pixels), map(list, expected))
+            del r
+            # An empty file can't be mapped, it is read instead.
+            open(f.name, 'wb').close()
+            r = Reader(filename=f.name, mmap=True)
+            self.assertRaises(FormatError, r.read)
+            r.file.close()
+        finally:
+            os.remove(f.name)
+    def testProbe(self):
+        """Probe the header of PNG files."""
+        import os
+
+        f = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+        try:
+            f.write(_pngsuite['tbbn1g04'])
+            f.close()
+            info = probe(f.name)
+            self.assertEqual(info['size'], (32, 32))
+            self.assertEqual(info['bitdepth'], 4)
+            self.assertEqual(info['color_type'], 0)
+            self.assertEqual(info['interlace'], 0)
+            self.assertEqual(info['gamma'], 1.0)
+            self.assertEqual(info['transparent'], (7,))
+            self.assertTrue(info['transparency'])
+            # Without any IDAT data it still works...
+            data = _pngsuite['basi3p08']
+            open(f.name, 'wb').write(data[:data.index(strtobytes('IDAT'))+4])
+            info = probe(f.name)
+            self.assertEqual(info['size'], (32, 32))
+            self.assertEqual(info['color_type'], 3)
+            self.assertEqual(info['interlace'], 1)
+            self.assertEqual(info['transparent'], None)
+            self.assertFalse(info['transparency'])
+            # ... but not without the IHDR chunk.
+            open(f.name, 'wb').write(data[:12])
+            self.assertRaises(FormatError, probe, f.name)
+        finally:
+            os.remove(f.name)
+    def testWindow(self):
+        """Decode a window of the image."""
+        for name in ('basn0g01', 'basn0g02', 'basn0g04', 'basn0g16',
+                     'basn2c08', 'basn2c16', 'basi2c08', 'basi0g04',
+                     'tbrn2c08'):
+            data = _pngsuite[name]
+            x,y,pixels,meta = Reader(bytes=data).asDirect()
+            planes = meta['planes']
+            expected = [list(row)[5*planes:23*planes]
+                        for row in list(pixels)[3:17]]
+            x,y,pixels,meta = Reader(bytes=data).asDirect(rows=(3,17),
+                                                          columns=(5,23))
+            self.assertEqual((x, y), (18, 14))
+            self.assertEqual(meta['size'], (18, 14))
+            self.assertEqual(map(list, pixels), expected)
+        x,y,pixels,meta = Reader(bytes=data).asRGBA8(rows=(30,None),
+                                                     columns=(-1,100))
+        self.assertEqual((x, y), (32, 2))
+        self.assertEqual(len(list(pixels)), 2)
+        self.assertRaises(ValueError, Reader(bytes=data).read, (10,10))
+    def testWindowEarlyStop(self):
+        """Decoding a window stops after its last row."""
+        rows = [[(x * y) & 0xff for x in range(256)] for y in range(256)]
+        raw = array('B')
+        for row in rows:
+            raw.append(0)
+            raw.extend(row)
+        idat = zlib.compress(tostring(raw))
+        o = BytesIO()
+        write_chunks(o, [('IHDR', struct.pack('!2I5B', 256, 256, 8, 0, 0, 0, 0))] +
+                        [('IDAT', idat[i:i+256]) for i in range(0, len(idat), 256)] +
+                        [('IEND', strtobytes(''))])
+        r = Reader(bytes=o.getvalue())
+        x,y,pixels,meta = r.read(rows=(2,4))
+        self.assertEqual(map(list, pixels), rows[2:4])
+        self.assertTrue(r.offset < len(o.getvalue()) // 2)
+    def testRGBA8Packed(self):
+        """Read all images as packed RGBA8, with and without numpy."""
+        global numpy
+
+        def expected(data):
+            width,height,pixels,meta = Reader(bytes=data).asDirect()
+            maxval = 2**meta['bitdepth'] - 1
+            planes = meta['planes']
+            out = bytearray()
+            for row in pixels:
+                row = [int(round(v*255.0/maxval)) for v in row]
+                for x in range(0, len(row), planes):
+                    pixel = row[x:x+planes]
+                    if planes < 3:
+                        pixel = pixel[:1]*3 + pixel[1:]
+                    if len(pixel) == 3:
+                        pixel.append(255)
+                    out.extend(pixel)
+            return out
+
+        o = BytesIO()
+        Writer(3, 2, bitdepth=16, transparent=(1,2,3)).write(o,
+            [[1,2,3, 1,2,4, 0,0,0], [65535,2,3, 1,2,3, 300,2,3]])
+        images = [o.getvalue()] + _pngsuite.values()
+        saved = numpy
+        try:
+            for use_numpy in (True, False):
+                if not use_numpy:
+                    numpy = None
+                for data in images:
+                    x,y,pixels,meta = Reader(bytes=data).read_rgba8_packed()
+                    self.assertTrue(isinstance(pixels, bytearray))
+                    self.assertEqual(len(pixels), x * y * 4)
+                    self.assertEqual(pixels, expected(data))
+                    self.assertEqual((meta['planes'], meta['bitdepth']), (4, 8))
+        finally:
+            numpy = saved
+        data = _pngsuite['tbgn3p08']
+        x,y,full,meta = Reader(bytes=data).read_rgba8_packed()
+        x,y,pixels,meta = Reader(bytes=data).read_rgba8_packed(rows=(1,3),
+                                                               columns=(2,5))
+        self.assertEqual((x, y), (3, 2))
+        self.assertEqual(pixels, full[32*4+2*4:32*4+5*4] +
+                                 full[64*4+2*4:64*4+5*4])
+    def testReadinto(self):
+        """Decode into different kinds of buffer."""
+        import mmap
+
+        data = _pngsuite['basn2c16']
+        x,y,expected,meta = Reader(bytes=data).read_rgba8_packed()
+        stride = 32 * 4 + 8
+        size = 3 + stride * 32
+        def check(buffer, contents):
+            self.assertEqual(Reader(bytes=data).readinto(buffer, stride, 3),
+                             (32, 32, meta))
+            out = bytearray(contents(buffer)[3:])
+            for y in range(32):
+                self.assertEqual(out[y*stride:y*stride+32*4],
+                                 expected[y*32*4:(y+1)*32*4])
+        check(bytearray(size), bytes)
+        check(array('B', [0]) * size, tostring)
+        m = mmap.mmap(-1, size)
+        check(m, lambda m: m[:])
+        m.close()
+        try:
+            import numpy
+        except ImportError:
+            print("skipping numpy test", file=sys.stderr)
+        else:
+            check(numpy.zeros(size, numpy.uint8), lambda a: a.tobytes())
+        self.assertRaises(ValueError, Reader(bytes=data).readinto,
+                          bytearray(size - 9), stride, 3)
+        self.assertRaises(ValueError, Reader(bytes=data).readinto,
+                          bytearray(size), 32 * 4 - 1)
+    def testParallelCompression(self):
+        """Compress with several threads."""
+        rows = [[(x * y + x // 7) & 0xff for x in range(300)]
+                for y in range(200)]
+        for compression in (None, 1, 9):
+            o = BytesIO()
+            Writer(100, 200, compression=compression, compression_workers=3,
+                   compression_block_size=5000).write(o, rows)
+            r = Reader(bytes=o.getvalue())
+            x,y,pixels,meta = r.read()
+            self.assertEqual(map(list, pixels), rows)
+            # The checksum is verified by zlib.decompress
+            r = Reader(bytes=o.getvalue())
+            r.preamble()
+            idat = strtobytes('').join(data for type,data in r.chunks()
+                                       if type == 'IDAT')
+            self.assertEqual(len(zlib.decompress(idat)), 200 * 301)
+        # The threads are stopped when writing fails.
+        import threading
+
+        def failing():
+            for row in rows[:100]:
+                yield row
+            raise ValueError('no more rows')
+        threads = threading.active_count()
+        w = Writer(100, 200, compression_workers=3)
+        self.assertRaises(ValueError, w.write, BytesIO(), failing())
+        self.assertEqual(threading.active_count(), threads)
+    def testDecodeMany(self):
+        """Decode files in worker processes."""
+        import os
+        import shutil
+
+        directory = tempfile.mkdtemp()
+        try:
+            names = ['basn0g02', 'basi3p08', 'tbrn2c08', 'basn6a08',
+                     'basn0g16']
+            paths = []
+            for name in names:
+                path = os.path.join(directory, name + '.png')
+                f = open(path, 'wb')
+                f.write(_pngsuite[name])
+                f.close()
+                paths.append(path)
+            results = list(decode_many(paths, workers=2))
+            self.assertEqual(sorted(r[0] for r in results), sorted(paths))
+            for path, width, height, pixels, meta in results:
+                expected = Reader(filename=path).read_rgba8_packed()
+                self.assertEqual((width, height, pixels), expected[:3])
+                self.assertEqual(meta, expected[3])
+            # A broken file.
+            f = open(paths[0], 'r+b')
+            f.seek(60)
+            f.write(strtobytes('broken'))
+            f.close()
+            self.assertRaises(Error, list, decode_many(paths[:1]))
+            # A missing file is only raised after the files before it.
+            missing = os.path.join(directory, 'missing.png')
+            results = decode_many([paths[1], missing, paths[2]], workers=1)
+            self.assertEqual(next(results)[0], paths[1])
+            self.assertRaises(EnvironmentError, next, results)
+            # A worker process which dies.
+            readinto = Reader.readinto
+            Reader.readinto = lambda self, buffer: os._exit(3)
+            try:
+                self.assertRaises((Error, RuntimeError), list,
+                                  decode_many(paths[1:3]))
+            finally:
+                Reader.readinto = readinto
+            self.assertEqual(list(decode_many([])), [])
+        finally:
+            shutil.rmtree(directory)
+    def testDirectTransparent(self):
+        """asDirect synthesizes alpha from tRNS for all bit depths."""
+        # The alpha of the pixels with the transparent colour (a
+        # transparent colour out of range matches no pixel).
+        for kw, transparent, clear in [
+          (dict(greyscale=True, bitdepth=2), 1, 0),
+          (dict(greyscale=True, bitdepth=16), 0x1234, 0),
+          (dict(bitdepth=8), (1, 2, 3), 0),
+          (dict(bitdepth=16), (0x100, 1, 0xffff), 0),
+          (dict(greyscale=True, bitdepth=8), 300, 255)]:
+            planes = (3, 1)[kw.get('greyscale', False)]
+            maxval = 2**kw['bitdepth'] - 1
+            pixel = transparent
+            if planes == 1:
+                pixel = (transparent,)
+            pixel = [v & maxval for v in pixel]
+            other = [maxval - v for v in pixel]
+            rows = [pixel + other + pixel, other + other + pixel]
+            o = BytesIO()
+            Writer(3, 2, transparent=transparent, **kw).write(o, rows)
+            x,y,pixels,meta = Reader(bytes=o.getvalue()).asDirect()
+            self.assertEqual(meta['planes'], planes + 1)
+            self.assertEqual(map(list, pixels),
+                             [pixel + [clear] + other + [maxval] +
+                              pixel + [clear],
+                              other + [maxval] + other + [maxval] +
+                              pixel + [clear]])
+    def testSamplePacking(self):
+        """Table driven packing and unpacking of samples."""
+        allbytes = array('B', range(256))
+        for bitdepth in (1, 2, 4):
+            spb = 8 // bitdepth
+            mask = 2**bitdepth - 1
+            values = [(b >> (bitdepth * (spb - 1 - k))) & mask
+                      for b in range(256) for k in range(spb)]
+            self.assertEqual(list(_unpacksamples(allbytes, bitdepth)),
+                             values)
+            self.assertEqual(_packsamples(values, bitdepth),
+                             tostring(allbytes))
+            # Rows padded to a whole byte.
+            width = spb + 1
+            packed = _packsamples(values[:width], bitdepth)
+            self.assertEqual(len(packed), 2)
+            self.assertEqual(list(_unpacksamples(packed * 3, bitdepth, width)),
+                             values[:width] * 3)
+        values = [0, 1, 255, 256, 0x1234, 0xffff]
+        packed = _pack16(values)
+        self.assertEqual(packed, struct.pack('!6H', *values))
+        self.assertEqual(list(_unpack16(array('B', packed))), values)
+    def testInterlacedSizes(self):
+        """Write and read interlaced images pass by pass."""
+        for width, height in [(1, 1), (3, 1), (1, 9), (5, 6), (13, 17)]:
+            for kw in [dict(greyscale=True, bitdepth=1),
+                       dict(greyscale=True, bitdepth=4),
+                       dict(alpha=True),
+                       dict(bitdepth=16)]:
+                planes = kw.get('greyscale') and 1 or 3 + kw.get('alpha', 0)
+                maxval = 2**kw.get('bitdepth', 8) - 1
+                rows = [[(x * 7 + y * 131) % (maxval + 1)
+                         for x in range(width * planes)]
+                        for y in range(height)]
+                o = BytesIO()
+                Writer(width, height, interlace=True,
+                       **kw).write(o, iter(rows))
+                r = Reader(bytes=o.getvalue())
+                x,y,pixels,meta = r.read()
+                self.assertTrue(meta['interlace'])
+                self.assertEqual(map(list, pixels), rows)
+                # The joined passes are a valid zlib stream.
+                r = Reader(bytes=o.getvalue())
+                r.preamble()
+                idat = strtobytes('').join(data for type,data in r.chunks()
+                                           if type == 'IDAT')
+                zlib.decompress(idat)
+                if width == 1 or height < 3:
+                    continue
+                x,y,pixels,meta = Reader(bytes=o.getvalue()).read(
+                  rows=(height // 3, height - 1), columns=(1, None))
+                self.assertEqual(map(list, pixels),
+                                 [row[planes:]
+                                  for row in rows[height // 3:height - 1]])
+    def testOptimize(self):
+        """Lossless reductions of the optimizer."""
+        def check(rows, **kw):
+            plain = BytesIO()
+            Writer(16, 16, **kw).write(plain, rows)
+            o = BytesIO()
+            Writer(16, 16, optimize=True, compression_workers=2,
+                   **kw).write(o, rows)
+            self.assertTrue(len(o.getvalue()) <= len(plain.getvalue()))
+            expected = list(Reader(bytes=plain.getvalue()).asRGBA8()[2])
+            x,y,pixels,meta = Reader(bytes=o.getvalue()).asRGBA8()
+            self.assertEqual(map(list, pixels), map(list, expected))
+            r = Reader(bytes=o.getvalue())
+            meta = r.read()[3]
+            if r.plte:
+                meta['palette'] = r.palette()
+            return meta
+        # Opaque grey RGBA with 4 levels: 2-bit greyscale or palette.
+        rows = [[(x ^ y) % 4 * 85] * 3 + [255] for y in range(16)
+                for x in range(16)]
+        rows = [sum(rows[y*16:y*16+16], []) for y in range(16)]
+        meta = check(rows, alpha=True)
+        self.assertEqual(meta['bitdepth'], 2)
+        self.assertFalse(meta['alpha'])
+        # Translucent colours: a palette with tRNS.
+        colours = [[i * 30, i % 3 * 90, 255 - i * 20, (128, 255)[i % 2]]
+                   for i in range(8)]
+        rows = [sum([colours[(x*x*7 + y*13 + x*y) % 8] for x in range(16)],
+                    []) for y in range(16)]
+        meta = check(rows, alpha=True)
+        self.assertEqual(meta['bitdepth'], 4)
+        self.assertEqual(len(meta['palette']), 8)
+        # 16-bit values which are 8-bit values times 257.
+        rows = [[(x*y & 0xff) * 257 for x in range(48)] for y in range(16)]
+        meta = check(rows, bitdepth=16)
+        self.assertTrue(meta['bitdepth'] <= 8)
+        # Nothing to reduce.
+        rows = [[(x*y*1001) & 0xffff for x in range(48)] for y in range(16)]
+        meta = check(rows, bitdepth=16, interlace=True)
+        self.assertEqual(meta['bitdepth'], 16)
+    def testChunkView(self):
+        """Chunks of PNG data in memory are not copied."""
+        r = Reader(bytes=_pngsuite['basn0g02'])
+        r.preamble()
+        type, data = r.chunkview()
+        self.assertEqual(type, 'IDAT')
+        self.assertFalse(isinstance(data, str))
+        self.assertEqual(_viewtobytes(data),
+                         Reader(bytes=_pngsuite['basn0g02']).chunk('IDAT')[1])
     def testFlat(self):
         """Test read_flat."""
         import hashlib
@@ -3682,6 +5633,9 @@ def _main(argv):
     parser.add_option("-c", "--compression",
                       action="store", type="int", metavar="level",
                       help="zlib compression level (0-9)")
+    parser.add_option("-O", "--optimize",
+                      default=False, action="store_true",
+                      help="write the smallest PNG file found by trying lossless reductions and compression settings")
     parser.add_option("-T", "--test",
                       default=False, action="store_true",
                       help="create a test image (a named PngSuite image if an argument is supplied)")
@@ -3776,7 +5730,8 @@ def _main(argv):
                         background=options.background,
                         alpha=bool(pamalpha or options.alpha),
                         gamma=options.gamma,
-                        compression=options.compression)
+                        compression=options.compression,
+                        optimize=options.optimize)
         if options.alpha:
             pgmfile = open(options.alpha, 'rb')
             format, awidth, aheight, adepth, amaxval = \
@@ -0,0 +1,143 @@
+'''
+Profiling hooks for the code generators and texexport.
+
+Enabled by setting the environment variable ORYOL_GEN_PROFILE to the
+path of a trace file, which is written when the process exits, in
+Chrome trace event format (open it in chrome://tracing or Perfetto).
+A '{pid}' in the path is replaced with the process id, for running
+several generator processes at the same time.
+
+The trace contains the generator phases, each tool process started
+through util/runner.py, and the Python heap size (current and peak)
+at the end of each phase if tracemalloc is available.
+
+Additionally, if ORYOL_GEN_CPROFILE is set to a path, a cProfile dump
+(to be loaded with the pstats module) is written there.
+'''
+import os, sys, time, json, threading, atexit
+try :
+    import tracemalloc
+except ImportError :
+    tracemalloc = None
+try :
+    import resource
+except ImportError :
+    resource = None
+
+TracePath = os.environ.get('ORYOL_GEN_PROFILE')
+ProfilePath = os.environ.get('ORYOL_GEN_CPROFILE')
+Enabled = bool(TracePath)
+
+startTime = time.time()
+events = []
+eventsLock = threading.Lock()
+cProfiler = None
+
+#-------------------------------------------------------------------------------
+def timestamp(t) :
+    # trace event timestamps are in microseconds
+    return int((t - startTime) * 1000000)
+
+#-------------------------------------------------------------------------------
+def event(name, cat, start, end, args=None) :
+    '''
+    Record a completed event which started and ended at the given
+    times (from time.time()).
+    '''
+    if not Enabled :
+        return
+    e = {
+        'name': name,
+        'cat': cat,
+        'ph': 'X',
+        'ts': timestamp(start),
+        'dur': timestamp(end) - timestamp(start),
+        'pid': os.getpid(),
+        'tid': threading.current_thread().ident
+    }
+    if args :
+        e['args'] = args
+    with eventsLock :
+        events.append(e)
+
+#-------------------------------------------------------------------------------
+def memory(t) :
+    if tracemalloc is not None and tracemalloc.is_tracing() :
+        current, peak = tracemalloc.get_traced_memory()
+        with eventsLock :
+            events.append({
+                'name': 'python heap',
+                'ph': 'C',
+                'ts': timestamp(t),
+                'pid': os.getpid(),
+                'args': { 'current_kb': current // 1024, 'peak_kb': peak // 1024 }
+            })
+
+#-------------------------------------------------------------------------------
+class Scope :
+    '''
+    Context manager which records the time spent in a with-block.
+    '''
+    def __init__(self, name, cat, args) :
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self) :
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback) :
+        if Enabled :
+            end = time.time()
+            event(self.name, self.cat, self.start, end, self.args)
+            memory(end)
+        return False
+
+#-------------------------------------------------------------------------------
+def scope(name, cat='phase', **args) :
+    '''
+    Profile a with-block, e.g.
+
+        with profiler.scope('parse', input=path) :
+            ...
+    '''
+    return Scope(name, cat, args)
+
+#-------------------------------------------------------------------------------
+def write() :
+    '''
+    Write the trace file (called at process exit).
+    '''
+    if cProfiler is not None :
+        cProfiler.disable()
+        cProfiler.dump_stats(ProfilePath.replace('{pid}', str(os.getpid())))
+    meta = {
+        'argv': sys.argv,
+        'python': sys.version.split()[0]
+    }
+    if tracemalloc is not None and tracemalloc.is_tracing() :
+        meta['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+    elif resource is not None :
+        # process-wide high water mark, in bytes on OSX, KBytes on Linux
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        meta['peak_memory_kb'] = maxrss // 1024 if sys.platform == 'darwin' else maxrss
+    path = TracePath.replace('{pid}', str(os.getpid()))
+    with eventsLock :
+        trace = {
+            'traceEvents': list(events),
+            'displayTimeUnit': 'ms',
+            'otherData': meta
+        }
+    with open(path, 'w') as f :
+        json.dump(trace, f, sort_keys=True)
+
+#-------------------------------------------------------------------------------
+if Enabled :
+    if tracemalloc is not None :
+        tracemalloc.start()
+    if ProfilePath :
+        import cProfile
+        cProfiler = cProfile.Profile()
+        cProfiler.enable()
+    atexit.register(write)
@@ -0,0 +1,174 @@
+'''
+Shared subprocess runner for the shader compiler wrappers.
+
+Reads stdout and stderr of the child process concurrently (so that a
+tool which writes a lot of output to one pipe can't deadlock), limits
+the number of concurrently running tools, and kills tools which don't
+finish within a timeout.
+
+The number of concurrent tool processes can be configured with
+the ORYOL_GEN_JOBS environment variable (default is the number of
+CPU cores), the timeout in seconds with ORYOL_GEN_TIMEOUT (default
+is 300 seconds).
+'''
+import os, time, subprocess, threading, multiprocessing
+import genutil as util
+from util import profiler
+try :
+    import concurrent.futures as futures
+except ImportError :
+    futures = None
+try :
+    import asyncio
+except ImportError :
+    asyncio = None
+
+#-------------------------------------------------------------------------------
+def getMaxJobs() :
+    jobs = int(os.environ.get('ORYOL_GEN_JOBS', '0'))
+    if jobs <= 0 :
+        try :
+            jobs = multiprocessing.cpu_count()
+        except NotImplementedError :
+            jobs = 1
+    return jobs
+
+MaxJobs = getMaxJobs()
+DefaultTimeout = float(os.environ.get('ORYOL_GEN_TIMEOUT', '300'))
+
+# limits the number of tool processes running at the same time
+jobSlots = threading.BoundedSemaphore(MaxJobs)
+
+# thread pool for submit() and runAsync(), created on demand
+executor = None
+executorLock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+class Result :
+    '''
+    The result of running a tool.
+    '''
+    def __init__(self, cmd, returncode, stdout, stderr, timedOut, timeout) :
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timedOut = timedOut
+        self.timeout = timeout
+
+    def output(self) :
+        '''
+        Return the combined stdout and stderr output.
+        '''
+        return self.stdout + self.stderr
+
+#-------------------------------------------------------------------------------
+def run(cmd, timeout=None, cwd=None) :
+    '''
+    Run a tool and wait for it to finish, returns a Result object.
+    Blocks while MaxJobs tools are already running.
+    '''
+    if timeout is None :
+        timeout = DefaultTimeout
+    queued = time.time()
+    jobSlots.acquire()
+    start = time.time()
+    try :
+        child = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+        killed = []
+        def kill() :
+            killed.append(True)
+            try :
+                child.kill()
+            except OSError :
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try :
+            # communicate() reads both pipes concurrently
+            out, err = child.communicate()
+        finally :
+            timer.cancel()
+            timer.join()
+    finally :
+        jobSlots.release()
+    profiler.event(os.path.basename(cmd[0]), 'tool', start, time.time(), {
+        'cmd': ' '.join(cmd),
+        'returncode': child.returncode,
+        'wait_ms': int((start - queued) * 1000)
+    })
+    return Result(cmd, child.returncode,
+        out.decode('utf-8', 'replace'), err.decode('utf-8', 'replace'),
+        len(killed) > 0, timeout)
+
+#-------------------------------------------------------------------------------
+def timeoutMessage(result) :
+    return "'{}' timed out after {} seconds".format(os.path.basename(result.cmd[0]), result.timeout)
+
+#-------------------------------------------------------------------------------
+def checkTimeout(result) :
+    '''
+    Terminate with an error message if a tool has timed out.
+    '''
+    if result.timedOut :
+        util.fmtError(timeoutMessage(result))
+
+#-------------------------------------------------------------------------------
+class Job :
+    '''
+    Minimal future object for submit() if concurrent.futures
+    isn't available (Python 2 without the 'futures' backport).
+    '''
+    def __init__(self, func, args) :
+        self.value = None
+        self.error = None
+        self.thread = threading.Thread(target=self.work, args=(func, args))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self, func, args) :
+        try :
+            self.value = func(*args)
+        except BaseException as e :
+            # including SystemExit from genutil.fmtError()
+            self.error = e
+
+    def result(self) :
+        self.thread.join()
+        if self.error is not None :
+            raise self.error
+        return self.value
+
+#-------------------------------------------------------------------------------
+def submitCall(func, *args) :
+    '''
+    Start running a python function in a background thread (e.g. a 
+    sequence of tool runs), returns a future object, call result() on
+    it to wait for the return value. The function must not wait for
+    other background jobs.
+    '''
+    global executor
+    if futures is None :
+        return Job(func, args)
+    with executorLock :
+        if executor is None :
+            executor = futures.ThreadPoolExecutor(max_workers=MaxJobs)
+    return executor.submit(func, *args)
+
+#-------------------------------------------------------------------------------
+def submit(cmd, timeout=None, cwd=None) :
+    '''
+    Start running a tool in the background, returns a future object,
+    call result() on it to wait for the Result.
+    '''
+    return submitCall(run, cmd, timeout, cwd)
+
+#-------------------------------------------------------------------------------
+def runAsync(cmd, timeout=None, cwd=None) :
+    '''
+    asyncio version of run(), returns an awaitable which resolves
+    to the Result (only available on Python 3).
+    '''
+    if asyncio is None or futures is None :
+        raise RuntimeError('runAsync() requires asyncio')
+    return asyncio.wrap_future(submit(cmd, timeout, cwd))
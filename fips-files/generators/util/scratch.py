@@ -0,0 +1,72 @@
+'''
+Scratch directory for intermediate shader compiler files (GLSL input
+files, SPIR-V, per-language sources and JSON reflection).
+
+Where the intermediate files are placed is configured with the
+ORYOL_SHADER_SCRATCH environment variable:
+
+- 'tmp' (default): in a per-run temporary directory, on a tmpfs
+  (/dev/shm) if available
+- 'build': next to the generated files in the build directory
+- any other value: in a per-run temporary directory under this path
+
+With ORYOL_SHADER_KEEP_SCRATCH=1 the per-run directory is not
+deleted, and its location is printed at exit for debugging.
+'''
+import os, shutil, tempfile, atexit
+from mod import log
+
+Mode = os.environ.get('ORYOL_SHADER_SCRATCH', 'tmp')
+Keep = os.environ.get('ORYOL_SHADER_KEEP_SCRATCH') == '1'
+
+# the per-run scratch directory, created on demand
+runDir = None
+
+# number of library directories created in runDir
+numLibraries = 0
+
+#-------------------------------------------------------------------------------
+def getRunDir() :
+    global runDir
+    if runDir is None :
+        if Mode == 'tmp' :
+            root = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+        else :
+            root = Mode
+            if not os.path.isdir(root) :
+                os.makedirs(root)
+        runDir = tempfile.mkdtemp(prefix='oryol-shd-', dir=root)
+        atexit.register(cleanup)
+    return runDir
+
+#-------------------------------------------------------------------------------
+def basePath(out_hdr) :
+    '''
+    Return the base path for the intermediate files of a generated
+    header; in a scratch directory each library gets its own
+    subdirectory, since different libraries often have the same name.
+    '''
+    global numLibraries
+    if Mode == 'build' :
+        return os.path.splitext(out_hdr)[0]
+    numLibraries += 1
+    lib_dir = os.path.join(getRunDir(), str(numLibraries))
+    os.makedirs(lib_dir)
+    return os.path.join(lib_dir, os.path.splitext(os.path.basename(out_hdr))[0])
+
+#-------------------------------------------------------------------------------
+def release(base_path) :
+    '''
+    Delete the intermediate files of a library after code generation,
+    unless they are in the build directory or should be kept.
+    '''
+    if Mode != 'build' and not Keep :
+        shutil.rmtree(os.path.dirname(base_path), ignore_errors=True)
+
+#-------------------------------------------------------------------------------
+def cleanup() :
+    if runDir is not None :
+        if Keep :
+            log.info('shader intermediate files kept in {}'.format(runDir))
+        else :
+            shutil.rmtree(runDir, ignore_errors=True)
@@ -1,41 +1,39 @@
 '''
 wrapper-script for the oryol-shdc tool (wrapper around SPIRV-Cross)
 '''
-import subprocess, platform, os, sys
+import os, sys
 import genutil as util
+from util import runner, toolregistry, diagnostics
 
 #-------------------------------------------------------------------------------
 def getToolPath() :
-    path = os.path.dirname(os.path.abspath(__file__))
-    if platform.system() == 'Windows' :
-        path += '/../../../tools/win32/'
-    elif platform.system() == 'Darwin' :
-        path += '/../../../tools/osx/'
-    elif platform.system() == 'Linux' :
-        if os.uname()[1] == 'raspberrypi' :
-            path += '/../../../tools/raspi/'
-        else :
-            path +=  '/../../../tools/linux/'
-    else :
-        error("Unknown host system {}".format(platform.system()))
-    return path + 'oryol-shdc'
+    return toolregistry.getPath('oryol-shdc')
 
 #-------------------------------------------------------------------------------
-def run(cmd):
-    child = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-    out = ''
-    while True :
-        out += bytes.decode(child.stderr.read())
-        if child.poll() != None :
-            break
-    for line in out.splitlines():
-        util.fmtError(line, False)
-    if child.returncode != 0:
-        exit(child.returncode)
+def parseErrors(res, input):
+    '''
+    Returns the errors and warnings of an oryol-shdc run as two lists
+    of (srcPath, srcLineNr, msg) tuples. oryol-shdc doesn't report source
+    locations, so all messages are located at the start of the input file.
+    Messages are errors if the tool failed, otherwise warnings.
+    '''
+    if res.timedOut:
+        return [(input, 0, runner.timeoutMessage(res))], []
+    msgs = [(input, 0, line) for line in res.stderr.splitlines()]
+    if res.returncode == 0:
+        return [], msgs
+    if not msgs:
+        msgs.append((input, 0, "'{}' failed with exit code {}".format(os.path.basename(res.cmd[0]), res.returncode)))
+    return msgs, []
 
 #-------------------------------------------------------------------------------
-def compile(input, base_path, slangs):
-    util.setErrorLocation(input, 0)
+def compileErrors(input, base_path, slangs):
+    '''
+    Translate the SPIR-V of a shader stage to all shader languages,
+    returns the errors and warnings (see parseErrors()), stops at the
+    first failing shader language.
+    '''
+    warnings = []
     for slang in slangs:
         if 'glsl' in slang:
             src_slang = 'glsl'
@@ -45,4 +43,14 @@ def compile(input, base_path, slangs):
         dst_path = '{}.{}'.format(base_path, slang)
         tool = getToolPath()
         cmd = [tool, '-spirv', src_path, '-o', dst_path, '-lang', slang]
-        run(cmd)
\ No newline at end of file
+        errors, slang_warnings = parseErrors(runner.run(cmd), input)
+        warnings.extend(slang_warnings)
+        if errors:
+            return errors, warnings
+    return [], warnings
+
+#-------------------------------------------------------------------------------
+def compile(input, base_path, slangs):
+    errors, warnings = compileErrors(input, base_path, slangs)
+    if diagnostics.report(errors, warnings, []):
+        sys.exit(10)
@@ -0,0 +1,61 @@
+'''
+Helper functions to write size-report files for code generators.
+
+Each generator writes a small JSON file with the sizes of the
+embedded data next to its generated header, 'fips sizereport'
+aggregates these files across a build directory.
+'''
+import os, re, json
+
+#-------------------------------------------------------------------------------
+def reportPath(out_hdr) :
+    '''
+    Return the path of the size-report file for a generated header.
+    '''
+    return os.path.splitext(out_hdr)[0] + '.size.json'
+
+#-------------------------------------------------------------------------------
+def fileSize(path) :
+    '''
+    Return the size of a file in bytes, or 0 if the file doesn't exist.
+    '''
+    if os.path.isfile(path) :
+        return os.path.getsize(path)
+    else :
+        return 0
+
+#-------------------------------------------------------------------------------
+def hlslByteCodeSize(hdr_path) :
+    '''
+    Return the size of the bytecode in an FXC output header (written
+    with /Fh), which contains the bytecode as a C array initializer
+    'const BYTE <name>[] = { ... };'. The initializer is searched
+    explicitly, because the reflection comment in the '#if 0' block
+    at the top of the header contains braces too (e.g. '// cbuffer').
+    Returns 0 if the file doesn't exist or has no bytecode array.
+    '''
+    if not os.path.isfile(hdr_path) :
+        return 0
+    with open(hdr_path, 'r') as f :
+        data = f.read()
+    m = re.search(r'\bBYTE\s+\w+\s*\[\s*\]\s*=\s*\{([^}]*)\}', data)
+    if not m :
+        return 0
+    return len([item for item in m.group(1).split(',') if item.strip()])
+
+#-------------------------------------------------------------------------------
+def write(out_src, out_hdr, generator, version, report) :
+    '''
+    Write the size report for a generated source/header pair,
+    the sizes of the generated files are added to the report.
+    '''
+    report['generator'] = generator
+    report['version'] = version
+    report['library'] = os.path.splitext(os.path.basename(out_hdr))[0]
+    report['generated'] = {
+        'source': fileSize(out_src),
+        'header': fileSize(out_hdr)
+    }
+    with open(reportPath(out_hdr), 'w') as f :
+        json.dump(report, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
@@ -0,0 +1,67 @@
+'''
+Tests for the size-report helpers, run from fips-files/generators with:
+
+    python -m unittest util.test_sizereport
+'''
+import os, shutil, tempfile, unittest
+
+from util import sizereport
+
+# an FXC /Fh header of a shader with a constant buffer, the reflection
+# comment in the '#if 0' block contains braces too
+FxcHeader = '''#if 0
+//
+// Generated by Microsoft (R) HLSL Shader Compiler 10.1
+//
+//
+// Buffer Definitions:
+//
+// cbuffer vsParams
+// {
+//
+//   float4x4 mvp;                      // Offset:    0 Size:    64
+//
+// }
+//
+vs_5_0
+dcl_globalFlags refactoringAllowed
+ret
+// Approximately 6 instruction slots used
+#endif
+
+const BYTE vs_hlsl5[] =
+{
+     68,  88,  66,  67, 134,  35,
+    113, 228,   1,   0,   0,   0
+};
+'''
+
+#-------------------------------------------------------------------------------
+class TestHlslByteCodeSize(unittest.TestCase) :
+
+    def setUp(self) :
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self) :
+        shutil.rmtree(self.dir)
+
+    def writeHeader(self, data) :
+        path = os.path.join(self.dir, 'shader.hlsl.h')
+        with open(path, 'w') as f :
+            f.write(data)
+        return path
+
+    def testCBufferComment(self) :
+        path = self.writeHeader(FxcHeader)
+        self.assertEqual(sizereport.hlslByteCodeSize(path), 12)
+
+    def testNoByteCode(self) :
+        path = self.writeHeader('#if 0\n// cbuffer x\n// {\n// }\n#endif\n')
+        self.assertEqual(sizereport.hlslByteCodeSize(path), 0)
+
+    def testMissingFile(self) :
+        path = os.path.join(self.dir, 'missing.hlsl.h')
+        self.assertEqual(sizereport.hlslByteCodeSize(path), 0)
+
+if __name__ == '__main__' :
+    unittest.main()
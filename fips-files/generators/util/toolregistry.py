@@ -0,0 +1,95 @@
+'''
+Registry of the precompiled tools under oryol/tools.
+
+Tool paths are resolved once per process, and each tool binary has
+a fingerprint (a hash of its content) which can be used as cache key,
+so that caches are invalidated when a tool is upgraded.
+
+If the environment variable ORYOL_TOOLS_DIR is set, tools are
+looked up in this directory instead of oryol/tools/[host].
+'''
+import os, platform, hashlib
+
+ToolsDir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../tools'))
+
+hostDir = None
+paths = {}
+overrides = {}
+fileFingerprints = {}
+
+#-------------------------------------------------------------------------------
+def getHostDir() :
+    '''
+    Return the host-platform specific tool directory name.
+    '''
+    global hostDir
+    if hostDir is None :
+        if platform.system() == 'Windows' :
+            hostDir = 'win32'
+        elif platform.system() == 'Darwin' :
+            hostDir = 'osx'
+        elif platform.system() == 'Linux' :
+            if os.uname()[1] == 'raspberrypi' :
+                hostDir = 'raspi'
+            else :
+                hostDir = 'linux'
+        else :
+            raise RuntimeError("Unknown host system {}".format(platform.system()))
+    return hostDir
+
+#-------------------------------------------------------------------------------
+def getPath(name) :
+    '''
+    Return the path of a tool, e.g. getPath('glslangValidator').
+    '''
+    if name in overrides :
+        return overrides[name]
+    if name not in paths :
+        toolsDir = os.environ.get('ORYOL_TOOLS_DIR')
+        if toolsDir :
+            paths[name] = os.path.join(toolsDir, name)
+        else :
+            paths[name] = os.path.join(ToolsDir, getHostDir(), name)
+    return paths[name]
+
+#-------------------------------------------------------------------------------
+def override(name, path) :
+    '''
+    Use a different binary for a tool (e.g. a stub tool for testing),
+    a path of None removes the override.
+    '''
+    if path is None :
+        overrides.pop(name, None)
+    else :
+        overrides[name] = path
+
+#-------------------------------------------------------------------------------
+def fingerprintFile(path) :
+    '''
+    Return the (cached) SHA1 hex digest of a tool binary, the '.exe'
+    extension is optional on Windows. Returns None if the file doesn't exist.
+    '''
+    if not path :
+        return None
+    if path not in fileFingerprints :
+        fingerprint = None
+        for candidate in [path, path + '.exe'] :
+            if os.path.isfile(candidate) :
+                h = hashlib.sha1()
+                with open(candidate, 'rb') as f :
+                    while True :
+                        chunk = f.read(1<<16)
+                        if not chunk :
+                            break
+                        h.update(chunk)
+                fingerprint = h.hexdigest()
+                break
+        fileFingerprints[path] = fingerprint
+    return fileFingerprints[path]
+
+#-------------------------------------------------------------------------------
+def fingerprint(name) :
+    '''
+    Return the fingerprint of a tool by name.
+    '''
+    return fingerprintFile(getPath(name))
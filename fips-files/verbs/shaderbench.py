@@ -0,0 +1,294 @@
+"""fips verb to benchmark the shader code generator"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from mod import log
+
+try :
+    import tracemalloc
+except ImportError :
+    tracemalloc = None
+try :
+    import resource
+except ImportError :
+    resource = None
+
+# name of the baseline file in the project directory
+BaselineFile = 'shaderbench.json'
+
+# the external tools which are replaced by stubs from tools/stubs
+Tools = ['glslangValidator', 'oryol-shdc']
+
+Phases = ['parse', 'expand', 'compile', 'validate', 'emit']
+
+# default benchmark parameters
+Defaults = OrderedDict([
+    ('programs', 32),
+    ('includes', 4),
+    ('uniforms', 8),
+    ('runs', 3),
+    ('slang', 'GLSL'),
+    ('tools', 'both')
+])
+
+UniformTypes = ['mat4', 'vec4', 'vec2', 'float']
+
+#-------------------------------------------------------------------------------
+def import_shader_generator(fips_dir, proj_dir) :
+    """make the code generator modules importable and import the
+    shader generator
+    """
+    for path in [fips_dir + '/generators', proj_dir + '/fips-files/generators'] :
+        if path not in sys.path :
+            sys.path.insert(0, path)
+    import Shader
+    return Shader
+
+#-------------------------------------------------------------------------------
+def synthesize(path, num_programs, num_includes, max_uniforms) :
+    """write a shader library with num_programs programs, each shader
+    includes num_includes blocks, the number of vertex shader uniforms
+    varies between 1 and max_uniforms; returns the number of lines
+    """
+    lines = []
+    for i in range(num_includes) :
+        lines += [
+            '@block Util{}'.format(i),
+            'vec4 util{}(vec4 v) {{'.format(i),
+            '    return v * {}.0;'.format(i + 1),
+            '}',
+            '@end',
+            ''
+        ]
+    includes = ['@include Util{}'.format(i) for i in range(num_includes)]
+    for p in range(num_programs) :
+        num_uniforms = 1 + p % max(max_uniforms, 1)
+        members = ['    {} m{};'.format(UniformTypes[u % len(UniformTypes)], u) for u in range(num_uniforms)]
+        lines += ['@vs vs{}'.format(p)] + includes + ['uniform vsParams {'] + members + [
+            '};',
+            'in vec4 position;',
+            'in vec2 texcoord0;',
+            'out vec2 uv;',
+            'out vec4 color;',
+            'void main() {',
+            '    gl_Position = m0 * position;',
+            '    uv = texcoord0;',
+            '    color = vec4({}.0);'.format(p),
+            '}',
+            '@end',
+            ''
+        ]
+        lines += ['@fs fs{}'.format(p)] + includes + [
+            'uniform fsParams {',
+            '    vec4 tint;',
+            '};',
+            'uniform sampler2D tex;',
+            'in vec2 uv;',
+            'in vec4 color;',
+            'out vec4 fragColor;',
+            'void main() {',
+            '    fragColor = texture(tex, uv) * color * tint;',
+            '}',
+            '@end',
+            '',
+            '@program Prog{} vs{} fs{}'.format(p, p, p),
+            ''
+        ]
+    with open(path, 'w') as f :
+        f.write('\n'.join(lines))
+    return len(lines)
+
+#-------------------------------------------------------------------------------
+def generate(Shader, input, out_dir, args) :
+    """run the same steps as Shader.generateLibrary(), returns the
+    wall time of each phase in seconds
+    """
+    from util import scratch
+    slangs = Shader.slVersions[args['slang']]
+    out_src = os.path.join(out_dir, 'bench.cc')
+    out_hdr = os.path.join(out_dir, 'bench.h')
+    times = OrderedDict()
+    start = time.time()
+    lib = Shader.ShaderLibrary([input])
+    lib.parseSources()
+    times['parse'] = time.time() - start
+    start = time.time()
+    lib.generateShaderSources()
+    times['expand'] = time.time() - start
+    start = time.time()
+    lib.compile(input, out_hdr, slangs, args)
+    times['compile'] = time.time() - start
+    start = time.time()
+    lib.validate(slangs)
+    times['validate'] = time.time() - start
+    start = time.time()
+    Shader.generateSource(out_src, lib, slangs)
+    Shader.generateHeader(out_hdr, lib, slangs)
+    Shader.writeSizeReport(out_src, out_hdr, lib, slangs)
+    times['emit'] = time.time() - start
+    scratch.release(lib.basePath)
+    return times
+
+#-------------------------------------------------------------------------------
+def peak_memory(Shader, input, out_dir, args) :
+    """return the peak memory use of the generator in KBytes (without
+    the tool processes) and how it was measured
+    """
+    if tracemalloc is not None :
+        tracemalloc.start()
+        generate(Shader, input, out_dir, args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak // 1024, 'tracemalloc'
+    elif resource is not None :
+        # process-wide high water mark, in bytes on OSX, KBytes on Linux
+        generate(Shader, input, out_dir, args)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin' :
+            peak //= 1024
+        return peak, 'maxrss'
+    else :
+        return 0, 'none'
+
+#-------------------------------------------------------------------------------
+def bench(Shader, proj_dir, work_dir, params, tools) :
+    """run the benchmark with the 'stub' or 'real' tools, returns
+    the result dictionary, or None if the tools are not available
+    """
+    from util import toolregistry
+    for tool in Tools :
+        if tools == 'stub' :
+            toolregistry.override(tool, '{}/tools/stubs/{}'.format(proj_dir, tool))
+        else :
+            toolregistry.override(tool, None)
+        if toolregistry.fingerprint(tool) is None :
+            log.warn("tool '{}' not found, skipping benchmark with {} tools".format(toolregistry.getPath(tool), tools))
+            return None
+    input = os.path.join(work_dir, 'bench.glsl')
+    num_lines = synthesize(input, params['programs'], params['includes'], params['uniforms'])
+    args = { 'slang': params['slang'], 'debug': 'false' }
+    best = None
+    for i in range(params['runs']) :
+        times = generate(Shader, input, work_dir, args)
+        if best is None :
+            best = times
+        else :
+            for phase in Phases :
+                best[phase] = min(best[phase], times[phase])
+    total = sum(best.values())
+    peak, peak_source = peak_memory(Shader, input, work_dir, args)
+    return {
+        'tools': tools,
+        'params': params,
+        'version': Shader.Version,
+        'phases_ms': dict((phase, round(best[phase] * 1000.0, 2)) for phase in Phases),
+        'total_ms': round(total * 1000.0, 2),
+        'programs_per_sec': round(params['programs'] / total, 1),
+        'lines_per_sec': round(num_lines / total, 1),
+        'peak_memory_kb': peak,
+        'peak_memory_source': peak_source
+    }
+
+#-------------------------------------------------------------------------------
+def show(result, baseline=None) :
+    log.info(log.YELLOW + '=== {} tools: {} programs, {} includes, up to {} uniforms, best of {} runs'.format(
+        result['tools'], result['params']['programs'], result['params']['includes'],
+        result['params']['uniforms'], result['params']['runs']) + log.DEF)
+    rows = [(phase, result['phases_ms'][phase]) for phase in Phases] + [('total', result['total_ms'])]
+    for name, ms in rows :
+        line = '  {:<12} {:>10.2f} ms'.format(name, ms)
+        if baseline is not None :
+            old_ms = baseline['total_ms'] if name == 'total' else baseline['phases_ms'][name]
+            delta = ms - old_ms
+            color = log.RED if delta > 0 else log.GREEN
+            line += color + ' {:>+10.2f} ms'.format(delta) + log.DEF
+        log.info(line)
+    log.info('  {:.1f} programs/s, {:.1f} lines/s, peak memory {} KB ({})'.format(
+        result['programs_per_sec'], result['lines_per_sec'],
+        result['peak_memory_kb'], result['peak_memory_source']))
+
+#-------------------------------------------------------------------------------
+def load_baseline(proj_dir) :
+    path = '{}/{}'.format(proj_dir, BaselineFile)
+    if os.path.isfile(path) :
+        with open(path, 'r') as f :
+            return json.load(f)
+    else :
+        return {}
+
+#-------------------------------------------------------------------------------
+def parse_params(args) :
+    params = OrderedDict(Defaults)
+    while len(args) > 0 :
+        name = args[0][2:] if args[0].startswith('--') else None
+        if name not in params or len(args) < 2 :
+            log.error("invalid argument '{}', see 'fips help shaderbench'".format(args[0]))
+        value = args[1]
+        if isinstance(Defaults[name], int) :
+            try :
+                value = int(value)
+            except ValueError :
+                log.error("'--{}' expects a number".format(name))
+        params[name] = value
+        args = args[2:]
+    if params['tools'] not in ['stub', 'real', 'both'] :
+        log.error("'--tools' expects 'stub', 'real' or 'both'")
+    if params['programs'] < 1 or params['runs'] < 1 :
+        log.error("'--programs' and '--runs' must be at least 1")
+    return params
+
+#-------------------------------------------------------------------------------
+def run(fips_dir, proj_dir, args) :
+    cmd = 'run'
+    if len(args) > 0 and args[0] in ['run', 'save', 'diff'] :
+        cmd = args[0]
+        args = args[1:]
+    params = parse_params(args)
+    Shader = import_shader_generator(fips_dir, proj_dir)
+    if params['slang'] not in Shader.slVersions :
+        log.error("Invalid shader language '{}', expected one of {}".format(params['slang'], ', '.join(sorted(Shader.slVersions))))
+    baseline = load_baseline(proj_dir)
+    tools = ['stub', 'real'] if params['tools'] == 'both' else [params['tools']]
+    work_dir = tempfile.mkdtemp(prefix='oryol-shaderbench-')
+    try :
+        for t in tools :
+            result = bench(Shader, proj_dir, work_dir, dict(params, tools=t), t)
+            if result is None :
+                continue
+            if cmd == 'diff' :
+                if t not in baseline :
+                    log.warn("no benchmark baseline for {} tools, run 'fips shaderbench save' first".format(t))
+                elif baseline[t]['params'] != result['params'] :
+                    log.warn('benchmark parameters differ from the baseline')
+                show(result, baseline.get(t))
+            else :
+                show(result)
+            if cmd == 'save' :
+                baseline[t] = result
+    finally :
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if cmd == 'save' :
+        path = '{}/{}'.format(proj_dir, BaselineFile)
+        with open(path, 'w') as f :
+            json.dump(baseline, f, indent=2, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        log.colored(log.GREEN, 'Saved benchmark baseline to {}'.format(path))
+
+#-------------------------------------------------------------------------------
+def help() :
+    log.info(log.YELLOW +
+             'fips shaderbench [run|save|diff] [--programs N] [--includes M] [--uniforms U]\n' +
+             '                 [--runs R] [--slang GLSL|GLES] [--tools stub|real|both]\n' +
+             log.DEF +
+             '    benchmark the shader code generator with a synthesized shader library,\n' +
+             '    prints the wall time of each generator phase (best of R runs), the\n' +
+             '    throughput and the peak memory use; with the stub tools from\n' +
+             '    tools/stubs the compile phase measures the tool scheduling overhead\n' +
+             '    without the external compiler time; "save" stores the results as\n' +
+             '    baseline in {}, "diff" compares against the baseline'.format(BaselineFile))
@@ -0,0 +1,125 @@
+"""fips verb to check shader sources without generating code (for editor integration)"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+from mod import log
+
+# default shader language group (see slVersions in generators/Shader.py)
+DefaultSlang = 'GLSL'
+
+#-------------------------------------------------------------------------------
+def import_shader_generator(fips_dir, proj_dir) :
+    """make the code generator modules importable and import the
+    shader generator
+    """
+    for path in [fips_dir + '/generators', proj_dir + '/fips-files/generators'] :
+        if path not in sys.path :
+            sys.path.insert(0, path)
+    import Shader
+    return Shader
+
+#-------------------------------------------------------------------------------
+def check(Shader, work_dir, path, slang) :
+    """check a single shader source file, returns a JSON-serializable result"""
+    start = time.time()
+    path = os.path.abspath(path)
+    if os.path.isfile(path) :
+        try :
+            diags = Shader.check(path, { 'slang': slang }, work_dir)
+        except Exception as e :
+            # e.g. a shader compiler tool not found, don't take down the server
+            diags = [{
+                'file': path,
+                'line': 0,
+                'severity': 'error',
+                'message': 'shader check failed: {}'.format(e)
+            }]
+    else :
+        diags = [{
+            'file': path,
+            'line': 0,
+            'severity': 'error',
+            'message': 'file not found'
+        }]
+    return {
+        'file': path,
+        'slang': slang,
+        'diagnostics': diags,
+        'time_ms': int((time.time() - start) * 1000)
+    }
+
+#-------------------------------------------------------------------------------
+def serve(Shader, work_dir, slang) :
+    """read check requests from stdin and write results to stdout,
+    one JSON object per line; a request is either a plain path, or
+    a JSON object with a 'file' and an optional 'slang' key
+    """
+    while True :
+        line = sys.stdin.readline()
+        if not line :
+            break
+        line = line.strip()
+        if not line :
+            continue
+        result = None
+        if line.startswith('{') :
+            try :
+                req = json.loads(line)
+            except ValueError as e :
+                result = { 'error': 'invalid request: {}'.format(e) }
+            else :
+                if not (isinstance(req, dict) and 'file' in req) :
+                    result = { 'error': "invalid request: expected a JSON object with a 'file' key" }
+                else :
+                    path = req['file']
+                    req_slang = req.get('slang', slang)
+        else :
+            path = line
+            req_slang = slang
+        if result is None :
+            try :
+                result = check(Shader, work_dir, path, req_slang)
+            except Exception as e :
+                # a bad request must not take down the server
+                result = { 'file': path, 'error': 'check failed: {}'.format(e) }
+        sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+#-------------------------------------------------------------------------------
+def run(fips_dir, proj_dir, args) :
+    slang = DefaultSlang
+    if '--slang' in args :
+        index = args.index('--slang')
+        if index + 1 >= len(args) :
+            log.error("'--slang' expects an argument (GLSL, GLES, MSL or HLSL)")
+        slang = args[index + 1]
+        args = args[:index] + args[index+2:]
+    if len(args) == 0 :
+        log.error("Param 'serve' or shader source path(s) expected")
+    Shader = import_shader_generator(fips_dir, proj_dir)
+    if slang not in Shader.slVersions :
+        log.error("Invalid shader language '{}', expected one of {}".format(slang, ', '.join(sorted(Shader.slVersions))))
+    work_dir = tempfile.mkdtemp(prefix='oryol-shadercheck-')
+    try :
+        if args[0] == 'serve' :
+            serve(Shader, work_dir, slang)
+        else :
+            results = [check(Shader, work_dir, path, slang) for path in args]
+            print(json.dumps(results, indent=2, sort_keys=True, separators=(',', ': ')))
+    finally :
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+#-------------------------------------------------------------------------------
+def help() :
+    log.info(log.YELLOW +
+             'fips shadercheck [--slang GLSL|GLES|MSL|HLSL] [path.glsl ...]\n' +
+             'fips shadercheck [--slang GLSL|GLES|MSL|HLSL] serve\n' +
+             log.DEF +
+             '    check shader sources without generating code and print\n' +
+             '    diagnostics as JSON, in "serve" mode check requests are read\n' +
+             '    from stdin (one path or JSON object per line)')
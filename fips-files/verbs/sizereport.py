@@ -0,0 +1,138 @@
+"""fips verb to aggregate and compare generated code size reports"""
+
+import os
+import json
+
+from mod import log, util, settings
+
+# name of the baseline file in the project directory
+BaselineFile = 'sizereport.json'
+
+#-------------------------------------------------------------------------------
+def gather(fips_dir, proj_dir, cfg_name) :
+    """find all .size.json files in the build directory of a config,
+    returns a dictionary keyed by library path relative to the build dir
+    """
+    proj_name = util.get_project_name_from_dir(proj_dir)
+    build_dir = util.get_build_dir(fips_dir, proj_name, cfg_name)
+    if not os.path.isdir(build_dir) :
+        log.error("build directory '{}' not found, please build config '{}' first".format(build_dir, cfg_name))
+    libs = {}
+    for root, dirs, files in os.walk(build_dir) :
+        dirs.sort()
+        for name in sorted(files) :
+            if name.endswith('.size.json') :
+                path = os.path.join(root, name)
+                with open(path, 'r') as f :
+                    report = json.load(f)
+                lib_path = os.path.relpath(path, build_dir)[:-len('.size.json')]
+                libs[lib_path.replace('\\', '/')] = {
+                    'generator': report['generator'],
+                    'embedded': report['embedded'],
+                    'source': report['generated']['source'],
+                    'header': report['generated']['header']
+                }
+    return libs
+
+#-------------------------------------------------------------------------------
+def totals(libs) :
+    """sum up the sizes of all libraries by generator"""
+    result = {}
+    for lib in libs.values() :
+        t = result.setdefault(lib['generator'], { 'embedded': 0, 'source': 0, 'header': 0 })
+        for key in ['embedded', 'source', 'header'] :
+            t[key] += lib[key]
+    return result
+
+#-------------------------------------------------------------------------------
+def show(fips_dir, proj_dir, cfg_name) :
+    libs = gather(fips_dir, proj_dir, cfg_name)
+    log.info('{:<60} {:>12} {:>12} {:>12}'.format('library', 'embedded', '.cc', '.h'))
+    for name in sorted(libs) :
+        lib = libs[name]
+        log.info('{:<60} {:>12} {:>12} {:>12}'.format(name, lib['embedded'], lib['source'], lib['header']))
+    for gen, t in sorted(totals(libs).items()) :
+        log.info(log.YELLOW + '{:<60} {:>12} {:>12} {:>12}'.format('total ' + gen, t['embedded'], t['source'], t['header']) + log.DEF)
+
+#-------------------------------------------------------------------------------
+def load_baseline(proj_dir) :
+    path = '{}/{}'.format(proj_dir, BaselineFile)
+    if os.path.isfile(path) :
+        with open(path, 'r') as f :
+            return json.load(f)
+    else :
+        return {}
+
+#-------------------------------------------------------------------------------
+def save(fips_dir, proj_dir, cfg_name) :
+    baseline = load_baseline(proj_dir)
+    baseline[cfg_name] = gather(fips_dir, proj_dir, cfg_name)
+    path = '{}/{}'.format(proj_dir, BaselineFile)
+    with open(path, 'w') as f :
+        json.dump(baseline, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+    log.colored(log.GREEN, "Saved size baseline for config '{}' to {}".format(cfg_name, path))
+
+#-------------------------------------------------------------------------------
+def diff(fips_dir, proj_dir, cfg_name) :
+    baseline = load_baseline(proj_dir)
+    if cfg_name not in baseline :
+        log.error("no size baseline for config '{}', run 'fips sizereport save' first".format(cfg_name))
+    old_libs = baseline[cfg_name]
+    new_libs = gather(fips_dir, proj_dir, cfg_name)
+    empty = { 'embedded': 0, 'source': 0, 'header': 0 }
+    num_changed = 0
+    for name in sorted(set(old_libs) | set(new_libs)) :
+        old = old_libs.get(name, empty)
+        new = new_libs.get(name, empty)
+        if name not in old_libs :
+            state = 'added'
+        elif name not in new_libs :
+            state = 'removed'
+        else :
+            state = ''
+        if state or any(old[key] != new[key] for key in empty) :
+            num_changed += 1
+            log.info('{:<60} {:>+12} {:>+12} {:>+12} {}'.format(name,
+                new['embedded'] - old['embedded'],
+                new['source'] - old['source'],
+                new['header'] - old['header'],
+                state))
+    old_totals = totals(old_libs)
+    new_totals = totals(new_libs)
+    for gen in sorted(set(old_totals) | set(new_totals)) :
+        old = old_totals.get(gen, empty)
+        new = new_totals.get(gen, empty)
+        delta = new['embedded'] - old['embedded']
+        color = log.RED if delta > 0 else log.GREEN
+        log.info(color + '{:<60} {:>+12} {:>+12} {:>+12}'.format('total ' + gen,
+            delta, new['source'] - old['source'], new['header'] - old['header']) + log.DEF)
+    if num_changed == 0 :
+        log.colored(log.GREEN, 'No size changes.')
+
+#-------------------------------------------------------------------------------
+def run(fips_dir, proj_dir, args) :
+    cmd = 'show'
+    if len(args) > 0 and args[0] in ['show', 'save', 'diff'] :
+        cmd = args[0]
+        args = args[1:]
+    if len(args) > 0 :
+        cfg_name = args[0]
+    else :
+        cfg_name = settings.get(proj_dir, 'config')
+    if cmd == 'show' :
+        show(fips_dir, proj_dir, cfg_name)
+    elif cmd == 'save' :
+        save(fips_dir, proj_dir, cfg_name)
+    else :
+        diff(fips_dir, proj_dir, cfg_name)
+
+#-------------------------------------------------------------------------------
+def help() :
+    log.info(log.YELLOW +
+             'fips sizereport [config]\n' +
+             'fips sizereport save [config]\n' +
+             'fips sizereport diff [config]\n' +
+             log.DEF +
+             '    show, save or compare the sizes of generated shader and sprite sheet code\n' +
+             '    (the baseline is stored in {} in the project directory)'.format(BaselineFile))
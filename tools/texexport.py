@@ -4,7 +4,8 @@ Oryol texture export functions
 '''
 import sys
 import os
-import platform
+import json
+import time
 import subprocess
 import tempfile
 
@@ -12,6 +13,14 @@ ProjectDirectory = os.path.dirname(os.path.abspath(__file__)) + '/..'
 TexSrcDirectory = ProjectDirectory + '/data'
 TexDstDirectory = ProjectDirectory + '/build/webpage'
 
+# the tool registry is shared with the code generators
+if ProjectDirectory + '/fips-files/generators' not in sys.path :
+    sys.path.insert(0, ProjectDirectory + '/fips-files/generators')
+from util import toolregistry, profiler
+
+# records which tool versions have exported the files in TexDstDirectory
+ToolStampFile = '.texexport-tools.json'
+
 # NOTE: PVRTexTools supports a lot more formats!
 PVRFormats = ['PVRTC1_2', 'PVRTC1_4', 'PVRTC1_2_RGB', 'PVRTC1_4_RGB', 'PVRTC2_2', 'PVRTC2_4']
 ETCFormats = ['ETC1', 'ETC2']
@@ -34,17 +43,18 @@ def configure(projDir, texSrcDir, texDstDir) :
     TexDstDirectory = texDstDir
 
 #-------------------------------------------------------------------------------
-def getToolsBinPath() :
-    path = os.path.dirname(os.path.abspath(__file__))
-    if platform.system() == 'Windows' :
-        path += '/win32/'
-    elif platform.system() == 'Darwin' :
-        path += '/osx/'
-    elif platform.system() == 'Linux' :
-        path +=  '/linux/'
-    else :
-        error("Unknown host system {}".format(platform.system()))
-    return path;
+def getToolPath(name) :
+    return toolregistry.getPath(name)
+
+#-------------------------------------------------------------------------------
+def call(cmdLine) :
+    start = time.time()
+    res = subprocess.call(args=cmdLine)
+    profiler.event(os.path.basename(cmdLine[0]), 'tool', start, time.time(), {
+        'cmd': ' '.join(cmdLine),
+        'returncode': res
+    })
+    return res
 
 #-------------------------------------------------------------------------------
 def ensureDstDirectory() :
@@ -52,11 +62,62 @@ def ensureDstDirectory() :
         os.makedirs(TexDstDirectory)
 
 #-------------------------------------------------------------------------------
-def needsExport(srcPath, dstPath) :
+def toolFingerprint(tools) :
+    return ','.join(str(toolregistry.fingerprint(tool)) for tool in tools)
+
+#-------------------------------------------------------------------------------
+def loadToolStamps(dstDir) :
+    path = dstDir + '/' + ToolStampFile
+    if os.path.isfile(path) :
+        try :
+            with open(path, 'r') as f :
+                return json.load(f)
+        except ValueError :
+            pass
+    return {}
+
+#-------------------------------------------------------------------------------
+def writeToolStamp(dstPath, tools) :
+    '''
+    Record the fingerprint of the tools which have exported a file,
+    or remove the record of the file if tools is None.
+    '''
+    dstDir, dstFilename = os.path.split(dstPath)
+    stamps = loadToolStamps(dstDir)
+    if tools is None :
+        stamps.pop(dstFilename, None)
+    else :
+        stamps[dstFilename] = toolFingerprint(tools)
+    with open(dstDir + '/' + ToolStampFile, 'w') as f :
+        json.dump(stamps, f, indent=2, sort_keys=True, separators=(',', ': '))
+
+#-------------------------------------------------------------------------------
+def finishExport(dstPath, tools, res) :
+    '''
+    Record the result of a tool run which exported a file (or of the
+    first failed run of a multi-step export): the tool fingerprint if
+    the run succeeded (res is 0), otherwise print the failure and remove
+    the file's record, so that it is exported again next time.
+    '''
+    if res == 0 :
+        writeToolStamp(dstPath, tools)
+        return
+    print("ERROR: exporting {} failed (exit code {})".format(dstPath, res))
+    writeToolStamp(dstPath, None)
+
+#-------------------------------------------------------------------------------
+def needsExport(srcPath, dstPath, tools=[]) :
+    '''
+    Check if a file must be exported, either because the source
+    file is newer, or because it was exported with different tools.
+    '''
     if not os.path.isfile(dstPath) :
         return True
     if os.stat(srcPath).st_mtime >= os.stat(dstPath).st_mtime :
         return True
+    dstDir, dstFilename = os.path.split(dstPath)
+    if loadToolStamps(dstDir).get(dstFilename) != toolFingerprint(tools) :
+        return True
     return False
 
 #-------------------------------------------------------------------------------
@@ -65,11 +126,11 @@ def toDDS(srcFilename, dstFilename, linearGamma, fmt, rgbFmt=None) :
     Convert a file to DDS format
     '''
     ensureDstDirectory()
-    ddsTool = getToolsBinPath() + 'nvcompress'
+    ddsTool = getToolPath('nvcompress')
     srcPath = TexSrcDirectory + '/' + srcFilename
     dstPath = TexDstDirectory + '/' + dstFilename
     print('=== toDDS: {} => {}:'.format(srcPath, dstPath))
-    if not needsExport(srcPath, dstPath) :
+    if not needsExport(srcPath, dstPath, ['nvcompress']) :
         return
     cmdLine = [ddsTool, '-'+fmt]
     if rgbFmt != None :
@@ -79,7 +140,7 @@ def toDDS(srcFilename, dstFilename, linearGamma, fmt, rgbFmt=None) :
         cmdLine.append('-tolineargamma')
     cmdLine.append(srcPath)
     cmdLine.append(dstPath)
-    subprocess.call(args=cmdLine)
+    finishExport(dstPath, ['nvcompress'], call(cmdLine))
 
 #-------------------------------------------------------------------------------
 def toCubeDDS(srcDir, srcExt, dstFilename, linearGamma, fmt, rgbFmt=None) :
@@ -87,8 +148,8 @@ def toCubeDDS(srcDir, srcExt, dstFilename, linearGamma, fmt, rgbFmt=None) :
     Generate a cube map and convert to dds.
     '''
     ensureDstDirectory()
-    nvassemble = getToolsBinPath() + 'nvassemble'
-    ddsTool = getToolsBinPath() + 'nvcompress'
+    nvassemble = getToolPath('nvassemble')
+    ddsTool = getToolPath('nvcompress')
     srcFiles = ['posx', 'negx', 'posy', 'negy', 'posz', 'negz']
     dstPath  = TexDstDirectory + '/' + dstFilename
 
@@ -99,13 +160,16 @@ def toCubeDDS(srcDir, srcExt, dstFilename, linearGamma, fmt, rgbFmt=None) :
     dirty = False
     for src in srcFiles :
         srcPath = TexSrcDirectory + '/' + srcDir + '/' + src + '.' + srcExt
-        dirty |= needsExport(srcPath, dstPath)
+        dirty |= needsExport(srcPath, dstPath, ['nvassemble', 'nvcompress'])
         cmdLine.append(srcPath)
     if not dirty :
         return
     cmdLine.append('-o')
     cmdLine.append(dstPath)
-    subprocess.call(args=cmdLine)
+    res = call(cmdLine)
+    if res != 0 :
+        finishExport(dstPath, ['nvassemble', 'nvcompress'], res)
+        return
 
     # ...and compress/convert to the desired format
     cmdLine = [ddsTool, '-'+fmt]
@@ -116,7 +180,7 @@ def toCubeDDS(srcDir, srcExt, dstFilename, linearGamma, fmt, rgbFmt=None) :
         cmdLine.append('-tolineargamma')        
     cmdLine.append(dstPath)
     cmdLine.append(dstPath)
-    subprocess.call(args=cmdLine)
+    finishExport(dstPath, ['nvassemble', 'nvcompress'], call(cmdLine))
 
 #-------------------------------------------------------------------------------
 def toPVR(srcFilename, dstFilename, format) :
@@ -127,14 +191,14 @@ def toPVR(srcFilename, dstFilename, format) :
         error('invalid PVR texture format {}!'.format(format))
 
     ensureDstDirectory()
-    pvrTool = getToolsBinPath() + 'PVRTexToolCLI'
+    pvrTool = getToolPath('PVRTexToolCLI')
     srcPath = TexSrcDirectory + '/' + srcFilename
     dstPath = TexDstDirectory + '/' + dstFilename
     print('=== toPVR: {} => {}:'.format(srcPath, dstPath))
-    if not needsExport(srcPath, dstPath) :
+    if not needsExport(srcPath, dstPath, ['PVRTexToolCLI']) :
         return
     cmdLine = [pvrTool, '-i', srcPath, '-o', dstPath, '-square', '+', '-pot', '+', '-m', '-mfilter', 'cubic', '-f', format ]
-    subprocess.call(args=cmdLine)
+    finishExport(dstPath, ['PVRTexToolCLI'], call(cmdLine))
 
 #-------------------------------------------------------------------------------
 def toCubePVR(srcDir, srcExt, dstFilename, format) :
@@ -145,7 +209,7 @@ def toCubePVR(srcDir, srcExt, dstFilename, format) :
         error('invalid PVR texture format {}!'.format(format))
 
     ensureDstDirectory()
-    pvrTool = getToolsBinPath() + 'PVRTexToolCLI'
+    pvrTool = getToolPath('PVRTexToolCLI')
     srcFiles = ['posx', 'negx', 'posy', 'negy', 'posz', 'negz']
     dstPath  = TexDstDirectory + '/' + dstFilename
 
@@ -156,7 +220,7 @@ def toCubePVR(srcDir, srcExt, dstFilename, format) :
     dirty = False
     for src in srcFiles :
         srcPath = TexSrcDirectory + '/' + srcDir + '/' + src + '.' + srcExt
-        dirty |= needsExport(srcPath, dstPath)
+        dirty |= needsExport(srcPath, dstPath, ['PVRTexToolCLI'])
         inputFiles += srcPath + ','
     if not dirty:
         return
@@ -170,7 +234,7 @@ def toCubePVR(srcDir, srcExt, dstFilename, format) :
     cmdLine.append('cubic')
     cmdLine.append('-f')
     cmdLine.append(format)
-    subprocess.call(args=cmdLine)
+    finishExport(dstPath, ['PVRTexToolCLI'], call(cmdLine))
 
 #-------------------------------------------------------------------------------
 def toETC(srcFilename, dstFilename, format) :
@@ -185,72 +249,81 @@ def toETC(srcFilename, dstFilename, format) :
     tmpFilename, ext = os.path.splitext(dstFilename)
     tmpFilename += '.ppm'
 
-    convTool = getToolsBinPath() + 'convert'
-    etcTool  = getToolsBinPath() + 'etcpack'
+    convTool = getToolPath('convert')
+    etcTool  = getToolPath('etcpack')
     srcPath  = TexSrcDirectory + '/' + srcFilename
     dstPath  = TexDstDirectory + '/' + dstFilename
     tmpPath  = tempfile.gettempdir() + '/' + tmpFilename
     print('=== toETC2: {} => {} => {}:'.format(srcPath, tmpPath, dstPath))
 
-    if not needsExport(srcPath, dstPath) :
+    if not needsExport(srcPath, dstPath, ['convert', 'etcpack']) :
         return
 
     # first convert file to PPM format
-    subprocess.call(args=[convTool, srcPath, tmpPath])
+    res = call([convTool, srcPath, tmpPath])
+    if res != 0 :
+        if os.path.isfile(tmpPath) :
+            os.unlink(tmpPath)
+        finishExport(dstPath, ['convert', 'etcpack'], res)
+        return
     cmd = [etcTool, tmpPath, TexDstDirectory, '-mipmaps', '-ktx', '-c']
     if format == 'etc1' :
         cmd.append('etc1')
     else :
         cmd.append('etc2')
-    subprocess.call(args=cmd)
+    res = call(cmd)
     os.unlink(tmpPath)
+    finishExport(dstPath, ['convert', 'etcpack'], res)
 
 #-------------------------------------------------------------------------------
 def exportSampleTextures(types = ['dds','pvr','etc']) :
     # DDS
     if 'dds' in types :
-        # default gamma 2.2
-        toDDS('lok256.jpg', 'lok_dxt1.dds', False, 'bc1')
-        toDDS('lok256.jpg', 'lok_dxt3.dds', False, 'bc2')
-        toDDS('lok256.jpg', 'lok_dxt5.dds', False, 'bc3')
-        toDDS('lok256.jpg', 'lok_bgra8.dds', False, 'rgb', 'bgra8')
-        toDDS('lok256.jpg', 'lok_rgba8.dds', False, 'rgb', 'rgba8')
-        toDDS('lok256.jpg', 'lok_bgr8.dds', False, 'rgb', 'bgr8')
-        toDDS('lok256.jpg', 'lok_rgb8.dds', False, 'rgb', 'rgb8')
-        toDDS('lok256.jpg', 'lok_argb4.dds', False, 'rgb', 'argb4')
-        toDDS('lok256.jpg', 'lok_abgr4.dds', False, 'rgb', 'abgr4')
-        toDDS('lok256.jpg', 'lok_rgb565.dds', False, 'rgb', 'rgb565')
-        toDDS('lok256.jpg', 'lok_bgr565.dds', False, 'rgb', 'bgr565')
-        toDDS('lok256.jpg', 'lok_argb1555.dds', False, 'rgb', 'argb1555')
-        toDDS('lok256.jpg', 'lok_abgr1555.dds', False, 'rgb', 'abgr1555')
-        toCubeDDS('RomeChurch', 'jpg', 'romechurch_dxt1.dds', False, 'bc1')
-
-        # linear gamma
-        toDDS('lok256.jpg', 'lok_linear_dxt1.dds', True, 'bc1')
-        toDDS('lok256.jpg', 'lok_linear_dxt3.dds', True, 'bc2')
-        toDDS('lok256.jpg', 'lok_linear_dxt5.dds', True, 'bc3')
-        toDDS('lok256.jpg', 'lok_linear_bgra8.dds', True, 'rgb', 'bgra8')
-        toDDS('lok256.jpg', 'lok_linear_rgba8.dds', True, 'rgb', 'rgba8')
-        toDDS('lok256.jpg', 'lok_linear_bgr8.dds', True, 'rgb', 'bgr8')
-        toDDS('lok256.jpg', 'lok_linear_rgb8.dds', True, 'rgb', 'rgb8')
-        toDDS('lok256.jpg', 'lok_linear_argb4.dds', True, 'rgb', 'argb4')
-        toDDS('lok256.jpg', 'lok_linear_abgr4.dds', True, 'rgb', 'abgr4')
-        toDDS('lok256.jpg', 'lok_linear_rgb565.dds', True, 'rgb', 'rgb565')
-        toDDS('lok256.jpg', 'lok_linear_bgr565.dds', True, 'rgb', 'bgr565')
-        toDDS('lok256.jpg', 'lok_linear_argb1555.dds', True, 'rgb', 'argb1555')
-        toDDS('lok256.jpg', 'lok_linear_abgr1555.dds', True, 'rgb', 'abgr1555')
-        toCubeDDS('RomeChurch', 'jpg', 'romechurch_linear_dxt1.dds', True, 'bc1')
+        with profiler.scope('export dds') :
+            # default gamma 2.2
+            toDDS('lok256.jpg', 'lok_dxt1.dds', False, 'bc1')
+            toDDS('lok256.jpg', 'lok_dxt3.dds', False, 'bc2')
+            toDDS('lok256.jpg', 'lok_dxt5.dds', False, 'bc3')
+            toDDS('lok256.jpg', 'lok_bgra8.dds', False, 'rgb', 'bgra8')
+            toDDS('lok256.jpg', 'lok_rgba8.dds', False, 'rgb', 'rgba8')
+            toDDS('lok256.jpg', 'lok_bgr8.dds', False, 'rgb', 'bgr8')
+            toDDS('lok256.jpg', 'lok_rgb8.dds', False, 'rgb', 'rgb8')
+            toDDS('lok256.jpg', 'lok_argb4.dds', False, 'rgb', 'argb4')
+            toDDS('lok256.jpg', 'lok_abgr4.dds', False, 'rgb', 'abgr4')
+            toDDS('lok256.jpg', 'lok_rgb565.dds', False, 'rgb', 'rgb565')
+            toDDS('lok256.jpg', 'lok_bgr565.dds', False, 'rgb', 'bgr565')
+            toDDS('lok256.jpg', 'lok_argb1555.dds', False, 'rgb', 'argb1555')
+            toDDS('lok256.jpg', 'lok_abgr1555.dds', False, 'rgb', 'abgr1555')
+            toCubeDDS('RomeChurch', 'jpg', 'romechurch_dxt1.dds', False, 'bc1')
+
+            # linear gamma
+            toDDS('lok256.jpg', 'lok_linear_dxt1.dds', True, 'bc1')
+            toDDS('lok256.jpg', 'lok_linear_dxt3.dds', True, 'bc2')
+            toDDS('lok256.jpg', 'lok_linear_dxt5.dds', True, 'bc3')
+            toDDS('lok256.jpg', 'lok_linear_bgra8.dds', True, 'rgb', 'bgra8')
+            toDDS('lok256.jpg', 'lok_linear_rgba8.dds', True, 'rgb', 'rgba8')
+            toDDS('lok256.jpg', 'lok_linear_bgr8.dds', True, 'rgb', 'bgr8')
+            toDDS('lok256.jpg', 'lok_linear_rgb8.dds', True, 'rgb', 'rgb8')
+            toDDS('lok256.jpg', 'lok_linear_argb4.dds', True, 'rgb', 'argb4')
+            toDDS('lok256.jpg', 'lok_linear_abgr4.dds', True, 'rgb', 'abgr4')
+            toDDS('lok256.jpg', 'lok_linear_rgb565.dds', True, 'rgb', 'rgb565')
+            toDDS('lok256.jpg', 'lok_linear_bgr565.dds', True, 'rgb', 'bgr565')
+            toDDS('lok256.jpg', 'lok_linear_argb1555.dds', True, 'rgb', 'argb1555')
+            toDDS('lok256.jpg', 'lok_linear_abgr1555.dds', True, 'rgb', 'abgr1555')
+            toCubeDDS('RomeChurch', 'jpg', 'romechurch_linear_dxt1.dds', True, 'bc1')
 
     # PVR
     if 'pvr' in types :
-        toPVR('lok256.jpg', 'lok_bpp2.pvr', 'PVRTC1_2')
-        toPVR('lok256.jpg', 'lok_bpp4.pvr', 'PVRTC1_4')
-        toCubePVR('RomeChurch', 'jpg', 'romechurch_bpp2.pvr', 'PVRTC1_2')
+        with profiler.scope('export pvr') :
+            toPVR('lok256.jpg', 'lok_bpp2.pvr', 'PVRTC1_2')
+            toPVR('lok256.jpg', 'lok_bpp4.pvr', 'PVRTC1_4')
+            toCubePVR('RomeChurch', 'jpg', 'romechurch_bpp2.pvr', 'PVRTC1_2')
 
     # ETC1/2
     if 'etc' in types :
-        toETC('lok256.jpg', 'lok_etc1.ktx', 'ETC1')
-        toETC('lok256.jpg', 'lok_etc2.ktx', 'ETC2')
+        with profiler.scope('export etc') :
+            toETC('lok256.jpg', 'lok_etc1.ktx', 'ETC1')
+            toETC('lok256.jpg', 'lok_etc2.ktx', 'ETC2')
 
 #-------------------------------------------------------------------------------
 if __name__ == '__main__' :